@@ -0,0 +1,186 @@
+"""
+Drives every HTMX endpoint of the 'playlist_tracker' dashboard at a configurable concurrency and reports p50 / p95
+latency, queries per request, and the EXPLAIN plan of each endpoint's slowest query. Runs the views in-process through
+Django's test client, against whatever database the app's settings point at (ideally one filled by
+'generate_warehouse.py'), e.g. from inside the web container:
+
+    POSTGRES_DB=bench_dw python benchmarks/dashboard_benchmark.py --requests 200 --concurrency 8 --explain
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from urllib.parse import quote
+
+ROOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT_DIR)
+sys.path.insert(0, os.path.join(ROOT_DIR, "playlist_tracker"))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "playlist_tracker.settings")
+
+import django
+
+django.setup()
+
+from django.db import connection, connections
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+
+
+def sample_requests(samples):
+
+    """
+    Builds realistic request urls for every endpoint from a random sample of the warehouse's contents
+
+    :param samples: number of distinct parameter sets to draw for each endpoint
+    :return: dict of endpoint name => list of urls
+    """
+
+    with connection.cursor() as cursor:
+
+        cursor.execute("SELECT label_name FROM label_dim ORDER BY random() LIMIT %s", [samples])
+        labels = [row[0] for row in cursor.fetchall()]
+
+        cursor.execute("""SELECT tab.track_id, tab.artist_id, label_name
+                          FROM track_artist_bridge tab
+                          JOIN track_dim td ON td.track_id = tab.track_id
+                          ORDER BY random() LIMIT %s""", [samples])
+        track_artists = cursor.fetchall()
+
+        cursor.execute("""SELECT playlist_id, min(date), max(date)
+                          FROM track_playlist_fact tpf
+                          JOIN date_dim dd ON dd.date_id = tpf.date_id
+                          GROUP BY playlist_id
+                          ORDER BY random() LIMIT %s""", [samples])
+        playlists = cursor.fetchall()
+
+    return {
+        "releases/label-suggestions": [f"/releases/label-suggestions/?label_search={label[:3]}" for label in labels],
+        "releases/search": [f"/releases/search/?q={quote(label)}" for label in labels] +
+                           [f"/releases/search/?q=track+{track_id}&type=track" for track_id, artist_id, label in
+                            track_artists],
+        "releases/artists": [f"/releases/artists/?label_search={label}" for label in labels],
+        "releases/tracks": [f"/releases/tracks/?label_search={label}&artist_id={artist_id}"
+                            for track_id, artist_id, label in track_artists],
+        "releases/track-plot": [f"/releases/track-plot/?track_id={track_id}&artist_id={artist_id}"
+                                for track_id, artist_id, label in track_artists],
+        "releases/compare": ["/releases/compare/?" + "&".join(f"track_id={t}&artist_id={a}"
+                                                              for t, a, label in track_artists[:10])],
+        "placements": ["/placements/"],
+        "placements/start-date": [f"/placements/start-date/?playlist_id={p}" for p, start, end in playlists],
+        "placements/end-date": [f"/placements/end-date/?playlist_id={p}&start_date={start}"
+                                for p, start, end in playlists],
+        "placements/placement-display": [f"/placements/placement-display/?playlist_id={p}&start_date={start}"
+                                         f"&end_date={end}" for p, start, end in playlists],
+        "placements/label-share-display": ["/placements/label-share-display/"] +
+                                          [f"/placements/label-share-display/?label_search={quote(label)}"
+                                           for label in labels],
+        "rising": ["/rising/"],
+    }
+
+
+def timed_request(url):
+
+    """
+    Sends a single request through the test client, capturing the queries it ran
+
+    :return: (status code, seconds, list of captured queries)
+    """
+
+    client = Client(HTTP_HOST="localhost")
+
+    with ExitStack() as stack:
+        # the primary + the read database, if one is configured (see playlist_tracker/db_routing.py)
+        captures = [stack.enter_context(CaptureQueriesContext(db_connection)) for db_connection in connections.all()]
+        start = time.perf_counter()
+        response = client.get(url)
+        elapsed = time.perf_counter() - start
+
+    connections.close_all()  # each worker thread has its own connection => don't leak them between requests
+
+    return response.status_code, elapsed, [query for queries in captures for query in queries.captured_queries]
+
+
+def percentile(values, pct):
+
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+
+    return ordered[index]
+
+
+def run_benchmark(endpoints, total_requests, concurrency):
+
+    """
+    Sends 'total_requests' requests to every endpoint with 'concurrency' requests in flight at a time
+
+    :return: dict of endpoint name => summary stats
+    """
+
+    results = {}
+
+    for name, urls in endpoints.items():
+
+        if not urls:
+            continue
+
+        request_urls = [random.choice(urls) for _ in range(total_requests)]
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            responses = list(executor.map(timed_request, request_urls))
+
+        latencies = [elapsed for status, elapsed, queries in responses]
+        query_counts = [len(queries) for status, elapsed, queries in responses]
+        slowest_queries = defaultdict(float)
+        for status, elapsed, queries in responses:
+            for query in queries:
+                slowest_queries[query["sql"]] = max(slowest_queries[query["sql"]], float(query["time"]))
+
+        results[name] = {"requests": len(responses),
+                         "errors": sum(1 for status, elapsed, queries in responses if status >= 400),
+                         "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+                         "p95_ms": round(percentile(latencies, 95) * 1000, 1),
+                         "max_ms": round(max(latencies) * 1000, 1),
+                         "queries_per_request": round(statistics.mean(query_counts), 1),
+                         "slowest_query": max(slowest_queries, key=slowest_queries.get) if slowest_queries else None}
+
+    return results
+
+
+def explain(sql):
+
+    with connection.cursor() as cursor:
+        cursor.execute(f"EXPLAIN (ANALYZE, BUFFERS) {sql}")
+        return "\n".join(row[0] for row in cursor.fetchall())
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Load test the playlist_tracker dashboard endpoints")
+    parser.add_argument("--requests", type=int, default=100, help="requests sent to each endpoint")
+    parser.add_argument("--concurrency", type=int, default=4, help="requests in flight at a time")
+    parser.add_argument("--samples", type=int, default=20, help="distinct parameter sets drawn for each endpoint")
+    parser.add_argument("--with-cache", action="store_true", help="keep the partial cache on (off = cold requests)")
+    parser.add_argument("--explain", action="store_true", help="print the EXPLAIN plan of each slowest query")
+    args = parser.parse_args()
+
+    caches = None if args.with_cache else {"default": {"BACKEND": "django.core.cache.backends.dummy.DummyCache"}}
+
+    with override_settings(CACHES=caches) if caches else override_settings():
+        benchmark_endpoints = sample_requests(args.samples)
+        benchmark_results = run_benchmark(benchmark_endpoints, args.requests, args.concurrency)
+
+    print(f"\n{'endpoint':<32}{'requests':>9}{'errors':>8}{'p50 ms':>9}{'p95 ms':>9}{'max ms':>9}{'queries':>9}")
+    for endpoint, stats in benchmark_results.items():
+        print(f"{endpoint:<32}{stats['requests']:>9}{stats['errors']:>8}{stats['p50_ms']:>9}{stats['p95_ms']:>9}"
+              f"{stats['max_ms']:>9}{stats['queries_per_request']:>9}")
+
+    if args.explain:
+        for endpoint, stats in benchmark_results.items():
+            if stats["slowest_query"]:
+                print(f"\n=== {endpoint} - slowest query\n{stats['slowest_query']}\n")
+                print(explain(stats["slowest_query"]))
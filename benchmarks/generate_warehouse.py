@@ -0,0 +1,168 @@
+"""
+Fills a scratch data warehouse with synthetic data (N playlists x M weeks x K tracks per playlist) so the dashboard can
+be benchmarked at realistic sizes. All rows are generated inside postgres with generate_series, so even large
+warehouses only take a few statements to build.
+
+Uses the same POSTGRES_* environment variables as the web app, e.g. from inside the web container:
+
+    POSTGRES_DB=bench_dw python benchmarks/generate_warehouse.py --playlists 200 --weeks 104 --tracks 100 --reset
+"""
+
+import argparse
+import datetime
+import os
+import sys
+import time
+
+import psycopg2
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "plugins"))
+
+from dw_schema import (TABLE_DEFINITIONS, DW_TABLES, populate_date_dim, link_track_labels, refresh_search_index,
+                       build_label_share)
+
+# deterministic pseudo-random integer in [0, n) derived from a seed expression
+RAND = "((hashtext(({seed})::text) & 2147483647) %% {n})"
+
+
+def generate(cursor, playlists, weeks, tracks_per_playlist, labels, artists_per_track, churn):
+
+    """
+    Generates the synthetic dimensions + facts. Expects empty tables.
+
+    :param cursor: psycopg2 cursor
+    :param playlists: number of playlists
+    :param weeks: number of weekly snapshots
+    :param tracks_per_playlist: number of tracks on every playlist snapshot
+    :param labels: number of distinct labels
+    :param artists_per_track: number of artists credited on every track
+    :param churn: number of tracks replaced on each playlist every week
+    :return: dict with the number of rows added to each table
+    """
+
+    total_tracks = max(playlists * tracks_per_playlist // 2, tracks_per_playlist)
+    total_artists = max(total_tracks // 3, artists_per_track)
+    end_date = datetime.date.today()
+    start_date = end_date - datetime.timedelta(weeks=weeks - 1)
+    params = {"playlists": playlists, "tracks": total_tracks, "artists": total_artists, "labels": labels,
+              "artists_per_track": artists_per_track, "tracks_per_playlist": tracks_per_playlist, "churn": churn,
+              "start_date": start_date, "end_date": end_date,
+              "date_ids": [(start_date + datetime.timedelta(weeks=w)).strftime("%Y%m%d") for w in range(weeks)]}
+    row_counts = {}
+
+    statements = {
+        "date_dim": populate_date_dim,  # the same calendar the ETL pre-populates
+        "playlist_dim": """
+            INSERT INTO playlist_dim (playlist_id, playlist_spotify_id, playlist_name)
+            SELECT i, 'p' || lpad(i::text, 21, '0'), 'Synthetic Playlist ' || i
+            FROM generate_series(1, %(playlists)s) i
+        """,
+        "track_dim": f"""
+            INSERT INTO track_dim (track_id, track_spotify_id, track_name, track_duration_ms, track_isrc,
+                                   track_album_position, album_id, album_name, album_release_date, album_type,
+                                   album_total_tracks, album_upc, label_name)
+            SELECT i, 't' || lpad(i::text, 21, '0'), 'Synthetic Track ' || i,
+                   90000 + {RAND.format(seed='i', n=270000)},
+                   'US' || lpad(i::text, 10, '0'), 1 + i %% 12, 'b' || lpad((i / 4)::text, 21, '0'),
+                   'Synthetic Album ' || i / 4, date '2000-01-01' + {RAND.format(seed="'r' || i / 4", n=9000)},
+                   'album', 12, lpad((i / 4)::text, 12, '0'),
+                   'Label ' || {RAND.format(seed="'l' || i / 4", n='%(labels)s')} || ' Records'
+            FROM generate_series(1, %(tracks)s) i
+        """,
+        "label_dim": link_track_labels,
+        "artist_dim": """
+            INSERT INTO artist_dim (artist_id, artist_spotify_id, artist_name)
+            SELECT i, 'a' || lpad(i::text, 21, '0'), 'Synthetic Artist ' || i
+            FROM generate_series(1, %(artists)s) i
+        """,
+        "track_artist_bridge": """
+            INSERT INTO track_artist_bridge (track_id, artist_id)
+            SELECT t, 1 + (t * 7 + k * 13) %% %(artists)s
+            FROM generate_series(1, %(tracks)s) t
+            CROSS JOIN generate_series(0, %(artists_per_track)s - 1) k
+            ON CONFLICT DO NOTHING
+        """,
+        # popularity / followers drift a little every week so the charts + trends have something to show
+        "track_metrics_fact": f"""
+            INSERT INTO track_metrics_fact (track_id, date_id, track_popularity)
+            SELECT t, to_char(d, 'YYYYMMDD'),
+                   least(100, greatest(0, {RAND.format(seed='t', n=80)} + w * ({RAND.format(seed="'g' || t", n=5)} - 2)))
+            FROM generate_series(1, %(tracks)s) t
+            CROSS JOIN LATERAL (SELECT d::date AS d, (d::date - %(start_date)s::date) / 7 AS w
+                                FROM generate_series(%(start_date)s::date, %(end_date)s::date, interval '7 days') d) week
+        """,
+        "artist_metrics_fact": f"""
+            INSERT INTO artist_metrics_fact (artist_id, date_id, artist_popularity, artist_followers)
+            SELECT a, to_char(d, 'YYYYMMDD'),
+                   least(100, greatest(0, {RAND.format(seed='a', n=80)} + w * ({RAND.format(seed="'g' || a", n=3)} - 1))),
+                   {RAND.format(seed="'f' || a", n=1000000)} + w * {RAND.format(seed="'h' || a", n=5000)}
+            FROM generate_series(1, %(artists)s) a
+            CROSS JOIN LATERAL (SELECT d::date AS d, (d::date - %(start_date)s::date) / 7 AS w
+                                FROM generate_series(%(start_date)s::date, %(end_date)s::date, interval '7 days') d) week
+        """,
+        # each week 'churn' tracks rotate onto every playlist, the rest shift down a position
+        "track_playlist_fact": f"""
+            INSERT INTO track_playlist_fact (track_id, playlist_id, date_id, track_playlist_position, track_popularity)
+            SELECT t, p, to_char(d, 'YYYYMMDD'), pos,
+                   least(100, greatest(0, {RAND.format(seed='t', n=80)} + w * ({RAND.format(seed="'g' || t", n=5)} - 2)))
+            FROM generate_series(1, %(playlists)s) p
+            CROSS JOIN generate_series(1, %(tracks_per_playlist)s) pos
+            CROSS JOIN LATERAL (SELECT d::date AS d, (d::date - %(start_date)s::date) / 7 AS w
+                                FROM generate_series(%(start_date)s::date, %(end_date)s::date, interval '7 days') d) week
+            CROSS JOIN LATERAL (SELECT 1 + (p * %(tracks_per_playlist)s + pos + w * %(churn)s) %% %(tracks)s AS t) track
+        """,
+        "fact_snapshot": """
+            INSERT INTO fact_snapshot (date_id)
+            SELECT DISTINCT date_id FROM track_playlist_fact
+            ON CONFLICT DO NOTHING
+        """,
+        "search_index": refresh_search_index,
+        "label_share_weekly": build_label_share,
+    }
+
+    for table, statement in statements.items():
+        start = time.perf_counter()
+        cursor.execute(statement, params)
+        row_counts[table] = cursor.rowcount
+        print(f"{table:<22}{cursor.rowcount:>12,} rows {time.perf_counter() - start:>8.1f} s")
+
+    # explicit ids were used above => move the SERIAL sequences past them
+    for table, column in (("playlist_dim", "playlist_id"), ("track_dim", "track_id"), ("artist_dim", "artist_id")):
+        cursor.execute(f"SELECT setval(pg_get_serial_sequence('{table}', '{column}'), max({column})) FROM {table}")
+
+    return row_counts
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Fill a scratch data warehouse with synthetic data")
+    parser.add_argument("--playlists", type=int, default=50)
+    parser.add_argument("--weeks", type=int, default=52)
+    parser.add_argument("--tracks", type=int, default=100, help="tracks on each playlist snapshot")
+    parser.add_argument("--labels", type=int, default=500, help="number of distinct labels")
+    parser.add_argument("--artists-per-track", type=int, default=2)
+    parser.add_argument("--churn", type=int, default=10, help="tracks replaced on each playlist every week")
+    parser.add_argument("--reset", action="store_true", help="drop the dw tables first")
+    args = parser.parse_args()
+
+    connection = psycopg2.connect(dbname=os.getenv("POSTGRES_DB"),
+                                  user=os.getenv("POSTGRES_USER"),
+                                  password=os.getenv("POSTGRES_PASSWORD"),
+                                  host=os.getenv("POSTGRES_HOST", "postgres"),
+                                  port=os.getenv("POSTGRES_PORT", 5432))
+    connection.autocommit = True
+    cursor = connection.cursor()
+
+    if args.reset:
+        cursor.execute(f"DROP TABLE IF EXISTS {', '.join(DW_TABLES)} CASCADE")
+    for table_definition in TABLE_DEFINITIONS:
+        cursor.execute(table_definition)
+
+    cursor.execute("SELECT count(*) FROM track_dim")
+    if cursor.fetchone()[0]:
+        sys.exit("The dw already has data, rerun with --reset to replace it")
+
+    generate(cursor, args.playlists, args.weeks, args.tracks, args.labels, args.artists_per_track, args.churn)
+
+    cursor.execute("VACUUM ANALYZE")  # fresh statistics so EXPLAIN plans match a real warehouse
+    connection.close()
@@ -0,0 +1,256 @@
+"""
+Local stand-in for the parts of the Spotify Web API used by 'SpotifyAPI'. Serves a synthetic catalog of playlists,
+tracks, albums and artists at a configurable scale, with optional latency and throttling (429) so the ETL can be
+benchmarked without live credentials.
+
+Run it on its own with:
+
+    python benchmarks/mock_spotify.py --playlists 50 --tracks-per-playlist 100 --port 8765
+
+and point the ETL at it by setting SPOTIFY_ACCOUNTS_URL / SPOTIFY_API_URL to http://localhost:8765
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+PAGE_SIZE = 100  # Spotify's default page size for playlist items
+
+
+def make_id(prefix, number):
+
+    """
+    Builds a 22 character id, the same length as a real Spotify id
+    """
+
+    return f"{prefix}{number:021d}"
+
+
+class MockCatalog:
+
+    """
+    Deterministic synthetic catalog. Playlists draw their tracks from a shared pool so tracks overlap between
+    playlists, the way they do on real editorial playlists.
+    """
+
+    def __init__(self, playlists=20, tracks_per_playlist=100, artists_per_track=2, seed=0, null_track_rate=0.01):
+
+        rng = random.Random(seed)
+        total_tracks = max(playlists * tracks_per_playlist // 2, tracks_per_playlist)
+        total_albums = max(total_tracks // 4, 1)
+        total_artists = max(total_tracks // 3, artists_per_track)
+        total_labels = max(total_albums // 10, 1)
+
+        self.artists = {make_id("a", i): {"id": make_id("a", i),
+                                          "name": f"Artist {i}",
+                                          "popularity": rng.randint(0, 100),
+                                          "followers": {"total": rng.randint(0, 5_000_000)}}
+                        for i in range(total_artists)}
+        artist_ids = list(self.artists)
+
+        self.albums = {}
+        for i in range(total_albums):
+            release_year = rng.randint(1990, 2024)
+            self.albums[make_id("b", i)] = {"id": make_id("b", i),
+                                            "name": f"Album {i}",
+                                            "release_date": (str(release_year) if rng.random() < 0.1
+                                                             else f"{release_year}-{rng.randint(1, 12):02}-01"),
+                                            "album_type": rng.choice(["single", "album", "compilation"]),
+                                            "total_tracks": rng.randint(1, 20),
+                                            "label": f"Label {rng.randrange(total_labels)} Records",
+                                            "external_ids": {"upc": f"{rng.randrange(10 ** 12):012d}"}}
+        album_ids = list(self.albums)
+
+        self.tracks = {}
+        for i in range(total_tracks):
+            album = self.albums[rng.choice(album_ids)]
+            self.tracks[make_id("t", i)] = {"id": make_id("t", i),
+                                            "name": f"Track {i}",
+                                            "duration_ms": rng.randint(90_000, 360_000),
+                                            "external_ids": {"isrc": f"US{i:010d}"},
+                                            "track_number": rng.randint(1, album["total_tracks"]),
+                                            "popularity": rng.randint(0, 100),
+                                            "album": {key: album[key] for key in
+                                                      ("id", "name", "release_date", "album_type", "total_tracks")},
+                                            "artists": [{"id": artist_id, "name": self.artists[artist_id]["name"]}
+                                                        for artist_id in rng.sample(artist_ids, artists_per_track)]}
+        track_ids = list(self.tracks)
+
+        self.playlists = {}
+        for i in range(playlists):
+            items = [{"track": self.tracks[track_id]}
+                     for track_id in rng.sample(track_ids, min(tracks_per_playlist, len(track_ids)))]
+            for item in items:
+                if rng.random() < null_track_rate:
+                    item["track"] = None  # podcasts / removed tracks show up as null tracks
+            self.playlists[make_id("p", i)] = {"id": make_id("p", i), "name": f"Playlist {i}", "items": items}
+
+
+class MockSpotifyHandler(BaseHTTPRequestHandler):
+
+    catalog = None
+    latency = 0.0  # seconds added to every request
+    throttle_rate = 0.0  # share of requests that are answered with a 429
+    retry_after = 1  # value of the 'Retry-After' header sent with a 429
+    request_counts = Counter()
+    lock = threading.Lock()
+
+    def log_message(self, format, *args):
+        pass  # keep benchmark output readable
+
+    def send_json(self, payload, status=200, headers=None):
+
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def count(self, endpoint):
+
+        with self.lock:
+            self.request_counts[endpoint] += 1
+
+    def throttled(self, endpoint):
+
+        time.sleep(self.latency)
+
+        if self.throttle_rate and random.random() < self.throttle_rate:
+            self.count(f"{endpoint} (429)")
+            self.send_json({"error": {"status": 429, "message": "API rate limit exceeded"}},
+                           status=429, headers={"Retry-After": str(self.retry_after)})
+            return True
+
+        self.count(endpoint)
+        return False
+
+    def do_POST(self):
+
+        path = urlparse(self.path).path
+
+        if path == "/api/token":
+            self.count("token")
+            self.send_json({"access_token": "mock-token", "token_type": "Bearer", "expires_in": 3600})
+        elif path == "/stats/reset":
+            with self.lock:
+                self.request_counts.clear()
+            self.send_json({})
+        else:
+            self.send_json({"error": {"status": 404, "message": "Not found"}}, status=404)
+
+    def do_GET(self):
+
+        parsed = urlparse(self.path)
+        path = parsed.path.rstrip("/")
+        params = {key: values[0] for key, values in parse_qs(parsed.query).items()}
+        parts = path.split("/")
+
+        if path == "/stats":
+            with self.lock:
+                self.send_json(dict(self.request_counts))
+
+        elif path == "/v1/search":
+            if self.throttled("search"):
+                return
+            term = params.get("q", "").lower()
+            limit = int(params.get("limit", 20))
+            matches = [{"id": playlist["id"], "name": playlist["name"]} for playlist in self.catalog.playlists.values()
+                       if term in playlist["name"].lower()]
+            self.send_json({"playlists": {"items": matches[:limit], "total": len(matches)}})
+
+        elif len(parts) == 4 and parts[2] == "playlists":
+            if self.throttled("playlist"):
+                return
+            playlist = self.catalog.playlists.get(parts[3])
+            if playlist is None:
+                self.send_json({"error": {"status": 404, "message": "Resource not found"}}, status=404)
+                return
+            self.send_json({"id": playlist["id"], "name": playlist["name"]})
+
+        elif len(parts) == 5 and parts[2] == "playlists" and parts[4] == "tracks":
+            if self.throttled("playlist items"):
+                return
+            playlist = self.catalog.playlists.get(parts[3])
+            if playlist is None:
+                self.send_json({"error": {"status": 404, "message": "Resource not found"}}, status=404)
+                return
+            offset = int(params.get("offset", 0))
+            self.send_json({"items": playlist["items"][offset: offset + PAGE_SIZE],
+                            "offset": offset,
+                            "total": len(playlist["items"])})
+
+        elif path in ("/v1/albums", "/v1/tracks", "/v1/artists"):
+            id_type = parts[2]
+            if self.throttled(id_type):
+                return
+            lookup = {"albums": self.catalog.albums,
+                      "tracks": self.catalog.tracks,
+                      "artists": self.catalog.artists}[id_type]
+            ids = params.get("ids", "").split(",")
+            self.send_json({id_type: [lookup.get(i) for i in ids]})
+
+        else:
+            self.send_json({"error": {"status": 404, "message": "Not found"}}, status=404)
+
+
+def start_mock_server(catalog, port=0, latency=0.0, throttle_rate=0.0, retry_after=1):
+
+    """
+    Starts the mock API in a background thread
+
+    :param catalog: 'MockCatalog' to serve
+    :param port: port to listen on (0 picks a free port)
+    :param latency: seconds added to every request
+    :param throttle_rate: share of requests that are answered with a 429
+    :param retry_after: value of the 'Retry-After' header sent with a 429
+    :return: the running server + its base url
+    """
+
+    handler = type("ConfiguredMockSpotifyHandler", (MockSpotifyHandler,),
+                   {"catalog": catalog,
+                    "latency": latency,
+                    "throttle_rate": throttle_rate,
+                    "retry_after": retry_after,
+                    "request_counts": Counter()})
+
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def add_catalog_arguments(parser):
+
+    parser.add_argument("--playlists", type=int, default=20, help="number of synthetic playlists")
+    parser.add_argument("--tracks-per-playlist", type=int, default=100, help="number of tracks on each playlist")
+    parser.add_argument("--latency-ms", type=float, default=0, help="latency added to every API request")
+    parser.add_argument("--throttle-rate", type=float, default=0, help="share of API requests answered with a 429")
+    parser.add_argument("--retry-after", type=int, default=1, help="'Retry-After' seconds sent with a 429")
+    parser.add_argument("--seed", type=int, default=0, help="random seed used to build the catalog")
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Serve a synthetic Spotify Web API")
+    add_catalog_arguments(parser)
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    mock_catalog = MockCatalog(playlists=args.playlists, tracks_per_playlist=args.tracks_per_playlist, seed=args.seed)
+    mock_server, base_url = start_mock_server(mock_catalog, port=args.port, latency=args.latency_ms / 1000,
+                                              throttle_rate=args.throttle_rate, retry_after=args.retry_after)
+    print(f"Mock Spotify API listening on {base_url}")
+
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        mock_server.shutdown()
@@ -0,0 +1,191 @@
+"""
+Micro-benchmark of the decoding + normalisation of Spotify API payloads. Compares the original path
+(requests' 'response.json()' => the standard library decoder, followed by one list comprehension per column) with the
+single-pass normalisers of 'spot_payloads', using either decoder, in the calling process and in process pools of
+increasing size. No network or database involved: the payloads are the mock API's responses, serialised up front.
+
+    python benchmarks/parse_benchmark.py --playlists 200 --tracks-per-playlist 500 --processes 2 4
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+from mock_spotify import MockCatalog, PAGE_SIZE
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "plugins"))
+
+import spot_payloads
+from spot_payloads import PayloadParser, get_decoder, normalize_playlist_page, parse_playlist_page, normalize_albums
+
+
+def legacy_normalize_playlist_page(json_response, off):
+
+    """
+    The normalisation 'SpotifyAPI.get_all_playlist_items' used to run on every page
+    """
+
+    json_clean = [json_response['items'][i] for i in range(len(json_response['items'])) if
+                  json_response['items'][i]['track'] is not None]
+
+    track_ids = [i['track']['id'] for i in json_clean]
+    track_names = [i['track']['name'] for i in json_clean]
+    track_durations = [i['track']['duration_ms'] for i in json_clean]
+    track_isrcs = [i['track']['external_ids']['isrc'] for i in json_clean]
+    track_album_positions = [i['track']['track_number'] for i in json_clean]
+    album_ids = [i['track']['album']['id'] for i in json_clean]
+    album_names = [i['track']['album']['name'] for i in json_clean]
+    album_release_dates = [
+        i['track']['album']['release_date'] + '-01-01' if len(i['track']['album']['release_date']) == 4 else
+        i['track']['album']['release_date'] for i in json_clean]
+    album_types = [i['track']['album']['album_type'] for i in json_clean]
+    album_total_tracks = [i['track']['album']['total_tracks'] for i in json_clean]
+    track_data = list(zip(track_ids, track_names, track_durations, track_isrcs, track_album_positions,
+                          album_ids, album_names, album_release_dates, album_types, album_total_tracks))
+
+    track_playlist_data = [off + i + 1 for i in range(len(json_clean))]
+
+    artist_ids = [j['id'] for i in json_clean for j in i['track']['artists']]
+    artist_names = [j['name'] for i in json_clean for j in i['track']['artists']]
+    artist_data = list(zip(artist_ids, artist_names))
+
+    track_artist_data = [(track['track']['id'], artist['id']) for track in json_clean for
+                         artist in track['track']['artists']]
+
+    return track_data, artist_data, track_artist_data, track_playlist_data
+
+
+def legacy_normalize_albums(json_response):
+
+    """
+    The normalisation 'SpotifyAPI.organize_album_data' used to run on every batch of albums
+    """
+
+    albums_arr = json_response['albums']
+    total_albums = len(albums_arr)
+
+    album_upcs = [albums_arr[i]['external_ids']['upc'] for i in range(total_albums)]
+    album_labels = [albums_arr[i]['label'] for i in range(total_albums)]
+
+    return list(zip(album_upcs, album_labels))
+
+
+def build_payloads(catalog):
+
+    """
+    :return: raw playlist pages + their offsets, and raw album batches (20 ids each), as the mock API sends them
+    """
+
+    pages, offsets = [], []
+    for playlist in catalog.playlists.values():
+        for offset in range(0, len(playlist["items"]), PAGE_SIZE):
+            pages.append(json.dumps({"items": playlist["items"][offset: offset + PAGE_SIZE],
+                                     "offset": offset,
+                                     "total": len(playlist["items"])}).encode())
+            offsets.append(offset)
+
+    album_ids = list(catalog.albums)
+    album_batches = [json.dumps({"albums": [catalog.albums[i] for i in album_ids[start: start + 20]]}).encode()
+                     for start in range(0, len(album_ids), 20)]
+
+    return pages, offsets, album_batches
+
+
+def time_path(function, repeat):
+
+    """
+    :return: best wall time (seconds) of the function over 'repeat' runs + its result
+    """
+
+    best, result = float("inf"), None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        best = min(best, time.perf_counter() - start)
+
+    return best, result
+
+
+def run_benchmark(args):
+
+    catalog = MockCatalog(playlists=args.playlists, tracks_per_playlist=args.tracks_per_playlist, seed=args.seed)
+    pages, offsets, album_batches = build_payloads(catalog)
+    total_mb = sum(len(page) for page in pages) / 2 ** 20
+
+    decoders = {"json": get_decoder("json")}
+    if spot_payloads.orjson is not None:
+        decoders["orjson"] = get_decoder("orjson")
+
+    paths = {"legacy (json + per-column comprehensions)":
+             lambda: [legacy_normalize_playlist_page(json.loads(page), offset) for page, offset in zip(pages, offsets)]}
+    for name, decode in decoders.items():
+        paths[f"{name} + single pass"] = lambda decode=decode: [normalize_playlist_page(decode(page), offset)
+                                                                for page, offset in zip(pages, offsets)]
+
+    # the pool's workers use the default decoder (SPOTIFY_JSON_DECODER / the fastest one installed)
+    parsers = {processes: PayloadParser(processes=processes) for processes in args.processes}
+    for processes, parser in parsers.items():
+        parser.map(parse_playlist_page, pages[:processes], offsets[:processes])  # start the workers up front
+        paths[f"process pool x {processes}"] = lambda parser=parser: parser.map(parse_playlist_page, pages, offsets)
+
+    results = []
+    expected = None
+    for name, function in paths.items():
+        seconds, output = time_path(function, args.repeat)
+        expected = expected or output
+        if output != expected:
+            raise AssertionError(f"'{name}' returned different rows than the legacy path")
+        results.append({"path": name, "seconds": round(seconds, 4), "pages_per_second": round(len(pages) / seconds)})
+
+    for parser in parsers.values():
+        parser.close()
+
+    album_paths = {"legacy albums (json)":
+                   lambda: [legacy_normalize_albums(json.loads(batch)) for batch in album_batches],
+                   "single pass albums (default decoder)":
+                   lambda: [normalize_albums(spot_payloads.decode_json(batch)) for batch in album_batches]}
+
+    album_results = []
+    for name, function in album_paths.items():
+        seconds, _ = time_path(function, args.repeat)
+        album_results.append({"path": name, "seconds": round(seconds, 4),
+                              "batches_per_second": round(len(album_batches) / seconds)})
+
+    return {"pages": len(pages), "payload_mb": round(total_mb, 1), "album_batches": len(album_batches),
+            "pages_results": results, "album_results": album_results}
+
+
+def print_report(report):
+
+    print(f"\nParse benchmark - {report['pages']} playlist pages ({report['payload_mb']} MB), "
+          f"{report['album_batches']} album batches\n")
+    baseline = report["pages_results"][0]["seconds"]
+    print(f"{'path':<45}{'seconds':>10}{'pages/s':>10}{'speedup':>10}")
+    for result in report["pages_results"]:
+        print(f"{result['path']:<45}{result['seconds']:>10}{result['pages_per_second']:>10}"
+              f"{baseline / result['seconds']:>9.1f}x")
+    print()
+    for result in report["album_results"]:
+        print(f"{result['path']:<45}{result['seconds']:>10}{result['batches_per_second']:>10}")
+    print()
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Benchmark the decoding + normalisation of Spotify API payloads")
+    parser.add_argument("--playlists", type=int, default=100, help="number of synthetic playlists")
+    parser.add_argument("--tracks-per-playlist", type=int, default=500, help="number of tracks on each playlist")
+    parser.add_argument("--seed", type=int, default=0, help="random seed used to build the catalog")
+    parser.add_argument("--processes", type=int, nargs="*", default=[2, 4], help="process pool sizes to compare")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per path (the best one is reported)")
+    parser.add_argument("--json", help="also write the report to this file")
+    args = parser.parse_args()
+
+    report = run_benchmark(args)
+    print_report(report)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
@@ -0,0 +1,40 @@
+from datetime import timedelta
+import pendulum
+from spot_dw import PlaylistDW
+from airflow.decorators import dag, task
+
+default_args = {'owner': 'cs',
+                'retries': 1,
+                'retry_delay': timedelta(minutes=1)}
+
+
+@dag(dag_id='playlist_backfill_v1',
+     default_args=default_args,
+     start_date=pendulum.datetime(2024, 11, 8, tz="UTC"),
+     schedule_interval='*/5 * * * *',
+     max_active_runs=1,
+     catchup=False)  # check for newly tracked playlists every 5 minutes
+def playlist_backfill():
+
+    dw = PlaylistDW()  # instantiate class that connects to and updates the data warehouse
+
+    @task(on_success_callback=dw.save_metrics, on_failure_callback=dw.save_metrics)
+    def process_backfill_jobs():
+
+        dw.create_tables()  # make sure the job queue exists
+        dw.populate_date_dim()
+
+        # work through the queue until there are no pending jobs left
+        while True:
+
+            job = dw.claim_backfill_job()
+            if job is None:
+                break
+
+            job_id, playlist_spotify_id = job
+            dw.backfill_playlist(job_id, playlist_spotify_id)  # added to the latest weekly snapshot
+
+    process_backfill_jobs()
+
+
+plist_backfill = playlist_backfill()  # instantiate the DAG
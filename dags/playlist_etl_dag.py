@@ -1,6 +1,6 @@
 from datetime import timedelta
 import pendulum
-from spot_dw import PlaylistDW
+from spot_dw import PlaylistDW, get_run_date
 from airflow.decorators import dag, task
 
 default_args = {'owner': 'cs',
@@ -17,40 +17,74 @@ def playlist_etl():
 
     dw = PlaylistDW()  # instantiate class that connects to and updates the data warehouse
 
-    @task
+    # store each task's stage timings / API request counts / rows loaded, whether the task succeeds or fails
+    record_metrics = {'on_success_callback': dw.save_metrics, 'on_failure_callback': dw.save_metrics}
+
+    @task(**record_metrics)
     def get_tracked_playlists():
 
         dw.create_tables()  # set up the data warehouse if it hasn't already been created
+        dw.populate_date_dim()  # make sure the calendar covers this run
         playlist_id_query = """SELECT playlist_spotify_id FROM playlist_dim WHERE playlist_id != 1"""
         dw.cursor.execute(playlist_id_query)
         tracked_playlists = [plist_id[0] for plist_id in dw.cursor.fetchall()]
 
         return tracked_playlists
 
-    @task
-    def extract_playlist_data(playlist_list):
+    @task(**record_metrics)
+    def extract_playlist_data(playlist_list, data_interval_end=None, run_id=None):
+
+        dw.enable_checkpoints(run_id)  # a retry resumes after the last playlist extracted by the failed attempt
 
-        # collect, clean playlist data
-        track, artist, track_artist, track_playlist = dw.extract_playlists_data(playlist_list)
+        # collect, clean playlist data (raw responses are archived under the run date for replays)
+        track, artist, track_artist, track_playlist = dw.extract_playlists_data(playlist_list,
+                                                                                get_run_date(data_interval_end))
 
         return track, artist, track_artist, track_playlist
 
-    @task
-    def load_playlist_data(playlist_data):
+    @task(**record_metrics)
+    def load_playlist_data(playlist_data, data_interval_end=None, run_id=None):
 
         track_data, artist_data, track_artist_data, track_playlist_data = playlist_data
+        run_date = get_run_date(data_interval_end)
+        dw.enable_checkpoints(run_id)  # a retry reuses the id batches fetched by the failed attempt
+
+        dw.update_dimensions(track_data, artist_data, run_date)  # add new rows to the data warehouse's dimensions
+
+        # track metrics, artist metrics, new track / artist pairings + playlist placements
+        fact_data = dw.organize_facts(track_artist_data, track_playlist_data, run_date)
+
+        dw.update_fact_tables(*fact_data)
+
+        dw.refresh_search_index()  # index new / renamed tracks, artists, albums + labels for the dashboard's search
+
+        dw.update_playlist_movements(run_date)  # diff each playlist's new snapshot against its previous one
+
+        dw.update_label_share(run_date)  # roll the snapshot's placements up into each label's share of the week
+
+        dw.clear_checkpoints()  # the run's data is loaded => its checkpoints aren't needed anymore
+
+    @task(**record_metrics)
+    def compute_trends(data_interval_end=None):
+
+        dw.compute_trends(get_run_date(data_interval_end))  # rank the new snapshot's rising tracks + artists
+
+    @task(**record_metrics)
+    def export_fact_archive():
 
-        dw.update_dimensions(track_data, artist_data)  # add new rows to the data warehouse's dimensions
+        dw.export_fact_archive()  # append the new snapshot to the Parquet archive used for offline analysis
 
-        final_track_artist_data, final_track_playlist_data = dw.organize_facts(track_artist_data, track_playlist_data)
+    @task(**record_metrics)
+    def apply_retention(data_interval_end=None):
 
-        dw.update_fact_tables(final_track_artist_data, final_track_playlist_data)
+        # roll up + prune old snapshots, archive inactive tracks / artists
+        dw.apply_retention(get_run_date(data_interval_end))
 
     plist_list = get_tracked_playlists()
 
     plist_data = extract_playlist_data(playlist_list=plist_list)
 
-    load_playlist_data(playlist_data=plist_data)
+    load_playlist_data(playlist_data=plist_data) >> [compute_trends(), export_fact_archive()] >> apply_retention()
 
 
 plist_etl = playlist_etl()  # instantiate the DAG
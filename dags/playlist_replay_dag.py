@@ -0,0 +1,55 @@
+from datetime import timedelta
+import pendulum
+from spot_dw import PlaylistDW
+from raw_archive import RawResponseArchive
+from airflow.decorators import dag, task
+
+default_args = {'owner': 'cs',
+                'retries': 1,
+                'retry_delay': timedelta(minutes=1)}
+
+
+@dag(dag_id='playlist_replay_v1',
+     default_args=default_args,
+     start_date=pendulum.datetime(2024, 11, 8, tz="UTC"),
+     schedule_interval=None,
+     catchup=False,
+     params={'start_date': '2024-01-01', 'end_date': '2099-12-31'})  # triggered manually with a range of run dates
+def playlist_replay():
+
+    dw = PlaylistDW()  # instantiate class that connects to and updates the data warehouse
+
+    record_metrics = {'on_success_callback': dw.save_metrics, 'on_failure_callback': dw.save_metrics}
+
+    @task(**record_metrics)
+    def get_archived_dates(params=None):
+
+        dw.create_tables()
+        dw.populate_date_dim()
+        run_dates = [run_date for run_date in RawResponseArchive.archived_dates()
+                     if params['start_date'] <= run_date <= params['end_date']]
+
+        return run_dates
+
+    @task(max_active_tis_per_dagrun=4, **record_metrics)  # each date replays in its own task => in parallel
+    def replay_date(run_date):
+
+        dw.replay_date(run_date)  # rebuild the date's dims + facts from the archived API responses
+
+    @task(**record_metrics)
+    def rebuild_derived_tables(run_dates):
+
+        # movements + trends compare each snapshot with the previous one => recompute in date order
+        for run_date in sorted(run_dates):
+            dw.update_playlist_movements(run_date)
+            dw.compute_trends(run_date)
+            dw.update_label_share(run_date)
+
+        dw.refresh_search_index()
+
+    run_dates = get_archived_dates()
+
+    replay_date.expand(run_date=run_dates) >> rebuild_derived_tables(run_dates)
+
+
+plist_replay = playlist_replay()  # instantiate the DAG
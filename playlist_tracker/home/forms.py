@@ -0,0 +1,17 @@
+from django import forms
+
+
+class OnboardForm(forms.Form):
+
+    # one playlist id, url or name per line, typed in and / or uploaded as a text file
+    playlists = forms.CharField(widget=forms.Textarea, required=False)
+    playlist_file = forms.FileField(required=False)
+
+    def clean(self):
+
+        cleaned_data = super().clean()
+
+        if not cleaned_data.get("playlists") and not cleaned_data.get("playlist_file"):
+            raise forms.ValidationError("Enter some playlists or upload a file")
+
+        return cleaned_data
@@ -0,0 +1,32 @@
+import sys
+from collections import Counter
+from django.core.management.base import BaseCommand
+from home.onboarding import parse_playlist_inputs, onboard_playlists
+from home.views import get_spotify_client
+
+
+class Command(BaseCommand):
+
+    help = "Starts tracking the playlists listed in a file (one playlist id, Spotify link or name per line)"
+
+    def add_arguments(self, parser):
+
+        parser.add_argument("path", help="file listing the playlists ('-' reads from stdin)")
+        parser.add_argument("--workers", type=int, default=8, help="number of playlists resolved concurrently")
+
+    def handle(self, *args, **options):
+
+        if options["path"] == "-":
+            text = sys.stdin.read()
+        else:
+            with open(options["path"], encoding="utf-8") as f:
+                text = f.read()
+
+        report = onboard_playlists(get_spotify_client(), parse_playlist_inputs(text), max_workers=options["workers"])
+
+        for row in report:
+            self.stdout.write(f"{row['status']:<16}{row['playlist_spotify_id'] or '':<24}"
+                              f"{row['playlist_name'] or '':<42}{row['input']}")
+
+        summary = Counter(row['status'] for row in report)
+        self.stdout.write(self.style.SUCCESS(", ".join(f"{count} {status}" for status, count in summary.items())))
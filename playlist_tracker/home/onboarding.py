@@ -0,0 +1,184 @@
+"""
+Bulk onboarding of playlists (the 'onboard_playlists' command + the '/onboard-playlists/' page). Each input line can
+be a playlist id, a Spotify URL / URI or a playlist name. Ids are checked against 'playlist_dim' before anything is
+sent to Spotify, the rest are resolved concurrently (every thread shares the client's request rate budget), and all
+of the new playlists are inserted in one batch along with their backfill jobs.
+"""
+
+import logging
+import re
+from concurrent.futures import ThreadPoolExecutor
+from django.db import connection
+
+MAX_ITEMS = 500  # max number of playlists onboarded at once
+PLAYLIST_NAME_LENGTH = 40  # size of 'playlist_dim.playlist_name'
+
+# a bare id, an open.spotify.com url (with or without a locale / query string) or a spotify: uri
+PLAYLIST_ID_PATTERN = re.compile(r"^(?:https?://open\.spotify\.com/(?:[\w-]+/)?playlist/|spotify:playlist:)?"
+                                 r"([0-9A-Za-z]{22})(?:[/?#].*)?$")
+
+
+def parse_playlist_inputs(text):
+
+    """
+    :param text: one playlist id, url or name per line (blank lines and lines starting with '#' are ignored)
+    :return: list of the input lines
+    """
+
+    lines = (line.strip() for line in text.splitlines())
+
+    return [line for line in lines if line and not line.startswith("#")]
+
+
+def parse_playlist_id(item):
+
+    """
+    :return: the playlist's spotify id if the item is an id / url / uri, otherwise None (=> searched by name)
+    """
+
+    match = PLAYLIST_ID_PATTERN.match(item)
+
+    return match.group(1) if match else None
+
+
+def resolve_playlist(client, item):
+
+    """
+    Looks up a single input with the Spotify API
+
+    :param client: 'SpotifyAPI' client
+    :param item: a playlist id / url / uri / name
+    :return: (playlist spotify id, playlist name) tuple, or None if nothing was found
+    """
+
+    playlist_id = parse_playlist_id(item)
+
+    if playlist_id:
+        playlist = client.get_playlist(playlist_id)
+        return (playlist['id'], playlist['name']) if playlist else None
+
+    # a few results => prefer an exact name match over Spotify's top result
+    search_result = client.search_spotify(item, search_type="playlist", limit=5)
+    candidates = [playlist for playlist in (search_result or {}).get('playlists', {}).get('items', []) if playlist]
+    if not candidates:
+        return None
+
+    playlist = next((p for p in candidates if p['name'].lower() == item.lower()), candidates[0])
+
+    return playlist['id'], playlist['name']
+
+
+def tracked_playlist_ids(playlist_ids):
+
+    """
+    :return: the subset of the playlist ids that are already in 'playlist_dim'
+    """
+
+    if not playlist_ids:
+        return set()
+
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT playlist_spotify_id FROM playlist_dim WHERE playlist_spotify_id = ANY(%s::bpchar[])",
+                       [list(playlist_ids)])
+        return {row[0] for row in cursor.fetchall()}
+
+
+def save_playlists(playlists):
+
+    """
+    Adds playlists to 'playlist_dim' in one statement and queues a backfill job for each new one
+
+    :param playlists: list of (playlist spotify id, playlist name) tuples
+    :return: the spotify ids of the playlists that were added (the others were added concurrently by someone else)
+    """
+
+    if not playlists:
+        return set()
+
+    playlist_ids, playlist_names = zip(*playlists)
+
+    with connection.cursor() as cursor:
+        cursor.execute("""INSERT INTO playlist_dim (playlist_spotify_id, playlist_name)
+                          SELECT playlist_spotify_id, left(playlist_name, %s)
+                          FROM unnest(%s::text[], %s::text[]) AS p (playlist_spotify_id, playlist_name)
+                          ON CONFLICT (playlist_spotify_id) DO NOTHING
+                          RETURNING playlist_id, playlist_spotify_id""",
+                       [PLAYLIST_NAME_LENGTH, list(playlist_ids), list(playlist_names)])
+        new_playlists = cursor.fetchall()
+
+        # the partial unique index on in-flight jobs dedupes repeat requests for the same playlist
+        cursor.execute("""INSERT INTO playlist_backfill_job (playlist_id)
+                          SELECT unnest(%s::int[])
+                          ON CONFLICT DO NOTHING""",
+                       [[playlist[0] for playlist in new_playlists]])
+
+    return {playlist[1] for playlist in new_playlists}
+
+
+def onboard_playlists(client, items, max_workers=8):
+
+    """
+    Resolves + stores a list of playlists
+
+    :param client: 'SpotifyAPI' client (its rate limiter is shared by the worker threads)
+    :param items: playlist ids / urls / uris / names
+    :param max_workers: number of inputs resolved concurrently
+    :return: one dict per input => 'input', 'playlist_spotify_id', 'playlist_name' and 'status' ('added',
+    'already tracked', 'duplicate', 'not found', 'error' or 'skipped (limit)' for the inputs after the first MAX_ITEMS)
+    """
+
+    report = [{'input': item, 'playlist_spotify_id': parse_playlist_id(item), 'playlist_name': None, 'status': None}
+              for item in items]
+
+    # inputs past the limit are reported back so they can be resubmitted
+    for row in report[MAX_ITEMS:]:
+        row['status'] = 'skipped (limit)'
+    batch = report[:MAX_ITEMS]
+
+    # ids that are already tracked / listed more than once don't need a request
+    input_ids = {row['playlist_spotify_id'] for row in batch if row['playlist_spotify_id']}
+    already_tracked = tracked_playlist_ids(input_ids)
+    seen_ids = set()
+    for row in batch:
+        if row['playlist_spotify_id'] in already_tracked:
+            row['status'] = 'already tracked'
+        elif row['playlist_spotify_id'] in seen_ids:
+            row['status'] = 'duplicate'
+        elif row['playlist_spotify_id']:
+            seen_ids.add(row['playlist_spotify_id'])
+
+    def resolve(row):
+        try:
+            return resolve_playlist(client, row['input'])
+        except Exception:
+            logging.exception(f"Could not resolve playlist '{row['input']}'")
+            return 'error'
+
+    pending = [row for row in batch if row['status'] is None]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for row, result in zip(pending, executor.map(resolve, pending)):
+            if result == 'error':
+                row['status'] = 'error'
+            elif result is None:
+                row['status'] = 'not found'
+            else:
+                row['playlist_spotify_id'], row['playlist_name'] = result
+
+    # names resolved to playlists that are tracked already / listed more than once
+    resolved = [row for row in batch if row['status'] is None]
+    already_tracked |= tracked_playlist_ids({row['playlist_spotify_id'] for row in resolved})
+    new_playlists = {}
+    for row in resolved:
+        if row['playlist_spotify_id'] in already_tracked:
+            row['status'] = 'already tracked'
+        elif row['playlist_spotify_id'] in new_playlists:
+            row['status'] = 'duplicate'
+        else:
+            new_playlists[row['playlist_spotify_id']] = row['playlist_name']
+
+    added = save_playlists(list(new_playlists.items()))
+    for row in resolved:
+        if row['status'] is None:
+            row['status'] = 'added' if row['playlist_spotify_id'] in added else 'already tracked'
+
+    return report
@@ -1,3 +1,36 @@
-from django.test import TestCase
+from unittest import mock
 
-# Create your tests here.
+from playlist_tracker.testing import DashboardTestCase
+from .onboarding import onboard_playlists
+
+
+class FakeSpotifyClient:
+
+    """
+    Answers playlist lookups by id like the Spotify API, naming every playlist after its id
+    """
+
+    def get_playlist(self, playlist_id):
+
+        return {'id': playlist_id, 'name': f"Playlist {playlist_id[-3:]}"}
+
+
+class OnboardPlaylistsTests(DashboardTestCase):
+
+    playlist_ids = [str(i).zfill(22) for i in range(1, 6)]
+
+    @mock.patch("home.onboarding.MAX_ITEMS", 3)
+    def test_inputs_past_the_limit_are_reported_as_skipped(self):
+
+        report = onboard_playlists(FakeSpotifyClient(), self.playlist_ids, max_workers=2)
+
+        self.assertEqual([row['status'] for row in report], ['added'] * 3 + ['skipped (limit)'] * 2)
+        self.assertEqual(self.execute("SELECT count(*) FROM playlist_dim"), [(3,)])
+        self.assertEqual(self.execute("SELECT count(*) FROM playlist_backfill_job WHERE status = 'pending'"), [(3,)])
+
+    def test_tracked_and_repeated_playlists_are_not_added_again(self):
+
+        onboard_playlists(FakeSpotifyClient(), self.playlist_ids[:1])
+        report = onboard_playlists(FakeSpotifyClient(), self.playlist_ids[:2] + self.playlist_ids[1:2])
+
+        self.assertEqual([row['status'] for row in report], ['already tracked', 'added', 'duplicate'])
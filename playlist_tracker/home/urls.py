@@ -4,5 +4,7 @@ from . import views
 # URLConf
 urlpatterns = [
     path('', views.load_home, name='home'),
-    path('track-playlist/', views.track_playlist, name='track-playlist')
+    path('track-playlist/', views.track_playlist, name='track-playlist'),
+    path('onboard-playlists/', views.onboard_playlists_page, name='onboard-playlists'),
+    path('backfill-status/<str:playlist_spotify_id>/', views.backfill_status, name='backfill-status')
 ]
@@ -1,34 +1,136 @@
 from django.shortcuts import render
 from django.db import connection
-from plugins.spot_api import SpotifyAPI
+from django.core.cache import cache
+from asgiref.sync import sync_to_async
+from functools import lru_cache
+from plugins.spot_api import SpotifyAPI, RateLimiter
+from .forms import OnboardForm
+from .onboarding import MAX_ITEMS, parse_playlist_inputs, onboard_playlists
 from dotenv import load_dotenv
+import hashlib
 import os
 
+SEARCH_CACHE_SECONDS = 300  # how long a playlist search result is reused for the same query
+
 
 def load_home(request):
 
     return render(request, 'home/home.html')
 
 
-def track_playlist(request):
+@lru_cache(maxsize=1)
+def get_spotify_client():
+
+    """
+    Returns a process-wide Spotify API client so the access token is only requested when it expires
+    """
 
     # load_dotenv()
 
-    spot_api = SpotifyAPI(os.getenv('SPOTIFY_CLIENT_ID'), os.getenv('SPOTIFY_CLIENT_SECRET'))
+    client = SpotifyAPI(os.getenv('SPOTIFY_CLIENT_ID'), os.getenv('SPOTIFY_CLIENT_SECRET'))
+    # every request / thread of the process shares one request rate budget (e.g. bulk onboarding's workers)
+    client.rate_limiter = RateLimiter(float(os.getenv('SPOTIFY_REQUESTS_PER_SECOND', 5)))
 
-    query = request.GET.get('q', '')
+    return client
 
-    if query:
 
-        plist_search_result = spot_api.search_spotify(query, search_type="playlist")  # returns JSON response
+def search_playlist(query):
+
+    """
+    Searches Spotify for a playlist, reusing recent results for the same query
+
+    :param query: the playlist name the user searched for
+    :return: (playlist spotify id, playlist name) tuple for the 1st search result, or None if nothing was found
+    """
+
+    cache_key = f"playlist-search:{hashlib.md5(query.strip().lower().encode()).hexdigest()}"
+    playlist_data = cache.get(cache_key)
+
+    if playlist_data is None:
+
+        plist_search_result = get_spotify_client().search_spotify(query, search_type="playlist")  # JSON response
+        if not plist_search_result or not plist_search_result['playlists']['items']:
+            return None
+
         plist_id = plist_search_result['playlists']['items'][0]['id']
         plist_name = plist_search_result['playlists']['items'][0]['name']
         playlist_data = (plist_id, plist_name)
+        cache.set(cache_key, playlist_data, SEARCH_CACHE_SECONDS)
+
+    return playlist_data
+
+
+def save_playlist(playlist_data):
+
+    """
+    Adds a playlist to 'playlist_dim' and queues a backfill job so its data is loaded before the next weekly run
+
+    :param playlist_data: (playlist spotify id, playlist name) tuple
+    """
+
+    with connection.cursor() as cursor:
+        cursor.execute("""INSERT INTO playlist_dim (playlist_spotify_id, playlist_name) VALUES (%s, %s)
+                          ON CONFLICT (playlist_spotify_id) DO NOTHING
+                          RETURNING playlist_id""",
+                       playlist_data)
+        new_playlist = cursor.fetchone()
+
+        if new_playlist:
+            # the partial unique index on in-flight jobs dedupes repeat requests for the same playlist
+            cursor.execute("INSERT INTO playlist_backfill_job (playlist_id) VALUES (%s) ON CONFLICT DO NOTHING",
+                           new_playlist)
+
+
+async def track_playlist(request):
+
+    query = request.GET.get('q', '')
+    results = []
+
+    if query:
+
+        # the Spotify request runs in a worker thread so the event loop isn't blocked while waiting on the API
+        playlist_data = await sync_to_async(search_playlist, thread_sensitive=False)(query)
+
+        if playlist_data:
+            await sync_to_async(save_playlist)(playlist_data)
+            results = [playlist_data]
+
+    return render(request, 'track-playlist.html', {'query': query, 'results': results})
+
+
+def onboard_playlists_page(request):
+
+    report = None
+
+    if request.method == 'POST':
+        form = OnboardForm(request.POST, request.FILES)
+        if form.is_valid():
+            text = form.cleaned_data['playlists'] or ''
+            if form.cleaned_data['playlist_file']:
+                text += '\n' + form.cleaned_data['playlist_file'].read().decode('utf-8', errors='replace')
+            report = onboard_playlists(get_spotify_client(), parse_playlist_inputs(text))
+    else:
+        form = OnboardForm()
+
+    return render(request, 'home/onboard.html', {'form': form, 'report': report, 'max_items': MAX_ITEMS})
+
 
-        with connection.cursor() as cursor:
-            cursor.execute("INSERT INTO playlist_dim (playlist_spotify_id, playlist_name) VALUES (%s, %s)",
-                           playlist_data)
+def backfill_status(request, playlist_spotify_id):
 
-        return render(request, 'track-playlist.html', {'query': query, 'results': [playlist_data]})
+    with connection.cursor() as cursor:
+        status_query = """
+            SELECT status, progress
+            FROM playlist_backfill_job bj
+            JOIN playlist_dim pd ON pd.playlist_id = bj.playlist_id
+            WHERE playlist_spotify_id = %s
+            ORDER BY requested_at DESC
+            LIMIT 1
+        """
+        cursor.execute(status_query, [playlist_spotify_id])
+        job = cursor.fetchone()
 
+    context = {'playlist_spotify_id': playlist_spotify_id,
+               'status': job[0] if job else None,
+               'progress': job[1] if job else None}
 
+    return render(request, 'home/partials/backfill_status.html', context)
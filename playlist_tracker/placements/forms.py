@@ -0,0 +1,56 @@
+from django import forms
+
+
+class PlaylistPageForm(forms.Form):
+
+    after_name = forms.CharField(max_length=40, required=False, strip=False)
+    after_id = forms.IntegerField(min_value=1, required=False)
+
+
+class PlaylistForm(forms.Form):
+
+    playlist_id = forms.IntegerField(min_value=1)
+
+
+class StartDateForm(PlaylistForm):
+
+    start_date = forms.DateField()
+
+
+class DateRangeForm(StartDateForm):
+
+    end_date = forms.DateField()
+
+    # keyset values of the last label on the previous page of the summary table
+    after_label = forms.CharField(max_length=100, required=False, strip=False)
+    after_placed = forms.IntegerField(min_value=0, required=False)
+    after_position = forms.DecimalField(required=False)
+
+    def clean(self):
+
+        cleaned_data = super().clean()
+        start_date = cleaned_data.get("start_date")
+        end_date = cleaned_data.get("end_date")
+
+        if start_date and end_date and end_date < start_date:
+            raise forms.ValidationError("The end date can't be before the start date")
+
+        return cleaned_data
+
+
+class LabelShareForm(forms.Form):
+
+    label_search = forms.CharField(max_length=100, required=False)  # no label => the top labels overall
+    start_date = forms.DateField(required=False)
+    end_date = forms.DateField(required=False)
+
+    def clean(self):
+
+        cleaned_data = super().clean()
+        start_date = cleaned_data.get("start_date")
+        end_date = cleaned_data.get("end_date")
+
+        if start_date and end_date and end_date < start_date:
+            raise forms.ValidationError("The end date can't be before the start date")
+
+        return cleaned_data
@@ -1,3 +1,36 @@
-from django.test import TestCase
+from playlist_tracker.testing import DashboardTestCase
+from playlist_tracker.pagination import PAGE_SIZE
+from .views import fetch_playlists
 
-# Create your tests here.
+
+class PlaylistPaginationTests(DashboardTestCase):
+
+    def test_every_playlist_is_listed_once(self):
+
+        # every third playlist has no name => sorts first and mustn't end the pages early
+        self.execute("""INSERT INTO playlist_dim (playlist_spotify_id, playlist_name)
+                        SELECT lpad(i::text, 22, '0'), CASE WHEN i %% 3 <> 0 THEN 'Playlist ' || i END
+                        FROM generate_series(1, %s) i""", [PAGE_SIZE * 2 + 5])
+
+        listed = []
+        playlist_data, next_url = fetch_playlists()
+        while True:
+            listed += playlist_data
+            if next_url is None:
+                break
+            last_id, last_name = playlist_data[-1]
+            playlist_data, next_url = fetch_playlists(last_name, last_id)
+
+        self.assertEqual(len(listed), PAGE_SIZE * 2 + 5)
+        self.assertEqual(len({playlist_id for playlist_id, name in listed}), PAGE_SIZE * 2 + 5)
+
+    def test_next_page_url_carries_an_empty_name(self):
+
+        self.execute("""INSERT INTO playlist_dim (playlist_spotify_id)
+                        SELECT lpad(i::text, 22, '0') FROM generate_series(1, %s) i""", [PAGE_SIZE + 1])
+
+        playlist_data, next_url = fetch_playlists()
+
+        self.assertIn("after_name=&", next_url)
+        response = self.client.get(next_url)
+        self.assertEqual(len(response.context['playlist_data']), 1)
@@ -3,7 +3,12 @@ from . import views
 
 urlpatterns = [
     path('', views.get_playlists, name='playlists'),
+    path('playlist-options/', views.playlist_options, name='playlist-options'),
     path('start-date/', views.get_start, name='start-date'),
     path('end-date/', views.get_end, name='end-date'),
-    path('placement-display/', views.display_placement_summary, name='placement-display')
+    path('placement-display/', views.display_placement_summary, name='placement-display'),
+    path('placement-rows/', views.placement_rows, name='placement-rows'),
+    path('placement-csv/', views.download_placement_summary, name='placement-csv'),
+    path('label-share/', views.label_share, name='label-share'),
+    path('label-share-display/', views.label_share_display, name='label-share-display')
 ]
\ No newline at end of file
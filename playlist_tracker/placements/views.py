@@ -1,114 +1,188 @@
 from django.shortcuts import render
-from django.db import connection
-import ast
+from django.http import HttpResponseBadRequest, StreamingHttpResponse
+from playlist_tracker.caching import cached_partial
+from playlist_tracker.middleware import profile_section
+from playlist_tracker.pagination import PAGE_SIZE, fetch_page, like_prefix, next_page_url
+from playlist_tracker.db_routing import read_connection
+from .forms import PlaylistPageForm, PlaylistForm, StartDateForm, DateRangeForm, LabelShareForm
+import csv
+import datetime
 import pandas as pd
 import plotly.express as px
 from plotly.io import to_html
 
 
+def fetch_playlists(after_name=None, after_id=None):
+
+    """
+    Grabs a single page of tracked playlists, ordered by name
+
+    :param after_name: name of the last playlist on the previous page (None for the first page)
+    :param after_id: id of the last playlist on the previous page
+    :return: list of (playlist id, playlist name) tuples + the url of the next page (None if this is the last page)
+    """
+
+    playlist_query = """
+        SELECT playlist_id, coalesce(playlist_name, '') AS playlist_name
+        FROM playlist_dim
+        {keyset}
+        ORDER BY coalesce(playlist_name, ''), playlist_id
+        LIMIT %s
+    """
+
+    with read_connection().cursor() as cursor:
+        if after_id is None:
+            playlist_data, has_more = fetch_page(cursor, playlist_query.format(keyset=""), [])
+        else:
+            keyset = "WHERE (coalesce(playlist_name, ''), playlist_id) > (%s, %s)"  # a NULL name would end the pages
+            playlist_data, has_more = fetch_page(cursor, playlist_query.format(keyset=keyset), [after_name, after_id])
+
+    next_url = None
+    if has_more:
+        next_url = next_page_url('playlist-options', {'after_name': playlist_data[-1][1],
+                                                      'after_id': playlist_data[-1][0]})
+
+    return playlist_data, next_url
+
+
 def get_playlists(request):
 
-    with connection.cursor() as cursor:
-        cursor.execute("SELECT playlist_id, playlist_name FROM playlist_dim")
-        playlist_data = [playlist for playlist in cursor.fetchall()]
+    playlist_data, next_url = fetch_playlists()
 
-    context = {'playlist_data': playlist_data}
+    context = {'playlist_data': playlist_data,
+               'next_url': next_url}
 
     return render(request, 'placements/placements.html', context)
 
 
+@cached_partial
+def playlist_options(request):
+
+    form = PlaylistPageForm(request.GET)
+    if not form.is_valid():
+        return HttpResponseBadRequest(form.errors.as_text())
+
+    playlist_data, next_url = fetch_playlists(form.cleaned_data['after_name'], form.cleaned_data['after_id'])
+
+    context = {'playlist_data': playlist_data,
+               'next_url': next_url}
+
+    return render(request, 'placements/partials/playlist_options.html', context)
+
+
+@cached_partial
 def get_start(request):
 
-    selected_playlist = request.GET.get('playlist_dropdown')
-    selected_playlist_data = ast.literal_eval(selected_playlist)
-    playlist_id = selected_playlist_data[0]
+    form = PlaylistForm(request.GET)
+    if not form.is_valid():
+        return HttpResponseBadRequest(form.errors.as_text())
 
-    with connection.cursor() as cursor:
+    with read_connection().cursor() as cursor:
 
         date_query = """
             SELECT DISTINCT dd.date_id, date
             FROM date_dim dd
             JOIN track_playlist_fact tpf on tpf.date_id = dd.date_id
             WHERE playlist_id = %s
+            ORDER BY date
         """
-        cursor.execute(date_query, [playlist_id])
-        dates = [date for date in cursor.fetchall()]
-        date_data = [(playlist_id, i[0], i[1]) for i in dates]
+        cursor.execute(date_query, [form.cleaned_data['playlist_id']])
+        date_data = [date for date in cursor.fetchall()]
 
     context = {'date_data': date_data}
 
     return render(request, 'placements/partials/start_date.html', context)
 
 
+@cached_partial
 def get_end(request):
 
-    selected_start = request.GET.get('start_date')
-    selected_start = selected_start[1:-1]
-    selected_start = selected_start.split(", ", 2)
-
-    playlist_id = selected_start[0].strip()
-    start_date = selected_start[2]
-    start_date = start_date.replace("datetime.date", "").strip("()")
-    start_date = start_date.strip()
-    start_date = start_date.replace(", ", "-")
+    form = StartDateForm(request.GET)
+    if not form.is_valid():
+        return HttpResponseBadRequest(form.errors.as_text())
 
-    with connection.cursor() as cursor:
+    with read_connection().cursor() as cursor:
 
         date_query = """
             SELECT DISTINCT dd.date_id, date
             FROM date_dim dd
             JOIN track_playlist_fact tpf on tpf.date_id = dd.date_id
             WHERE playlist_id = %s and date >= %s
+            ORDER BY date
         """
 
-        cursor.execute(date_query, [playlist_id, start_date])
-        end_dates = [date for date in cursor.fetchall()]
-        end_dates_data = [(playlist_id, start_date, i[1]) for i in end_dates]
+        cursor.execute(date_query, [form.cleaned_data['playlist_id'], form.cleaned_data['start_date']])
+        end_dates_data = [date for date in cursor.fetchall()]
 
     context = {'end_dates_data': end_dates_data}
 
     return render(request, 'placements/partials/end_date.html', context)
 
 
-def organize_placement_data(request):
-
-    selected_end = request.GET.get('end_date')
-    selected_end = selected_end[1:-1]
-    selected_end = selected_end.split(", ", 2)
-
-    playlist_id_clean = selected_end[0].strip("\'\"")
-    start_date_clean = selected_end[1].strip("\'\"")
-    end_date_clean = selected_end[2]
-    end_date_clean = end_date_clean.replace("datetime.date", "").strip("()")
-    end_date_clean = end_date_clean.strip()
-    end_date_clean = end_date_clean.replace(", ", "-")
-
-    with connection.cursor() as cursor:
-
-        query = """
-                SELECT
-                    label_name,
-                    count(track_playlist_position) as tracks_placed,
-                    round(avg(track_playlist_position), 2) as average_track_position    
-                FROM
-                    track_playlist_fact tpf
-                JOIN
-                    date_dim dd ON tpf.date_id = dd.date_id
-                JOIN
-                    track_dim td ON tpf.track_id = td.track_id
-                WHERE
-                    playlist_id = %s AND date BETWEEN %s AND %s
-                GROUP BY label_name
-                ORDER BY tracks_placed DESC, average_track_position ASC
-        """
-        cursor.execute(query, [playlist_id_clean, start_date_clean, end_date_clean])
-        results = cursor.fetchall()
+placement_summary_query = """
+        SELECT
+            coalesce(ld.label_name, '') as label_name,
+            count(track_playlist_position) as tracks_placed,
+            round(avg(track_playlist_position), 2) as average_track_position
+        FROM
+            track_playlist_fact tpf
+        JOIN
+            date_dim dd ON tpf.date_id = dd.date_id
+        JOIN
+            track_dim td ON tpf.track_id = td.track_id
+        LEFT JOIN
+            label_dim ld ON td.label_id = ld.label_id
+        WHERE
+            playlist_id = %s AND date BETWEEN %s AND %s
+        GROUP BY td.label_id, ld.label_name
+        {keyset}
+        ORDER BY tracks_placed DESC, average_track_position ASC, label_name ASC
+"""
+
+# rows after the last row on the previous page (negating the count keeps every keyset column in ascending order)
+placement_summary_keyset = """
+        HAVING (-count(track_playlist_position), round(avg(track_playlist_position), 2), coalesce(ld.label_name, ''))
+            > (%s, %s, %s)
+"""
+
+
+def organize_placement_data(date_range):
+
+    """
+    Grabs a single page of the label placement summary for a playlist + date range
+
+    :param date_range: cleaned data from a valid 'DateRangeForm'
+    :return: dataframe containing the page's rows + the url of the next page (None if this is the last page)
+    """
+
+    query_params = [date_range['playlist_id'], date_range['start_date'], date_range['end_date']]
+
+    with read_connection().cursor() as cursor:
+
+        if date_range['after_placed'] is None:
+            query = placement_summary_query.format(keyset="") + "LIMIT %s"
+        else:
+            query = placement_summary_query.format(keyset=placement_summary_keyset) + "LIMIT %s"
+            query_params += [-date_range['after_placed'], date_range['after_position'], date_range['after_label']]
+
+        results, has_more = fetch_page(cursor, query, query_params)
         columns = [desc[0] for desc in cursor.description]
         df = pd.DataFrame(results, columns=columns)
 
-    return df
+    next_url = None
+    if has_more:
+        last_row = results[-1]
+        next_url = next_page_url('placement-rows', {'playlist_id': date_range['playlist_id'],
+                                                    'start_date': date_range['start_date'].isoformat(),
+                                                    'end_date': date_range['end_date'].isoformat(),
+                                                    'after_label': last_row[0],
+                                                    'after_placed': last_row[1],
+                                                    'after_position': last_row[2]})
 
+    return df, next_url
 
+
+@profile_section("chart")
 def plot_label_placements(df):
 
     plot_df = df.nlargest(10, "tracks_placed")  # only display the top 10 in the plot
@@ -146,17 +220,286 @@ def plot_label_placements(df):
     return label_bar_chart
 
 
+def organize_movement_data(date_range):
+
+    """
+    Summarizes the adds, drops, and position moves recorded for a playlist within a date range
+
+    :param date_range: cleaned data from a valid 'DateRangeForm'
+    :return: list of (date, adds, drops, moves) rows per snapshot + list of the biggest climbers
+    """
+
+    # the start date's own movements compare it with a snapshot outside of the range
+    query_params = [date_range['playlist_id'], date_range['start_date'], date_range['end_date']]
+
+    with read_connection().cursor() as cursor:
+
+        churn_query = """
+            SELECT
+                date,
+                count(*) FILTER (WHERE movement_type = 'add') as adds,
+                count(*) FILTER (WHERE movement_type = 'drop') as drops,
+                count(*) FILTER (WHERE movement_type = 'move') as moves
+            FROM playlist_movement_fact pmf
+            JOIN date_dim dd ON dd.date_id = pmf.date_id
+            WHERE playlist_id = %s AND date > %s AND date <= %s
+            GROUP BY date
+            ORDER BY date
+        """
+        cursor.execute(churn_query, query_params)
+        churn = cursor.fetchall()
+
+        climber_query = """
+            SELECT date, track_name, previous_position, current_position, position_change
+            FROM playlist_movement_fact pmf
+            JOIN date_dim dd ON dd.date_id = pmf.date_id
+            JOIN track_dim td ON td.track_id = pmf.track_id
+            WHERE playlist_id = %s AND date > %s AND date <= %s AND movement_type = 'move'
+            ORDER BY position_change DESC
+            LIMIT 10
+        """
+        cursor.execute(climber_query, query_params)
+        climbers = cursor.fetchall()
+
+    return churn, climbers
+
+
+@cached_partial
 def display_placement_summary(request):
 
-    data = organize_placement_data(request)
+    form = DateRangeForm(request.GET)
+    if not form.is_valid():
+        return HttpResponseBadRequest(form.errors.as_text())
+
+    data, next_url = organize_placement_data(form.cleaned_data)  # 1st page holds the top labels used in the chart
 
     bar_chart = plot_label_placements(data)
 
     headers = list(data.columns)
     rows = data.to_dict(orient="records")
 
+    churn, climbers = organize_movement_data(form.cleaned_data)
+
     context = {'bar_chart': bar_chart,
                'headers': headers,
-               'rows': rows}
+               'rows': rows,
+               'next_url': next_url,
+               'date_range': form.cleaned_data,
+               'churn': churn,
+               'climbers': climbers}
 
     return render(request, 'placements/partials/placement_display.html', context)
+
+
+@cached_partial
+def placement_rows(request):
+
+    form = DateRangeForm(request.GET)
+    if not form.is_valid():
+        return HttpResponseBadRequest(form.errors.as_text())
+
+    data, next_url = organize_placement_data(form.cleaned_data)
+
+    context = {'rows': data.to_dict(orient="records"),
+               'next_url': next_url}
+
+    return render(request, 'placements/partials/placement_rows.html', context)
+
+
+class Echo:
+
+    """
+    File-like object that hands each written line straight back to the csv writer's caller
+    """
+
+    def write(self, value):
+        return value
+
+
+def download_placement_summary(request):
+
+    form = DateRangeForm(request.GET)
+    if not form.is_valid():
+        return HttpResponseBadRequest(form.errors.as_text())
+
+    query_params = [form.cleaned_data['playlist_id'], form.cleaned_data['start_date'], form.cleaned_data['end_date']]
+
+    def stream_rows():
+
+        writer = csv.writer(Echo())
+        yield writer.writerow(["label_name", "tracks_placed", "average_track_position"])
+
+        # server-side cursor => rows are streamed from postgres in chunks instead of being loaded all at once
+        with read_connection().chunked_cursor() as cursor:
+            cursor.execute(placement_summary_query.format(keyset=""), query_params)
+            for row in cursor:
+                yield writer.writerow(row)
+
+    response = StreamingHttpResponse(stream_rows(), content_type="text/csv")
+    response["Content-Disposition"] = 'attachment; filename="label_placements.csv"'
+
+    return response
+
+
+SHARE_WEEKS = 26  # weeks shown by the label share page when no start date is picked
+SHARE_CHART_LABELS = 10  # labels plotted in the share chart
+
+# labels ranked by their placements across every tracked playlist, with their share of all placements in the range
+label_share_query = """
+        WITH total AS (
+            SELECT sum(placements) AS placements
+            FROM label_share_weekly
+            WHERE grouping_level = 3 AND date_id BETWEEN %(start)s AND %(end)s
+        )
+        SELECT
+            ld.label_id,
+            ld.label_name,
+            sum(lsw.placements) AS tracks_placed,
+            round(100.0 * sum(lsw.placements) / min(total.placements), 2) AS share_of_placements,
+            count(*) AS weeks_placed,
+            round(sum(lsw.avg_position * lsw.placements) / sum(lsw.placements), 2) AS average_track_position
+        FROM label_share_weekly lsw
+        CROSS JOIN total
+        JOIN label_dim ld ON ld.label_id = lsw.label_id
+        WHERE lsw.grouping_level = 1 AND lsw.date_id BETWEEN %(start)s AND %(end)s {label_filter}
+        GROUP BY ld.label_id, ld.label_name
+        ORDER BY tracks_placed DESC, ld.label_name
+        LIMIT %(limit)s
+"""
+
+# labels whose canonical name (see 'label_dim') starts with the search text
+share_label_filter = f"""
+            AND lsw.label_id IN (SELECT label_id FROM label_dim
+                                 WHERE canonical_name LIKE {like_prefix('canonical_label_name(%(label)s)')})
+"""
+
+# weekly share of every placement for a few labels => the chart's time series
+label_share_series_query = """
+        SELECT dd.date, ld.label_name, round(lsw.placement_share * 100, 2) AS share_of_placements
+        FROM label_share_weekly lsw
+        JOIN label_dim ld ON ld.label_id = lsw.label_id
+        JOIN date_dim dd ON dd.date_id = lsw.date_id
+        WHERE lsw.grouping_level = 1 AND lsw.label_id = ANY(%(label_ids)s) AND lsw.date_id BETWEEN %(start)s AND %(end)s
+        ORDER BY dd.date, ld.label_name
+"""
+
+# drill-down => the labels' share of each playlist's placements in the range
+label_playlist_share_query = """
+        WITH playlist_total AS (
+            SELECT playlist_id, sum(placements) AS placements
+            FROM label_share_weekly
+            WHERE grouping_level = 2 AND date_id BETWEEN %(start)s AND %(end)s
+            GROUP BY playlist_id
+        )
+        SELECT
+            ld.label_name,
+            pd.playlist_name,
+            sum(lsw.placements) AS tracks_placed,
+            round(100.0 * sum(lsw.placements) / min(pt.placements), 2) AS share_of_playlist,
+            count(*) AS weeks_placed,
+            round(sum(lsw.avg_position * lsw.placements) / sum(lsw.placements), 2) AS average_track_position
+        FROM label_share_weekly lsw
+        JOIN playlist_total pt ON pt.playlist_id = lsw.playlist_id
+        JOIN label_dim ld ON ld.label_id = lsw.label_id
+        JOIN playlist_dim pd ON pd.playlist_id = lsw.playlist_id
+        WHERE lsw.grouping_level = 0 AND lsw.label_id = ANY(%(label_ids)s) AND lsw.date_id BETWEEN %(start)s AND %(end)s
+        GROUP BY ld.label_id, ld.label_name, pd.playlist_id, pd.playlist_name
+        ORDER BY tracks_placed DESC, ld.label_name, pd.playlist_name
+        LIMIT %(limit)s
+"""
+
+
+def organize_label_share(filters):
+
+    """
+    Reads the labels' share of playlist placements from the 'label_share_weekly' rollup. Without a label, the labels
+    with the most placements across every tracked playlist are ranked; with one, the matching labels are broken
+    down by playlist.
+
+    :param filters: cleaned data from a valid 'LabelShareForm'
+    :return: dict with the date range, the chart's weekly series (dataframe) and the table's headers + rows, or None
+    if nothing has been rolled up yet
+    """
+
+    with read_connection().cursor() as cursor:
+
+        cursor.execute("SELECT max(date_id) FROM label_share_weekly")
+        latest_date_id = cursor.fetchone()[0]
+        if latest_date_id is None:
+            return None
+
+        end_date = filters['end_date'] or datetime.datetime.strptime(latest_date_id, "%Y%m%d").date()
+        start_date = filters['start_date'] or end_date - datetime.timedelta(weeks=SHARE_WEEKS - 1)
+        params = {'start': start_date.strftime("%Y%m%d"),
+                  'end': end_date.strftime("%Y%m%d"),
+                  'label': filters['label_search'],
+                  'limit': SHARE_CHART_LABELS if filters['label_search'] else PAGE_SIZE}
+
+        label_filter = share_label_filter if filters['label_search'] else ""
+        cursor.execute(label_share_query.format(label_filter=label_filter), params)
+        labels = cursor.fetchall()
+        headers = [desc[0] for desc in cursor.description][1:]  # the label ids are only used by the next queries
+
+        params['label_ids'] = [row[0] for row in labels[:SHARE_CHART_LABELS]]
+        cursor.execute(label_share_series_query, params)
+        series = pd.DataFrame(cursor.fetchall(), columns=["date", "label_name", "share_of_placements"])
+
+        if filters['label_search']:
+            params['limit'] = PAGE_SIZE
+            cursor.execute(label_playlist_share_query, params)
+            rows = cursor.fetchall()
+            headers = [desc[0] for desc in cursor.description]
+        else:
+            rows = [row[1:] for row in labels]
+
+    return {'start_date': start_date,
+            'end_date': end_date,
+            'series': series,
+            'headers': headers,
+            'rows': rows}
+
+
+@profile_section("chart")
+def plot_label_share(df):
+
+    fig = px.line(
+        df,
+        x="date",
+        y="share_of_placements",
+        color="label_name",
+        markers=True,
+        labels={"date": "week",
+                "share_of_placements": "share of placements (%)",
+                "label_name": "label"},
+        title=f"Weekly share of playlist placements (top {SHARE_CHART_LABELS} labels)"
+    )
+
+    fig.update_layout(
+        title={
+            "x": 0.5,
+            "xanchor": "center",
+        }
+    )
+
+    return to_html(fig, full_html=False)
+
+
+def label_share(request):
+
+    return render(request, 'placements/label_share.html')
+
+
+@cached_partial
+def label_share_display(request):
+
+    form = LabelShareForm(request.GET)
+    if not form.is_valid():
+        return HttpResponseBadRequest(form.errors.as_text())
+
+    share = organize_label_share(form.cleaned_data)
+
+    context = {'label_search': form.cleaned_data['label_search'],
+               'share': share,
+               'share_chart': plot_label_share(share['series']) if share and not share['series'].empty else None}
+
+    return render(request, 'placements/partials/label_share_display.html', context)
@@ -0,0 +1,63 @@
+from django.core.cache import cache
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
+from functools import wraps
+from playlist_tracker.db_routing import read_connection
+import hashlib
+
+PARTIAL_CACHE_SECONDS = 60 * 15  # upper bound on how long a rendered partial is reused
+
+
+def snapshot_version():
+
+    """
+    Builds a marker that changes whenever the data warehouse changes: every ETL step that writes to it (loads, trends,
+    movements, label shares, replays, retention) bumps 'dw_data_version', and the web app itself adds playlists /
+    queues backfills. Read from the same database as the partials, so a lagging replica never caches its data under a
+    newer marker.
+    """
+
+    with read_connection().cursor() as cursor:
+        version_query = """
+            SELECT
+                (SELECT version FROM dw_data_version),
+                (SELECT max(date_id) FROM track_playlist_fact),  -- loads written straight to the tables (benchmarks)
+                (SELECT max(playlist_id) FROM playlist_dim),
+                (SELECT max(finished_at) FROM playlist_backfill_job)
+        """
+        cursor.execute(version_query)
+        version = cursor.fetchone()
+
+    return ":".join(str(value) for value in version)
+
+
+def cached_partial(view):
+
+    """
+    Caches a partial's rendered response per data warehouse snapshot + query string. The same key is sent as the
+    response's ETag so repeat requests from the browser can be answered with a 304.
+    """
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+
+        etag = quote_etag(hashlib.md5(f"{snapshot_version()}:{request.get_full_path()}".encode()).hexdigest())
+
+        not_modified = get_conditional_response(request, etag=etag)
+        if not_modified is not None:
+            return not_modified
+
+        cache_key = f"partial:{etag}"
+        response = cache.get(cache_key)
+
+        if response is None:
+            response = view(request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+            cache.set(cache_key, response, PARTIAL_CACHE_SECONDS)
+
+        response.headers["ETag"] = etag
+
+        return response
+
+    return wrapper
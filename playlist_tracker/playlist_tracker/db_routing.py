@@ -0,0 +1,121 @@
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+import logging
+import threading
+import time
+
+logger = logging.getLogger("playlist_tracker.db_routing")
+
+# seconds the read database is behind the primary (0 for a read database that isn't a streaming replica, NULL when
+# a replica has lost its connection to the primary => its data can't be trusted to be recent)
+replication_lag_query = """
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN NOT EXISTS (SELECT FROM pg_stat_wal_receiver WHERE status = 'streaming') THEN NULL
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0  -- caught up (the primary may just be idle)
+        ELSE extract(epoch FROM now() - pg_last_xact_replay_timestamp())
+    END
+"""
+
+_lock = threading.Lock()
+_status = {"alias": DEFAULT_DB_ALIAS, "checked_at": None}  # last health check of the read database (per process)
+
+
+def reads_setting(name):
+
+    """
+    Reads one of the DATABASE_READS settings, falling back to a default that keeps every query on the primary
+    """
+
+    defaults = {"ALIAS": "replica",  # database alias the dashboard's read queries are sent to (when it's configured)
+                "MAX_LAG_SECONDS": 60,  # replicas further behind than this are skipped
+                "CHECK_SECONDS": 10,  # how long the result of a health check is reused
+                "APPS": []}  # apps whose ORM reads are routed to the read database
+
+    return getattr(settings, "DATABASE_READS", {}).get(name, defaults[name])
+
+
+def read_database_is_fresh(alias):
+
+    """
+    :return: True if the read database is reachable and no further behind the primary than MAX_LAG_SECONDS
+    """
+
+    try:
+        with connections[alias].cursor() as cursor:
+            cursor.execute(replication_lag_query)
+            lag = cursor.fetchone()[0]
+    except DatabaseError:
+        logger.warning(f"Read database '{alias}' is unreachable, reading from the primary", exc_info=True)
+        return False
+
+    if lag is None or lag > reads_setting("MAX_LAG_SECONDS"):
+        logger.warning(f"Read database '{alias}' is stale (lag: {lag} seconds), reading from the primary")
+        return False
+
+    return True
+
+
+def read_alias():
+
+    """
+    Picks the database the dashboard's read queries run on => the read database while it's healthy, otherwise the
+    primary. The health check runs at most once every CHECK_SECONDS per process; other threads keep using the
+    previous answer while it runs.
+    """
+
+    alias = reads_setting("ALIAS")
+    if alias not in settings.DATABASES:
+        return DEFAULT_DB_ALIAS
+
+    now = time.monotonic()
+    with _lock:
+        checked_at = _status["checked_at"]
+        if checked_at is not None and now - checked_at < reads_setting("CHECK_SECONDS"):
+            return _status["alias"]
+        _status["checked_at"] = now
+
+    chosen = alias if read_database_is_fresh(alias) else DEFAULT_DB_ALIAS
+
+    with _lock:
+        if chosen != _status["alias"]:
+            logger.info(f"Dashboard reads switched to '{chosen}'")
+        _status["alias"] = chosen
+
+    return chosen
+
+
+def read_connection():
+
+    """
+    :return: connection for read-only dashboard queries (writes + reads that must see them always use 'connection')
+    """
+
+    return connections[read_alias()]
+
+
+class ReadDatabaseRouter:
+
+    """
+    Sends ORM reads of the DATABASE_READS['APPS'] models to the read database; writes, migrations and every other app
+    (auth, sessions, admin) stay on the primary
+    """
+
+    def db_for_read(self, model, **hints):
+
+        if model._meta.app_label in reads_setting("APPS"):
+            return read_alias()
+
+        return None
+
+    def db_for_write(self, model, **hints):
+
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+
+        return True  # both aliases hold the same data
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+
+        return db == DEFAULT_DB_ALIAS
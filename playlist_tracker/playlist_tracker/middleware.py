@@ -0,0 +1,234 @@
+from django.conf import settings
+from django.db import connections
+from django.http import JsonResponse, HttpResponseForbidden
+from django.template.backends.django import DjangoTemplates, Template
+from collections import defaultdict, deque
+from contextlib import ExitStack
+from functools import wraps
+import logging
+import random
+import threading
+import time
+
+slow_query_logger = logging.getLogger("playlist_tracker.slow_queries")
+
+_local = threading.local()  # profile of the request currently being handled by this thread
+_stats_lock = threading.Lock()
+_endpoint_stats = defaultdict(lambda: {"requests": 0, "sql_count": 0, "db_ms": 0.0, "render_ms": 0.0,
+                                       "chart_ms": 0.0, "total_ms": 0.0, "max_ms": 0.0,
+                                       "recent_ms": deque(maxlen=500)})
+_slow_queries = deque(maxlen=50)  # latest slow queries (+ sampled plans) across every endpoint
+
+
+def profiling_setting(name):
+
+    """
+    Reads one of the QUERY_PROFILING settings, falling back to a production-safe default
+    """
+
+    defaults = {"ENABLED": True,
+                "SLOW_QUERY_MS": 200,  # queries slower than this are logged with their parameters
+                "EXPLAIN_SAMPLE_RATE": 0.0}  # share of slow SELECTs re-run under EXPLAIN ANALYZE
+
+    return getattr(settings, "QUERY_PROFILING", {}).get(name, defaults[name])
+
+
+class RequestProfile:
+
+    """
+    Time + query counts collected while a single request is handled
+    """
+
+    def __init__(self):
+
+        self.sql_count = 0
+        self.db_ms = 0.0
+        self.sections = defaultdict(float)  # e.g. 'render' / 'chart' => ms
+        self.slow_queries = []
+
+
+def record_query(execute, sql, params, many, context):
+
+    """
+    'connection.execute_wrapper' hook => times every query the current request runs
+    """
+
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        profile = getattr(_local, "profile", None)
+        if profile is not None:
+            profile.sql_count += 1
+            profile.db_ms += elapsed_ms
+            if elapsed_ms >= profiling_setting("SLOW_QUERY_MS"):
+                profile.slow_queries.append((sql, params, many, elapsed_ms, context["connection"].alias))
+
+
+def profile_section(name):
+
+    """
+    Decorator that adds a function's run time to a named section (e.g. 'chart') of the current request's profile
+    """
+
+    def decorator(func):
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            profile = getattr(_local, "profile", None)
+            if profile is None:
+                return func(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                profile.sections[name] += (time.perf_counter() - start) * 1000
+
+        return wrapper
+
+    return decorator
+
+
+class ProfiledTemplate(Template):
+
+    @profile_section("render")
+    def render(self, context=None, request=None):
+        return super().render(context, request)
+
+
+class ProfiledDjangoTemplates(DjangoTemplates):
+
+    """
+    Django template backend that adds template rendering time to the current request's profile
+    """
+
+    def from_string(self, template_code):
+        return ProfiledTemplate(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        return ProfiledTemplate(super().get_template(template_name).template, self)
+
+
+def explain_query(sql, params, alias):
+
+    """
+    Re-runs a read-only query under EXPLAIN ANALYZE on the database it ran on (queries are never profiled while this
+    runs)
+    """
+
+    with connections[alias].cursor() as cursor:
+        cursor.execute(f"EXPLAIN (ANALYZE, BUFFERS) {sql}", params)
+        return "\n".join(row[0] for row in cursor.fetchall())
+
+
+class QueryProfilingMiddleware:
+
+    """
+    Records the SQL count, database time, template render time and chart build time of every request. The totals are
+    sent back in a 'Server-Timing' header and aggregated per endpoint (see 'profiling_summary'), and queries slower
+    than QUERY_PROFILING['SLOW_QUERY_MS'] are logged along with their parameters.
+    """
+
+    def __init__(self, get_response):
+
+        self.get_response = get_response
+
+    def __call__(self, request):
+
+        if not profiling_setting("ENABLED"):
+            return self.get_response(request)
+
+        _local.profile = profile = RequestProfile()
+        start = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                # the primary + the read database (see db_routing.py)
+                for db_connection in connections.all():
+                    stack.enter_context(db_connection.execute_wrapper(record_query))
+                response = self.get_response(request)
+        finally:
+            _local.profile = None
+
+        total_ms = (time.perf_counter() - start) * 1000
+        endpoint = request.resolver_match.view_name if request.resolver_match else "unresolved"
+
+        self.log_slow_queries(endpoint, profile)
+        self.record_stats(endpoint, profile, total_ms)
+
+        response.headers["Server-Timing"] = ", ".join(
+            [f"db;dur={profile.db_ms:.1f};desc=\"{profile.sql_count} queries\"", f"total;dur={total_ms:.1f}"] +
+            [f"{name};dur={ms:.1f}" for name, ms in profile.sections.items()])
+
+        return response
+
+    @staticmethod
+    def log_slow_queries(endpoint, profile):
+
+        for sql, params, many, elapsed_ms, alias in profile.slow_queries:
+
+            slow_query_logger.warning(f"Slow query ({elapsed_ms:.1f} ms) on {endpoint} ('{alias}' database): {sql} - "
+                                      f"params: {params}")
+
+            plan = None
+            is_read_only = sql.lstrip().upper().startswith(("SELECT", "WITH")) and not many
+            if is_read_only and random.random() < profiling_setting("EXPLAIN_SAMPLE_RATE"):
+                try:
+                    plan = explain_query(sql, params, alias)
+                    slow_query_logger.warning(f"Plan for the slow query on {endpoint}:\n{plan}")
+                except Exception:
+                    slow_query_logger.exception("Could not EXPLAIN the slow query")
+
+            with _stats_lock:
+                _slow_queries.append({"endpoint": endpoint,
+                                      "database": alias,
+                                      "ms": round(elapsed_ms, 1),
+                                      "sql": sql,
+                                      "params": "many" if many else str(params),
+                                      "plan": plan})
+
+    @staticmethod
+    def record_stats(endpoint, profile, total_ms):
+
+        with _stats_lock:
+            stats = _endpoint_stats[endpoint]
+            stats["requests"] += 1
+            stats["sql_count"] += profile.sql_count
+            stats["db_ms"] += profile.db_ms
+            stats["render_ms"] += profile.sections["render"]
+            stats["chart_ms"] += profile.sections["chart"]
+            stats["total_ms"] += total_ms
+            stats["max_ms"] = max(stats["max_ms"], total_ms)
+            stats["recent_ms"].append(total_ms)
+
+
+def profiling_summary(request):
+
+    """
+    Aggregated request profiles for every endpoint handled by this worker process (internal IPs only). Endpoints are
+    sorted by their total time, so the hottest ones come first.
+    """
+
+    if request.META.get("REMOTE_ADDR") not in settings.INTERNAL_IPS:
+        return HttpResponseForbidden()
+
+    with _stats_lock:
+        endpoints = []
+        for endpoint, stats in _endpoint_stats.items():
+            requests = stats["requests"]
+            recent = sorted(stats["recent_ms"])
+            endpoints.append({"endpoint": endpoint,
+                              "requests": requests,
+                              "total_ms": round(stats["total_ms"], 1),
+                              "avg_ms": round(stats["total_ms"] / requests, 1),
+                              "p95_ms": round(recent[int(0.95 * (len(recent) - 1))], 1),
+                              "max_ms": round(stats["max_ms"], 1),
+                              "avg_sql_count": round(stats["sql_count"] / requests, 1),
+                              "avg_db_ms": round(stats["db_ms"] / requests, 1),
+                              "avg_render_ms": round(stats["render_ms"] / requests, 1),
+                              "avg_chart_ms": round(stats["chart_ms"] / requests, 1)})
+        slow_queries = list(_slow_queries)
+
+    endpoints.sort(key=lambda e: e["total_ms"], reverse=True)
+
+    return JsonResponse({"endpoints": endpoints, "slow_queries": slow_queries[::-1]})
@@ -0,0 +1,49 @@
+from django.urls import reverse
+from urllib.parse import urlencode
+
+PAGE_SIZE = 50  # max rows returned by a dropdown / table partial in a single request
+
+
+def fetch_page(cursor, query, params, page_size=PAGE_SIZE):
+
+    """
+    Runs a keyset-limited query and fetches a single page of results. The query must end with 'LIMIT %s'.
+
+    :param cursor: database cursor
+    :param query: SQL query ordered by the columns used as the page's keyset
+    :param params: list of the query's parameters (excluding the limit)
+    :param page_size: max number of rows to return
+    :return: list of rows + a boolean that's True when there are more rows after this page
+    """
+
+    cursor.execute(query, params + [page_size + 1])  # grab one extra row to find out if there's another page
+    rows = cursor.fetchall()
+
+    return rows[:page_size], len(rows) > page_size
+
+
+def next_page_url(view_name, params):
+
+    """
+    Builds the URL a 'load more' button uses to request the next page of a partial
+
+    :param view_name: name of the url pattern that serves the following pages
+    :param params: dict of query string parameters, including the keyset values of the last row on the current page
+    :return: url string
+    """
+
+    return f"{reverse(view_name)}?{urlencode(params)}"
+
+
+def like_prefix(expression):
+
+    """
+    Builds the LIKE pattern matching every value that starts with a text expression, e.g. the canonical form of the
+    text typed into a search bar. '%', '_' and the escape character are escaped so they only ever match themselves.
+    The pattern is constant folded before planning => prefix searches still use a 'varchar_pattern_ops' index.
+
+    :param expression: SQL expression of the prefix (containing the query parameter's placeholder)
+    :return: SQL expression of the pattern
+    """
+
+    return rf"replace(replace(replace({expression}, '\', '\\'), '%%', '\%%'), '_', '\_') || '%%'"
@@ -28,7 +28,8 @@ INSTALLED_APPS = [
     'debug_toolbar',
     'home',
     'releases',
-    'placements'
+    'placements',
+    'rising'
 ]
 
 MIDDLEWARE = [
@@ -40,6 +41,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'playlist_tracker.middleware.QueryProfilingMiddleware',
 ]
 
 INTERNAL_IPS = [
@@ -52,7 +54,7 @@ ROOT_URLCONF = 'playlist_tracker.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'BACKEND': 'playlist_tracker.middleware.ProfiledDjangoTemplates',  # DjangoTemplates + render timing
         'DIRS': [os.path.join(BASE_DIR, 'templates')],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -83,6 +85,59 @@ DATABASES = {
     }
 }
 
+# Optional read database (e.g. a streaming replica) for the dashboard's read-only queries, so they don't compete with
+# the ETL's loads on the primary. Reads fall back to the primary while it's unreachable or lagging (see db_routing.py).
+
+if os.getenv('POSTGRES_READ_HOST'):
+    DATABASES['replica'] = {
+        **DATABASES['default'],
+        'HOST': os.getenv('POSTGRES_READ_HOST'),
+        'PORT': int(os.getenv('POSTGRES_READ_PORT', 5432)),
+        'OPTIONS': {'connect_timeout': 2},  # an unreachable replica shouldn't hold up the fallback
+        'TEST': {'MIRROR': 'default'},
+    }
+
+DATABASE_READS = {
+    'ALIAS': 'replica',
+    'MAX_LAG_SECONDS': float(os.getenv('READ_MAX_LAG_SECONDS', 60)),
+    'CHECK_SECONDS': float(os.getenv('READ_CHECK_SECONDS', 10)),
+    'APPS': ['home', 'releases', 'placements', 'rising'],
+}
+
+DATABASE_ROUTERS = ['playlist_tracker.db_routing.ReadDatabaseRouter']
+
+
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'playlist-tracker',
+    }
+}
+
+
+# Query profiling (see playlist_tracker/middleware.py)
+
+QUERY_PROFILING = {
+    'ENABLED': os.getenv('QUERY_PROFILING_ENABLED', 'true') == 'true',
+    'SLOW_QUERY_MS': float(os.getenv('SLOW_QUERY_MS', 200)),
+    'EXPLAIN_SAMPLE_RATE': float(os.getenv('EXPLAIN_SAMPLE_RATE', 0)),
+}
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'playlist_tracker.slow_queries': {'handlers': ['console'], 'level': 'WARNING'},
+        'playlist_tracker.db_routing': {'handlers': ['console'], 'level': 'INFO'},
+    },
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -0,0 +1,43 @@
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase
+from plugins.dw_schema import TABLE_DEFINITIONS
+
+
+class DashboardTestCase(TestCase):
+
+    """
+    Test case whose test database holds the data warehouse's tables, which are created by 'PlaylistDW' rather than by
+    Django migrations. Every test runs in a transaction that's rolled back afterwards.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+
+        with connection.cursor() as cursor:
+            for statement in TABLE_DEFINITIONS:
+                cursor.execute(statement)
+
+    def setUp(self):
+
+        cache.clear()  # partials are cached by the state of the DW, which every test rolls back
+
+    def execute(self, sql, params=None):
+
+        """
+        :return: every row returned by a query (an empty list for statements that don't return rows)
+        """
+
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return cursor.fetchall() if cursor.description else []
+
+    def add_dates(self, start, end):
+
+        """
+        Adds the 'date_dim' rows of a date range
+        """
+
+        self.execute("""INSERT INTO date_dim (date_id, date)
+                        SELECT to_char(day, 'YYYYMMDD'), day FROM generate_series(%s::date, %s::date, '1 day') day""",
+                     [start, end])
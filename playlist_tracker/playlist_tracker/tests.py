@@ -0,0 +1,100 @@
+from types import SimpleNamespace
+from unittest import mock
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, OperationalError, connections
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from playlist_tracker import db_routing
+from playlist_tracker.testing import DashboardTestCase
+
+# a read database alias next to the primary (health checks are mocked => it's never connected to)
+WITH_REPLICA = {DEFAULT_DB_ALIAS: settings.DATABASES[DEFAULT_DB_ALIAS], 'replica': settings.DATABASES[DEFAULT_DB_ALIAS]}
+PRIMARY_ONLY = {DEFAULT_DB_ALIAS: settings.DATABASES[DEFAULT_DB_ALIAS]}
+
+
+class ReadAliasTests(TestCase):
+
+    def setUp(self):
+
+        db_routing._status.update(alias=DEFAULT_DB_ALIAS, checked_at=None)  # forget the previous test's health check
+
+    @override_settings(DATABASES=PRIMARY_ONLY)
+    def test_reads_stay_on_the_primary_without_a_read_database(self):
+
+        with mock.patch.object(db_routing, "read_database_is_fresh") as health_check:
+            self.assertEqual(db_routing.read_alias(), DEFAULT_DB_ALIAS)
+
+        health_check.assert_not_called()
+
+    @override_settings(DATABASES=WITH_REPLICA)
+    def test_healthy_read_database_is_used(self):
+
+        with mock.patch.object(db_routing, "read_database_is_fresh", return_value=True):
+            self.assertEqual(db_routing.read_alias(), 'replica')
+
+    @override_settings(DATABASES=WITH_REPLICA)
+    def test_reads_fall_back_to_the_primary(self):
+
+        with mock.patch.object(db_routing, "read_database_is_fresh", return_value=False):
+            self.assertEqual(db_routing.read_alias(), DEFAULT_DB_ALIAS)
+
+    @override_settings(DATABASES=WITH_REPLICA, DATABASE_READS={'CHECK_SECONDS': 10})
+    def test_health_check_is_reused_for_check_seconds(self):
+
+        with mock.patch.object(db_routing, "read_database_is_fresh", side_effect=[False, True]) as health_check, \
+                mock.patch.object(db_routing, "time", monotonic=mock.Mock(side_effect=[100, 105, 111])):
+            aliases = [db_routing.read_alias() for _ in range(3)]
+
+        self.assertEqual(aliases, [DEFAULT_DB_ALIAS, DEFAULT_DB_ALIAS, 'replica'])
+        self.assertEqual(health_check.call_count, 2)
+
+
+class ReadDatabaseIsFreshTests(TestCase):
+
+    def test_primary_has_no_lag(self):
+
+        self.assertTrue(db_routing.read_database_is_fresh(DEFAULT_DB_ALIAS))
+
+    def test_unreachable_database_is_not_fresh(self):
+
+        with mock.patch.object(connections[DEFAULT_DB_ALIAS], "cursor", side_effect=OperationalError):
+            self.assertFalse(db_routing.read_database_is_fresh(DEFAULT_DB_ALIAS))
+
+    @override_settings(DATABASE_READS={'MAX_LAG_SECONDS': 60})
+    def test_lagging_or_disconnected_replica_is_not_fresh(self):
+
+        for lag, fresh in ((30, True), (90, False), (None, False)):
+            cursor = mock.MagicMock()
+            cursor.__enter__.return_value.fetchone.return_value = (lag,)
+            with mock.patch.object(connections[DEFAULT_DB_ALIAS], "cursor", return_value=cursor):
+                self.assertEqual(db_routing.read_database_is_fresh(DEFAULT_DB_ALIAS), fresh, lag)
+
+
+class ReadDatabaseRouterTests(TestCase):
+
+    @override_settings(DATABASE_READS={'APPS': ['placements']})
+    def test_only_reads_of_the_dashboard_apps_are_routed(self):
+
+        router = db_routing.ReadDatabaseRouter()
+        model = SimpleNamespace(_meta=SimpleNamespace(app_label='placements'))
+        other_model = SimpleNamespace(_meta=SimpleNamespace(app_label='auth'))
+
+        with mock.patch.object(db_routing, "read_alias", return_value='replica'):
+            self.assertEqual(router.db_for_read(model), 'replica')
+            self.assertIsNone(router.db_for_read(other_model))
+            self.assertEqual(router.db_for_write(model), DEFAULT_DB_ALIAS)
+
+
+class SnapshotVersionTests(DashboardTestCase):
+
+    def test_partials_are_refreshed_when_the_dw_changes(self):
+
+        first = self.client.get(reverse('rising'))
+        cached = self.client.get(reverse('rising'), HTTP_IF_NONE_MATCH=first.headers['ETag'])
+        self.execute("UPDATE dw_data_version SET version = version + 1")  # e.g. 'compute_trends' finished
+        refreshed = self.client.get(reverse('rising'), HTTP_IF_NONE_MATCH=first.headers['ETag'])
+
+        self.assertEqual(cached.status_code, 304)
+        self.assertEqual(refreshed.status_code, 200)
+        self.assertNotEqual(refreshed.headers['ETag'], first.headers['ETag'])
@@ -1,5 +1,6 @@
 from django.contrib import admin
 from django.urls import path, include
+from playlist_tracker.middleware import profiling_summary
 import debug_toolbar
 
 urlpatterns = [
@@ -7,5 +8,7 @@ urlpatterns = [
     path('', include('home.urls')),
     path('__debug__', include(debug_toolbar.urls)),
     path('releases/', include('releases.urls')),
-    path('placements/', include('placements.urls'))
+    path('placements/', include('placements.urls')),
+    path('rising/', include('rising.urls')),
+    path('profiling/', profiling_summary, name='profiling')
 ]
\ No newline at end of file
@@ -0,0 +1,86 @@
+from django import forms
+
+
+class LabelForm(forms.Form):
+
+    label_search = forms.CharField(max_length=100, required=False)
+
+    # keyset values of the last artist on the previous page of the dropdown
+    after_name = forms.CharField(max_length=40, required=False, strip=False)
+    after_id = forms.IntegerField(min_value=1, required=False)
+
+
+class EntityTypeField(forms.MultipleChoiceField):
+
+    """
+    Entity types a search is filtered by. An empty value (the 'Everything' option) is ignored.
+    """
+
+    def to_python(self, value):
+
+        return [entity_type for entity_type in super().to_python(value) if entity_type]
+
+
+class SearchForm(forms.Form):
+
+    q = forms.CharField(max_length=100)
+    type = EntityTypeField(choices=[("track", "Tracks"), ("artist", "Artists"), ("album", "Albums"),
+                                    ("label", "Labels")],
+                           required=False)  # no type selected => search every type
+
+
+class ArtistForm(forms.Form):
+
+    label_search = forms.CharField(max_length=100, required=False)
+    artist_id = forms.IntegerField(min_value=1)
+
+
+class TrackForm(forms.Form):
+
+    track_id = forms.IntegerField(min_value=1)
+    artist_id = forms.IntegerField(min_value=1)
+
+
+class IdListField(forms.Field):
+
+    """
+    Collects every value supplied for a repeated query string parameter (e.g. ?track_id=1&track_id=2) as a list of ids
+    """
+
+    widget = forms.MultipleHiddenInput
+
+    def __init__(self, *, max_ids=50, **kwargs):
+
+        self.max_ids = max_ids
+        super().__init__(**kwargs)
+
+    def to_python(self, value):
+
+        if not value:
+            return []
+
+        try:
+            ids = [int(i) for i in value]
+        except (TypeError, ValueError):
+            raise forms.ValidationError("Enter a list of whole numbers")
+
+        ids = list(dict.fromkeys(ids))  # drop repeated selections, keep their order
+        if len(ids) > self.max_ids:
+            raise forms.ValidationError(f"Compare at most {self.max_ids} ids at a time")
+
+        return ids
+
+
+class CompareForm(forms.Form):
+
+    track_id = IdListField(required=False)
+    artist_id = IdListField(required=False)
+
+    def clean(self):
+
+        cleaned_data = super().clean()
+
+        if not cleaned_data.get("track_id") and not cleaned_data.get("artist_id"):
+            raise forms.ValidationError("Select at least one track or artist to compare")
+
+        return cleaned_data
@@ -1,3 +1,44 @@
-from django.test import TestCase
+from playlist_tracker.testing import DashboardTestCase
+from playlist_tracker.pagination import like_prefix
+from .views import fetch_artists
 
-# Create your tests here.
+
+class LikePrefixTests(DashboardTestCase):
+
+    def matches(self, value, prefix):
+
+        return self.execute(f"SELECT %s LIKE {like_prefix('%s')}", [value, prefix])[0][0]
+
+    def test_wildcards_only_match_themselves(self):
+
+        self.assertTrue(self.matches("50% Records", "50%"))
+        self.assertFalse(self.matches("500 Records", "50%"))
+        self.assertTrue(self.matches("a_b", "a_"))
+        self.assertFalse(self.matches("ab", "a_"))
+        self.assertTrue(self.matches("back\\slash", "back\\"))
+
+    def test_prefix_matches_the_start_only(self):
+
+        self.assertTrue(self.matches("Sony Music", "Son"))
+        self.assertFalse(self.matches("Big Sony", "Son"))
+
+
+class ArtistPaginationTests(DashboardTestCase):
+
+    def test_artists_without_a_name_are_paged(self):
+
+        self.execute("INSERT INTO label_dim (label_name, canonical_name) VALUES ('Label', 'label')")
+        self.execute("""INSERT INTO track_dim (track_spotify_id, label_id)
+                        SELECT 'track', label_id FROM label_dim""")
+        self.execute("""INSERT INTO artist_dim (artist_spotify_id, artist_name)
+                        SELECT lpad(i::text, 22, '0'), CASE WHEN i % 2 = 0 THEN 'Artist ' || i END
+                        FROM generate_series(1, 60) i""")
+        self.execute("""INSERT INTO track_artist_bridge (track_id, artist_id)
+                        SELECT track_id, artist_id FROM track_dim CROSS JOIN artist_dim""")
+
+        artist_data, next_url = fetch_artists("lab")
+        last_id, last_name = artist_data[-1]
+        more_artists, next_url = fetch_artists("lab", last_name, last_id)
+
+        self.assertEqual(len(artist_data) + len(more_artists), 60)
+        self.assertIsNone(next_url)
@@ -3,7 +3,12 @@ from . import views
 
 urlpatterns = [
     path('', views.labels, name='labels'),
+    path('label-suggestions/', views.label_suggestions, name='label-suggestions'),
+    path('search/', views.search, name='search'),
     path('artists/', views.artists, name='artists'),
+    path('artist-options/', views.artist_options, name='artist-options'),
     path('tracks/', views.releases, name='tracks'),
-    path('track-plot/', views.display_plots, name='track-plot')
+    path('track-plot/', views.display_plots, name='track-plot'),
+    path('compare/', views.compare, name='compare'),
+    path('compare-item/', views.compare_item, name='compare-item')
 ]
\ No newline at end of file
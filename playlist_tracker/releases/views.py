@@ -1,63 +1,180 @@
 from django.shortcuts import render
-from django.db import connection
-import ast
+from django.http import HttpResponseBadRequest
+from playlist_tracker.caching import cached_partial
+from playlist_tracker.middleware import profile_section
+from playlist_tracker.pagination import fetch_page, like_prefix, next_page_url
+from playlist_tracker.db_routing import read_connection
+from .forms import LabelForm, SearchForm, ArtistForm, TrackForm, CompareForm
+import re
 import pandas as pd
 import plotly.express as px
 from plotly.io import to_html
 from collections import defaultdict
 
+# labels whose canonical name (see 'label_dim') starts with the search text => an index range scan on 'label_dim'
+matching_labels = f"SELECT label_id FROM label_dim WHERE canonical_name LIKE {like_prefix('canonical_label_name(%s)')}"
+
 
 def labels(request):
 
-    with connection.cursor() as cursor:
-        cursor.execute("SELECT DISTINCT(label_name) FROM track_dim")
-        labels = [label[0] for label in cursor.fetchall()]
+    return render(request, 'releases/releases.html')
 
-    context = {'labels': labels}
 
-    return render(request, 'releases/releases.html', context)
+@cached_partial
+def label_suggestions(request):
 
+    form = LabelForm(request.GET)
+    if not form.is_valid():
+        return HttpResponseBadRequest(form.errors.as_text())
 
-def artists(request):
+    label = form.cleaned_data['label_search']
 
-    label = request.GET.get('label_search')
+    with read_connection().cursor() as cursor:
+        label_query = f"""
+            SELECT label_name
+            FROM label_dim
+            WHERE canonical_name LIKE {like_prefix('canonical_label_name(%s)')}
+            ORDER BY label_name
+            LIMIT %s
+        """
+        labels, has_more = fetch_page(cursor, label_query, [label], page_size=20)
 
-    with connection.cursor() as cursor:
+    context = {'labels': [row[0] for row in labels]}
 
-        artist_query = """
-            SELECT DISTINCT tpf.artist_id, artist_name
-            FROM track_artist_fact tpf
-            JOIN track_dim td ON td.track_id = tpf.track_id
-            JOIN artist_dim ad ON ad.artist_id = tpf.artist_id
-            WHERE label_name ILIKE %s
-            ORDER BY artist_name ASC
+    return render(request, 'releases/partials/label_suggestions.html', context)
+
+
+def build_search_query(text):
+
+    """
+    Turns the search text into a 'to_tsquery' expression where every word is a prefix (so results show up while the
+    user is still typing), e.g. 'daft pun' => 'daft:* & pun:*'
+    """
+
+    return " & ".join(f"{word}:*" for word in re.findall(r"\w+", text))
+
+
+@cached_partial
+def search(request):
+
+    form = SearchForm(request.GET)
+    if not form.is_valid():
+        return HttpResponseBadRequest(form.errors.as_text())
+
+    text = form.cleaned_data['q']
+    entity_types = form.cleaned_data['type'] or ["track", "artist", "album", "label"]
+    results = []
+
+    ts_query = build_search_query(text)
+    if ts_query:
+        # full-text matches (any word prefix) or close spellings (trigram similarity) => both GIN indexed
+        search_query = """
+            SELECT entity_type, entity_key, entity_name, detail, artist_id
+            FROM search_index, to_tsquery('simple', %s) query
+            WHERE (search_vector @@ query OR entity_name %% %s) AND entity_type = ANY(%s)
+            ORDER BY search_vector @@ query DESC,
+                     greatest(ts_rank(search_vector, query), similarity(entity_name, %s)) DESC,
+                     length(entity_name), entity_key
+            LIMIT %s
         """
-        cursor.execute(artist_query, [f"%{label}%"])
-        artists = [artist for artist in cursor.fetchall()]
-        artist_data = [(label, i[0], i[1]) for i in artists]
+        with read_connection().cursor() as cursor:
+            results, has_more = fetch_page(cursor, search_query, [ts_query, text, entity_types, text], page_size=20)
+
+    context = {'results': results,
+               'query': text}
+
+    return render(request, 'releases/partials/search_results.html', context)
+
 
-    context = {'artist_data': artist_data}
+def fetch_artists(label, after_name=None, after_id=None):
+
+    """
+    Grabs a single page of the artists who've released tracks on a label of interest, ordered by name
+
+    :param label: (partial) label name typed into the search bar
+    :param after_name: name of the last artist on the previous page (None for the first page)
+    :param after_id: id of the last artist on the previous page
+    :return: list of (artist id, artist name) tuples + the url of the next page (None if this is the last page)
+    """
+
+    artist_query = f"""
+        SELECT DISTINCT tpf.artist_id, coalesce(artist_name, '') AS artist_name
+        FROM track_artist_bridge tpf
+        JOIN track_dim td ON td.track_id = tpf.track_id
+        JOIN artist_dim ad ON ad.artist_id = tpf.artist_id
+        WHERE td.label_id IN ({matching_labels}) {{keyset}}
+        ORDER BY coalesce(artist_name, '') ASC, tpf.artist_id ASC
+        LIMIT %s
+    """
+
+    with read_connection().cursor() as cursor:
+        if after_id is None:
+            artist_data, has_more = fetch_page(cursor, artist_query.format(keyset=""), [label])
+        else:
+            keyset = "AND (coalesce(artist_name, ''), tpf.artist_id) > (%s, %s)"  # a NULL name would end the pages
+            artist_data, has_more = fetch_page(cursor, artist_query.format(keyset=keyset),
+                                               [label, after_name, after_id])
+
+    next_url = None
+    if has_more:
+        next_url = next_page_url('artist-options', {'label_search': label,
+                                                    'after_name': artist_data[-1][1],
+                                                    'after_id': artist_data[-1][0]})
+
+    return artist_data, next_url
+
+
+@cached_partial
+def artists(request):
+
+    form = LabelForm(request.GET)
+    if not form.is_valid():
+        return HttpResponseBadRequest(form.errors.as_text())
+
+    artist_data, next_url = fetch_artists(form.cleaned_data['label_search'])
+
+    context = {'artist_data': artist_data,
+               'next_url': next_url}
 
     return render(request, 'releases/partials/artists.html', context)
 
 
+@cached_partial
+def artist_options(request):
+
+    form = LabelForm(request.GET)
+    if not form.is_valid():
+        return HttpResponseBadRequest(form.errors.as_text())
+
+    artist_data, next_url = fetch_artists(form.cleaned_data['label_search'],
+                                          form.cleaned_data['after_name'],
+                                          form.cleaned_data['after_id'])
+
+    context = {'artist_data': artist_data,
+               'next_url': next_url}
+
+    return render(request, 'releases/partials/artist_options.html', context)
+
+
+@cached_partial
 def releases(request):
 
-    artist_data = request.GET.get('artist_dropdown')
-    artist_data_tuple = ast.literal_eval(artist_data)
+    form = ArtistForm(request.GET)
+    if not form.is_valid():
+        return HttpResponseBadRequest(form.errors.as_text())
 
-    label = artist_data_tuple[0]
-    artist_id = artist_data_tuple[1]
+    label = form.cleaned_data['label_search']
+    artist_id = form.cleaned_data['artist_id']
 
-    release_search = """
+    release_search = f"""
             SELECT DISTINCT tpf.track_id, track_name, artist_id
-            FROM track_artist_fact tpf
+            FROM track_artist_bridge tpf
             JOIN track_dim td ON td.track_id = tpf.track_id
-            WHERE artist_id = %s and label_name ILIKE %s
+            WHERE artist_id = %s and td.label_id IN ({matching_labels})
         """
 
-    with connection.cursor() as cursor:
-        cursor.execute(release_search, [artist_id, f"%{label}%"])
+    with read_connection().cursor() as cursor:
+        cursor.execute(release_search, [artist_id, label])
         releases = [release for release in cursor.fetchall()]
 
     context = {'releases': releases}
@@ -65,25 +182,24 @@ def releases(request):
     return render(request, 'releases/partials/tracks.html', context)
 
 
-def prepare_plot_data(request):
-
-    track_data = request.GET.get('track_dropdown')
-    track_data = ast.literal_eval(track_data)
-
-    track_id = track_data[0]
-    artist_id = track_data[2]
+def prepare_plot_data(track_id, artist_id):
 
     plot_data_search = """
-            SELECT date, track_popularity, artist_popularity, artist_followers
-            FROM track_artist_fact taf
-            JOIN date_dim dd ON dd.date_id = taf.date_id
-            JOIN artist_dim ad ON ad.artist_id = taf.artist_id
-            WHERE track_id = %s AND taf.artist_id = %s
+            SELECT tmd.date, track_popularity, artist_popularity, artist_followers
+            FROM track_metrics_dense tmd  -- gaps left by change-only storage are filled in
+            JOIN artist_metrics_dense amd ON amd.date_id = tmd.date_id AND amd.artist_id = %(artist_id)s
+            WHERE tmd.track_id = %(track_id)s
+            UNION ALL
+            -- older history is kept as monthly averages (see 'PlaylistDW.apply_retention')
+            SELECT tmm.month, avg_track_popularity, avg_artist_popularity, max_artist_followers
+            FROM track_metrics_monthly tmm
+            JOIN artist_metrics_monthly amm ON amm.month = tmm.month AND amm.artist_id = %(artist_id)s
+            WHERE tmm.track_id = %(track_id)s
             ORDER by date ASC
         """
 
-    with connection.cursor() as cursor:
-        cursor.execute(plot_data_search, [track_id, artist_id])
+    with read_connection().cursor() as cursor:
+        cursor.execute(plot_data_search, {'track_id': track_id, 'artist_id': artist_id})
         plot_data = [row for row in cursor.fetchall()]
 
     plot_df = pd.DataFrame(plot_data, columns=["Date", "Track Pop", "Artist Pop", "Artist Followers"])
@@ -96,7 +212,8 @@ def prepare_plot_data(request):
     return plot_df
 
 
-def create_time_series_plot(df, y, title, hover_cols=("Date",)):
+@profile_section("chart")
+def create_time_series_plot(df, y, title, hover_cols=("Date",), color=None):
 
     hover_dict = defaultdict(bool)
 
@@ -107,7 +224,8 @@ def create_time_series_plot(df, y, title, hover_cols=("Date",)):
                   x="Date",
                   y=y,
                   title=title,
-                  hover_data=hover_dict
+                  hover_data=hover_dict,
+                  color=color
                   )
 
     fig.update_layout(
@@ -128,9 +246,14 @@ def create_time_series_plot(df, y, title, hover_cols=("Date",)):
     return line_chart
 
 
+@cached_partial
 def display_plots(request):
 
-    data = prepare_plot_data(request)
+    form = TrackForm(request.GET)
+    if not form.is_valid():
+        return HttpResponseBadRequest(form.errors.as_text())
+
+    data = prepare_plot_data(form.cleaned_data['track_id'], form.cleaned_data['artist_id'])
 
     # create the 3 plots to display on the page
     date_vs_track_pop = create_time_series_plot(data, "Track Pop", "Track Popularity over time",
@@ -142,9 +265,139 @@ def display_plots(request):
 
     context = {'date_vs_track': date_vs_track_pop,
                'date_vs_artist_pop': date_vs_artist_pop,
-               'date_vs_artist_foll': date_vs_artist_followers}
+               'date_vs_artist_foll': date_vs_artist_followers,
+               'track_id': form.cleaned_data['track_id'],
+               'artist_id': form.cleaned_data['artist_id']}
 
     return render(request, 'releases/partials/track_plot.html', context)
 
 
+def prepare_comparison_data(track_ids, artist_ids):
+
+    """
+    Grabs the time series for every selected track and artist in a single query
+
+    :param track_ids: list of track IDs (track_dim.track_id)
+    :param artist_ids: list of artist IDs (artist_dim.artist_id)
+    :return: dataframe with one row per entity + date
+    """
+
+    comparison_search = """
+            SELECT 'Track' as entity_type, tmd.track_id as entity_id, track_name as entity_name, date,
+                   track_popularity as popularity, NULL::int as followers
+            FROM track_metrics_dense tmd
+            JOIN track_dim td ON td.track_id = tmd.track_id
+            WHERE tmd.track_id = ANY(%s)
+            UNION ALL
+            SELECT 'Track', tmm.track_id, track_name, month, avg_track_popularity, NULL
+            FROM track_metrics_monthly tmm
+            JOIN track_dim td ON td.track_id = tmm.track_id
+            WHERE tmm.track_id = ANY(%s)
+            UNION ALL
+            SELECT 'Artist', amd.artist_id, artist_name, date, artist_popularity, artist_followers
+            FROM artist_metrics_dense amd
+            JOIN artist_dim ad ON ad.artist_id = amd.artist_id
+            WHERE amd.artist_id = ANY(%s)
+            UNION ALL
+            SELECT 'Artist', amm.artist_id, artist_name, month, avg_artist_popularity, max_artist_followers
+            FROM artist_metrics_monthly amm
+            JOIN artist_dim ad ON ad.artist_id = amm.artist_id
+            WHERE amm.artist_id = ANY(%s)
+            ORDER BY 1, 2, 4
+        """
+
+    with read_connection().cursor() as cursor:
+        cursor.execute(comparison_search, [track_ids, track_ids, artist_ids, artist_ids])
+        comparison_data = [row for row in cursor.fetchall()]
+
+    comparison_df = pd.DataFrame(comparison_data, columns=["Type", "ID", "Name", "Date", "Popularity", "Followers"])
+    comparison_df['Date'] = pd.to_datetime(comparison_df['Date'])
+    comparison_df['Followers'] = pd.to_numeric(comparison_df['Followers'])  # tracks don't have follower counts
+    comparison_df['Label'] = comparison_df['Type'] + ": " + comparison_df['Name']  # tracks + artists can share names
+
+    return comparison_df
+
+
+def summarize_comparison_data(df):
+
+    """
+    Computes summary stats (growth rates + peak popularity) for each track / artist in a comparison
+
+    :param df: dataframe returned by 'prepare_comparison_data'
+    :return: dataframe with one row per track / artist
+    """
+
+    grouped = df.groupby("Label", sort=False)
+    first = grouped.first()
+    last = grouped.last()
+    peak_rows = df.loc[grouped["Popularity"].idxmax()].set_index("Label")
+    first_popularity = first["Popularity"].where(first["Popularity"] != 0)  # avoid dividing by a score of 0
+    first_followers = first["Followers"].where(first["Followers"] != 0)
+
+    summary = pd.DataFrame({
+        "Latest Popularity": last["Popularity"],
+        "Popularity Change": last["Popularity"] - first["Popularity"],
+        "Popularity Growth (%)": ((last["Popularity"] - first["Popularity"]) / first_popularity * 100).round(2),
+        "Peak Popularity": peak_rows["Popularity"],
+        "Peak Date": peak_rows["Date"].dt.date,
+        "Follower Growth (%)": ((last["Followers"] - first["Followers"]) / first_followers * 100).round(2),
+        "Weeks Tracked": grouped.size(),
+    })
+
+    return summary.reset_index().rename(columns={"Label": "Track / Artist"})
+
+
+@cached_partial
+def compare(request):
+
+    form = CompareForm(request.GET)
+    if not form.is_valid():
+        return HttpResponseBadRequest(form.errors.as_text())
+
+    data = prepare_comparison_data(form.cleaned_data['track_id'], form.cleaned_data['artist_id'])
+
+    track_data = data[data["Type"] == "Track"]
+    artist_data = data[data["Type"] == "Artist"]
+
+    context = {'headers': [],
+               'rows': []}
+
+    if not track_data.empty:
+        context['track_pop'] = create_time_series_plot(track_data, "Popularity", "Track Popularity over time",
+                                                       hover_cols=("Date", "Popularity"), color="Label")
+    if not artist_data.empty:
+        context['artist_pop'] = create_time_series_plot(artist_data, "Popularity", "Artist Popularity over time",
+                                                        hover_cols=("Date", "Popularity", "Followers"),
+                                                        color="Label")
+        context['artist_foll'] = create_time_series_plot(artist_data, "Followers", "Artist Followers over time",
+                                                         hover_cols=("Date", "Followers"), color="Label")
+    if not data.empty:
+        summary = summarize_comparison_data(data)
+        context['headers'] = list(summary.columns)
+        context['rows'] = summary.fillna("").to_dict(orient="records")
+
+    return render(request, 'releases/compare.html', context)
+
+
+def compare_item(request):
+
+    form = TrackForm(request.GET)
+    if not form.is_valid():
+        return HttpResponseBadRequest(form.errors.as_text())
+
+    name_search = """
+            SELECT track_name, artist_name
+            FROM track_dim td, artist_dim ad
+            WHERE track_id = %s AND artist_id = %s
+        """
+
+    with read_connection().cursor() as cursor:
+        cursor.execute(name_search, [form.cleaned_data['track_id'], form.cleaned_data['artist_id']])
+        names = cursor.fetchone()
+
+    context = {'track_id': form.cleaned_data['track_id'],
+               'artist_id': form.cleaned_data['artist_id'],
+               'track_name': names[0] if names else "",
+               'artist_name': names[1] if names else ""}
 
+    return render(request, 'releases/partials/compare_item.html', context)
@@ -0,0 +1,31 @@
+from django.urls import reverse
+from playlist_tracker.testing import DashboardTestCase
+
+
+class LeaderboardTests(DashboardTestCase):
+
+    def test_latest_trends_are_ranked(self):
+
+        self.add_dates("2024-09-03", "2024-09-10")
+        self.execute("""INSERT INTO track_dim (track_spotify_id, track_name)
+                        VALUES ('first', 'Rising Track'), ('second', 'Steady Track')""")
+        self.execute("""INSERT INTO track_trend (date_id, track_id, popularity_delta, label_zscore, trend_score,
+                                                 trend_rank)
+                        SELECT date_id, track_id, 1, NULL, rank, rank
+                        FROM track_dim
+                        JOIN (VALUES ('Rising Track', 1), ('Steady Track', 2)) ranks (track_name, rank)
+                            USING (track_name)
+                        CROSS JOIN (VALUES ('20240903'), ('20240910')) dates (date_id)""")
+
+        response = self.client.get(reverse('rising'))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['date_id'], '20240910')
+        self.assertEqual([row[:2] for row in response.context['tracks']], [(1, 'Rising Track'), (2, 'Steady Track')])
+
+    def test_page_renders_before_the_first_trends(self):
+
+        response = self.client.get(reverse('rising'))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['tracks'], [])
@@ -0,0 +1,51 @@
+from django.shortcuts import render
+from playlist_tracker.caching import cached_partial
+from playlist_tracker.db_routing import read_connection
+
+LEADERBOARD_SIZE = 50
+
+
+@cached_partial
+def leaderboard(request):
+
+    with read_connection().cursor() as cursor:
+
+        cursor.execute("SELECT max(date_id) FROM track_trend")
+        date_id = cursor.fetchone()[0]
+
+        track_query = """
+            SELECT trend_rank, track_name, ld.label_name, track_popularity, popularity_delta, playlist_count,
+                   playlist_add_velocity, label_zscore, trend_score
+            FROM track_trend tt
+            JOIN track_dim td ON td.track_id = tt.track_id
+            LEFT JOIN label_dim ld ON ld.label_id = td.label_id
+            WHERE date_id = %s
+            ORDER BY trend_rank
+            LIMIT %s
+        """
+        cursor.execute(track_query, [date_id, LEADERBOARD_SIZE])
+        tracks = cursor.fetchall()
+        track_headers = ["rank", "track", "label", "popularity", "popularity change", "playlists",
+                         "playlist adds", "label z-score", "score"]
+
+        artist_query = """
+            SELECT trend_rank, artist_name, artist_popularity, popularity_delta, artist_followers,
+                   round(follower_growth_rate * 100, 2), playlist_count, playlist_add_velocity, trend_score
+            FROM artist_trend art
+            JOIN artist_dim ad ON ad.artist_id = art.artist_id
+            WHERE date_id = %s
+            ORDER BY trend_rank
+            LIMIT %s
+        """
+        cursor.execute(artist_query, [date_id, LEADERBOARD_SIZE])
+        artists = cursor.fetchall()
+        artist_headers = ["rank", "artist", "popularity", "popularity change", "followers", "follower growth (%)",
+                          "playlists", "playlist adds", "score"]
+
+    context = {'date_id': date_id,
+               'tracks': tracks,
+               'track_headers': track_headers,
+               'artists': artists,
+               'artist_headers': artist_headers}
+
+    return render(request, 'rising/rising.html', context)
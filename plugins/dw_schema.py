@@ -0,0 +1,736 @@
+"""
+DDL for the data warehouse's tables. Kept free of Airflow imports so the schema can also be created by scripts
+(e.g. the benchmarks) that talk to postgres directly.
+"""
+
+
+# create the dimensions
+create_date = """CREATE TABLE IF NOT EXISTS date_dim (
+                    date_id char(8),
+                    date DATE,
+                    date_description varchar(18),  -- e.g. 'September 30, 2024'
+                    calendar_year char(4),
+                    calendar_quarter SMALLINT,
+                    calendar_month_num SMALLINT,
+                    calendar_month_name varchar(9),
+                    calendar_month_day_num SMALLINT,
+                    day_of_week varchar(9),
+                    constraint date_id_pk primary key (date_id)
+                    )
+                """
+
+# warehouses created while 'date_description' was a varchar(17) can't store the September dates
+widen_date_description = """ALTER TABLE date_dim ALTER COLUMN date_description TYPE varchar(18)"""
+
+create_playlist = """CREATE TABLE IF NOT EXISTS playlist_dim (
+                        playlist_id SERIAL,
+                        playlist_spotify_id char(22), 
+                        playlist_name varchar(40), 
+                        constraint plist_id_pk primary key (playlist_id),
+                        constraint unique_playlist_spotify_id unique (playlist_spotify_id)
+                        )
+                    """
+
+create_track = """CREATE TABLE IF NOT EXISTS track_dim (
+                        track_id SERIAL,
+                        track_spotify_id char(22),
+                        track_name varchar(100),
+                        track_duration_ms INTEGER,
+                        track_isrc char(12),
+                        track_album_position SMALLINT,
+                        album_id char(22),
+                        album_name varchar(100),
+                        album_release_date DATE,
+                        album_type varchar(20),
+                        album_total_tracks SMALLINT,
+                        album_upc varchar(20),
+                        label_name varchar(100),
+                        constraint track_id_pk primary key (track_id),
+                        constraint unique_track_spotify_id unique (track_spotify_id)
+                        )
+                    """
+
+create_artist = """CREATE TABLE IF NOT EXISTS artist_dim (
+                        artist_id SERIAL,
+                        artist_spotify_id char(22),
+                        artist_name varchar(40),
+                        constraint artist_id_pk primary key (artist_id),
+                        constraint unique_artist_spotify_id unique (artist_spotify_id)
+                        )
+                """
+
+
+# create the fact tables
+# latest metrics of each track / artist => one row per entity + snapshot
+create_track_metrics = """CREATE TABLE IF NOT EXISTS track_metrics_fact (
+                                track_id INTEGER,
+                                date_id char(8),
+                                track_popularity SMALLINT,
+                                constraint track_metrics_pk primary key (track_id, date_id),
+                                constraint track_metrics_fk1 foreign key (track_id) references track_dim (track_id),
+                                constraint track_metrics_fk2 foreign key (date_id) references date_dim (date_id)
+                                )
+                            """
+
+create_artist_metrics = """CREATE TABLE IF NOT EXISTS artist_metrics_fact (
+                                artist_id INTEGER,
+                                date_id char(8),
+                                artist_popularity SMALLINT,
+                                artist_followers INT,
+                                constraint artist_metrics_pk primary key (artist_id, date_id),
+                                constraint artist_metrics_fk1 foreign key (artist_id) references artist_dim (artist_id),
+                                constraint artist_metrics_fk2 foreign key (date_id) references date_dim (date_id)
+                                )
+                            """
+
+# which artists are credited on which tracks (stored once, not once per snapshot)
+create_track_artist_bridge = """CREATE TABLE IF NOT EXISTS track_artist_bridge (
+                                    track_id INTEGER,
+                                    artist_id INTEGER,
+                                    constraint track_artist_bridge_pk primary key (track_id, artist_id),
+                                    constraint track_artist_bridge_fk1 foreign key (track_id) references track_dim (track_id),
+                                    constraint track_artist_bridge_fk2 foreign key (artist_id) references artist_dim (artist_id)
+                                    );
+                                CREATE INDEX IF NOT EXISTS track_artist_bridge_artist ON track_artist_bridge (artist_id)
+                              """
+
+create_track_playlist = """CREATE TABLE IF NOT EXISTS track_playlist_fact (
+                                track_id INTEGER,
+                                playlist_id INTEGER,
+                                date_id char(8),
+                                track_playlist_position SMALLINT,
+                                track_popularity SMALLINT,
+                                constraint track_playlist_pk primary key (track_id, playlist_id, date_id),
+                                constraint track_playlist_fk1 foreign key (track_id) references track_dim (track_id),
+                                constraint track_playlist_fk2 foreign key (playlist_id) references playlist_dim (playlist_id),
+                                constraint track_playlist_fk3 foreign key (date_id) references date_dim (date_id)
+                                )
+                            """
+
+
+# queue of newly tracked playlists waiting for their first load
+create_backfill_job = """CREATE TABLE IF NOT EXISTS playlist_backfill_job (
+                                job_id SERIAL,
+                                playlist_id INTEGER,
+                                status varchar(10) DEFAULT 'pending',
+                                progress varchar(60),
+                                requested_at TIMESTAMP DEFAULT now(),
+                                started_at TIMESTAMP,
+                                finished_at TIMESTAMP,
+                                error_message TEXT,
+                                constraint backfill_job_pk primary key (job_id),
+                                constraint backfill_job_fk1 foreign key (playlist_id) references playlist_dim (playlist_id)
+                                )
+                            """
+
+
+# only one pending / running job per playlist
+create_backfill_index = """CREATE UNIQUE INDEX IF NOT EXISTS backfill_job_in_flight
+                                ON playlist_backfill_job (playlist_id)
+                                WHERE status IN ('pending', 'running')
+                            """
+
+
+# ranked growth metrics computed after each load
+create_track_trend = """CREATE TABLE IF NOT EXISTS track_trend (
+                            date_id char(8),
+                            track_id INTEGER,
+                            track_popularity SMALLINT,
+                            popularity_delta SMALLINT,
+                            playlist_count SMALLINT,
+                            playlist_add_velocity SMALLINT,
+                            label_zscore NUMERIC(8, 3),
+                            trend_score NUMERIC(8, 3),
+                            trend_rank INTEGER,
+                            constraint track_trend_pk primary key (date_id, track_id),
+                            constraint track_trend_fk1 foreign key (track_id) references track_dim (track_id),
+                            constraint track_trend_fk2 foreign key (date_id) references date_dim (date_id)
+                            )
+                        """
+
+create_artist_trend = """CREATE TABLE IF NOT EXISTS artist_trend (
+                            date_id char(8),
+                            artist_id INTEGER,
+                            artist_popularity SMALLINT,
+                            popularity_delta SMALLINT,
+                            artist_followers INT,
+                            follower_growth_rate NUMERIC,  -- unbounded => an artist going from 1 to 10M followers fits
+                            playlist_count SMALLINT,
+                            playlist_add_velocity SMALLINT,
+                            trend_score NUMERIC(8, 3),
+                            trend_rank INTEGER,
+                            constraint artist_trend_pk primary key (date_id, artist_id),
+                            constraint artist_trend_fk1 foreign key (artist_id) references artist_dim (artist_id),
+                            constraint artist_trend_fk2 foreign key (date_id) references date_dim (date_id)
+                            )
+                        """
+
+# warehouses created before the column was unbounded
+widen_follower_growth_rate = """ALTER TABLE artist_trend ALTER COLUMN follower_growth_rate TYPE NUMERIC"""
+
+create_trend_rank_index = """CREATE INDEX IF NOT EXISTS track_trend_rank ON track_trend (date_id, trend_rank);
+                             CREATE INDEX IF NOT EXISTS artist_trend_rank ON artist_trend (date_id, trend_rank)
+                          """
+
+
+# adds / drops / position moves between a playlist's consecutive snapshots
+create_playlist_movement = """CREATE TABLE IF NOT EXISTS playlist_movement_fact (
+                                track_id INTEGER,
+                                playlist_id INTEGER,
+                                date_id char(8),
+                                prev_date_id char(8),
+                                movement_type varchar(4),
+                                previous_position SMALLINT,
+                                current_position SMALLINT,
+                                position_change SMALLINT,
+                                constraint playlist_movement_pk primary key (track_id, playlist_id, date_id),
+                                constraint playlist_movement_fk1 foreign key (track_id) references track_dim (track_id),
+                                constraint playlist_movement_fk2 foreign key (playlist_id) references playlist_dim (playlist_id),
+                                constraint playlist_movement_fk3 foreign key (date_id) references date_dim (date_id)
+                                )
+                            """
+
+create_playlist_movement_index = """CREATE INDEX IF NOT EXISTS playlist_movement_playlist_date
+                                        ON playlist_movement_fact (playlist_id, date_id)
+                                """
+
+
+# each label's share of the playlist placements in a snapshot, rolled up over CUBE (label, playlist) => grouping_level
+# 0 = a label on one playlist, 1 = a label across every playlist, 2 = a playlist's total, 3 = the snapshot's total
+create_label_share = """CREATE TABLE IF NOT EXISTS label_share_weekly (
+                            date_id char(8),
+                            grouping_level SMALLINT,
+                            label_id INTEGER,  -- NULL on the levels 0 + 1 rows of the tracks without a label
+                            playlist_id INTEGER,
+                            placements INTEGER,
+                            track_count INTEGER,
+                            top_10_placements INTEGER,
+                            avg_position NUMERIC(6, 2),
+                            placement_share NUMERIC(7, 6),  -- share of the playlist's (level 0) / every placement
+                            constraint label_share_weekly_fk1 foreign key (date_id) references date_dim (date_id),
+                            constraint label_share_weekly_fk2 foreign key (label_id) references label_dim (label_id),
+                            constraint label_share_weekly_fk3 foreign key (playlist_id) references playlist_dim (playlist_id)
+                            );
+                        CREATE UNIQUE INDEX IF NOT EXISTS label_share_weekly_key
+                            ON label_share_weekly (date_id, grouping_level, coalesce(label_id, 0), coalesce(playlist_id, 0));
+                        CREATE INDEX IF NOT EXISTS label_share_weekly_label
+                            ON label_share_weekly (label_id, grouping_level, date_id)
+                     """
+
+# rolls up the placements of the given snapshots ('PlaylistDW.update_label_share'). Each row's share is taken against
+# the same snapshot's playlist total (level 0) or overall total (levels 1-3), read from the rollup itself.
+build_label_share = """
+    INSERT INTO label_share_weekly (date_id, grouping_level, label_id, playlist_id, placements, track_count,
+                                    top_10_placements, avg_position, placement_share)
+    WITH placement_rollup AS (
+        SELECT
+            tpf.date_id,
+            GROUPING(td.label_id, tpf.playlist_id) AS grouping_level,
+            td.label_id,
+            tpf.playlist_id,
+            count(*) AS placements,
+            count(DISTINCT tpf.track_id) AS track_count,
+            count(*) FILTER (WHERE tpf.track_playlist_position <= 10) AS top_10_placements,
+            round(avg(tpf.track_playlist_position), 2) AS avg_position
+        FROM track_playlist_fact tpf
+        JOIN track_dim td ON td.track_id = tpf.track_id
+        WHERE tpf.date_id = ANY(%(date_ids)s::bpchar[])
+        GROUP BY tpf.date_id, CUBE (td.label_id, tpf.playlist_id)
+    )
+    SELECT r.date_id, r.grouping_level, r.label_id, r.playlist_id, r.placements, r.track_count, r.top_10_placements,
+           r.avg_position, round(r.placements::numeric / total.placements, 6)
+    FROM placement_rollup r
+    JOIN placement_rollup total ON total.date_id = r.date_id
+        AND total.grouping_level = CASE WHEN r.grouping_level = 0 THEN 2 ELSE 3 END
+        AND (total.grouping_level = 3 OR total.playlist_id = r.playlist_id)
+"""
+
+
+# the fact tables are read / pruned one snapshot at a time (trends, movements, exports, retention)
+create_fact_date_index = """CREATE INDEX IF NOT EXISTS track_metrics_fact_date ON track_metrics_fact (date_id);
+                            CREATE INDEX IF NOT EXISTS artist_metrics_fact_date ON artist_metrics_fact (date_id);
+                            CREATE INDEX IF NOT EXISTS track_playlist_fact_date ON track_playlist_fact (date_id)
+                         """
+
+
+# tracks / artists that haven't been on a tracked playlist for a while are archived => no longer refreshed every run
+add_archived_at = """ALTER TABLE track_dim ADD COLUMN IF NOT EXISTS archived_at TIMESTAMP;
+                     ALTER TABLE artist_dim ADD COLUMN IF NOT EXISTS archived_at TIMESTAMP
+                  """
+
+
+# labels are stored once per canonical name (case / punctuation / spacing variants collapse into one label)
+create_canonical_label_function = """CREATE OR REPLACE FUNCTION canonical_label_name(name text) RETURNS text
+                                        LANGUAGE sql IMMUTABLE PARALLEL SAFE
+                                        AS $$ SELECT trim(regexp_replace(lower(name), '[^[:alnum:]]+', ' ', 'g')) $$
+                                  """
+
+create_label = """CREATE TABLE IF NOT EXISTS label_dim (
+                        label_id SERIAL,
+                        label_name varchar(100),
+                        canonical_name varchar(100),
+                        constraint label_id_pk primary key (label_id),
+                        constraint unique_label_canonical_name unique (canonical_name)
+                        );
+                  CREATE INDEX IF NOT EXISTS label_dim_canonical_prefix
+                    ON label_dim (canonical_name varchar_pattern_ops)
+                """
+
+# every spelling of a label seen on Spotify => its label (rows can also be added by hand to merge labels)
+create_label_alias = """CREATE TABLE IF NOT EXISTS label_alias (
+                            alias_name varchar(100),
+                            label_id INTEGER,
+                            constraint label_alias_pk primary key (alias_name),
+                            constraint label_alias_fk1 foreign key (label_id) references label_dim (label_id)
+                            )
+                        """
+
+add_track_label_id = """ALTER TABLE track_dim ADD COLUMN IF NOT EXISTS label_id INTEGER REFERENCES label_dim (label_id);
+                        CREATE INDEX IF NOT EXISTS track_dim_label ON track_dim (label_id);
+                        CREATE INDEX IF NOT EXISTS track_dim_unlinked_label ON track_dim (track_id)
+                            WHERE label_id IS NULL AND label_name IS NOT NULL
+                     """
+
+# links tracks that don't have a 'label_id' yet to their label, adding new labels / spellings along the way. The
+# display name of a new label is its most common spelling.
+link_track_labels = """INSERT INTO label_dim (label_name, canonical_name)
+                       SELECT DISTINCT ON (canonical_name) label_name, canonical_name
+                       FROM (SELECT label_name, canonical_label_name(label_name) AS canonical_name, count(*) AS tracks
+                             FROM track_dim td
+                             WHERE label_id IS NULL AND label_name IS NOT NULL
+                                AND NOT EXISTS (SELECT 1 FROM label_alias la WHERE la.alias_name = td.label_name)
+                             GROUP BY label_name) spellings
+                       WHERE canonical_name <> ''
+                       ORDER BY canonical_name, tracks DESC, label_name
+                       ON CONFLICT (canonical_name) DO NOTHING;
+
+                       INSERT INTO label_alias (alias_name, label_id)
+                       SELECT DISTINCT td.label_name, ld.label_id
+                       FROM track_dim td
+                       JOIN label_dim ld ON ld.canonical_name = canonical_label_name(td.label_name)
+                       WHERE td.label_id IS NULL AND td.label_name IS NOT NULL
+                       ON CONFLICT (alias_name) DO NOTHING;
+
+                       UPDATE track_dim td
+                       SET label_id = la.label_id
+                       FROM label_alias la
+                       WHERE la.alias_name = td.label_name AND td.label_id IS NULL AND td.label_name IS NOT NULL
+                    """
+
+
+# hash of each dimension row's tracked attributes => the loader only rewrites rows whose attributes changed. Rows
+# loaded before the column existed have no hash yet and are rewritten (once) the next time they're extracted.
+add_row_hash = """ALTER TABLE track_dim ADD COLUMN IF NOT EXISTS row_hash char(32);
+                  ALTER TABLE track_dim ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP;
+                  ALTER TABLE artist_dim ADD COLUMN IF NOT EXISTS row_hash char(32);
+                  ALTER TABLE artist_dim ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP
+               """
+
+# type-2 history of each track's label (the open row, valid_to IS NULL, is the current label)
+create_track_label_history = """CREATE TABLE IF NOT EXISTS track_label_history (
+                                    track_id INTEGER,
+                                    label_id INTEGER,
+                                    label_name varchar(100),
+                                    valid_from TIMESTAMP,
+                                    valid_to TIMESTAMP,
+                                    constraint track_label_history_pk primary key (track_id, valid_from),
+                                    constraint track_label_history_fk1 foreign key (track_id) references track_dim (track_id),
+                                    constraint track_label_history_fk2 foreign key (label_id) references label_dim (label_id)
+                                    );
+                                CREATE UNIQUE INDEX IF NOT EXISTS track_label_history_current
+                                    ON track_label_history (track_id) WHERE valid_to IS NULL;
+                                -- labels of the tracks loaded before the table existed
+                                INSERT INTO track_label_history (track_id, label_id, label_name, valid_from)
+                                SELECT track_id, label_id, label_name, '-infinity'
+                                FROM track_dim
+                                WHERE NOT EXISTS (SELECT 1 FROM track_label_history)
+                             """
+
+
+# monthly rollups of the snapshots that have aged out of the full resolution retention window
+create_track_metrics_monthly = """CREATE TABLE IF NOT EXISTS track_metrics_monthly (
+                                    track_id INTEGER,
+                                    month DATE,
+                                    snapshot_count SMALLINT,
+                                    avg_track_popularity SMALLINT,
+                                    max_track_popularity SMALLINT,
+                                    constraint track_metrics_monthly_pk primary key (track_id, month),
+                                    constraint track_metrics_monthly_fk1 foreign key (track_id) references track_dim (track_id)
+                                    )
+                                """
+
+create_artist_metrics_monthly = """CREATE TABLE IF NOT EXISTS artist_metrics_monthly (
+                                    artist_id INTEGER,
+                                    month DATE,
+                                    snapshot_count SMALLINT,
+                                    avg_artist_popularity SMALLINT,
+                                    max_artist_followers INT,
+                                    constraint artist_metrics_monthly_pk primary key (artist_id, month),
+                                    constraint artist_metrics_monthly_fk1 foreign key (artist_id) references artist_dim (artist_id)
+                                    )
+                                """
+
+create_track_playlist_monthly = """CREATE TABLE IF NOT EXISTS track_playlist_monthly (
+                                    track_id INTEGER,
+                                    playlist_id INTEGER,
+                                    month DATE,
+                                    snapshot_count SMALLINT,
+                                    best_position SMALLINT,
+                                    avg_position SMALLINT,
+                                    avg_track_popularity SMALLINT,
+                                    constraint track_playlist_monthly_pk primary key (track_id, playlist_id, month),
+                                    constraint track_playlist_monthly_fk1 foreign key (track_id) references track_dim (track_id),
+                                    constraint track_playlist_monthly_fk2 foreign key (playlist_id) references playlist_dim (playlist_id)
+                                    )
+                                """
+
+
+# moves the rows of the old per (track, artist, snapshot) tables into the split tables above, then drops them
+migrate_track_artist_fact = """DO $$
+                               BEGIN
+                                   -- a table (not yet the view below)
+                                   IF EXISTS (SELECT 1 FROM pg_tables
+                                              WHERE schemaname = current_schema()
+                                                AND tablename = 'track_artist_fact') THEN
+                                       INSERT INTO track_metrics_fact (track_id, date_id, track_popularity)
+                                       SELECT track_id, date_id, max(track_popularity)
+                                       FROM track_artist_fact
+                                       GROUP BY track_id, date_id
+                                       ON CONFLICT DO NOTHING;
+
+                                       INSERT INTO artist_metrics_fact (artist_id, date_id, artist_popularity,
+                                                                        artist_followers)
+                                       SELECT artist_id, date_id, max(artist_popularity), max(artist_followers)
+                                       FROM track_artist_fact
+                                       GROUP BY artist_id, date_id
+                                       ON CONFLICT DO NOTHING;
+
+                                       INSERT INTO track_artist_bridge (track_id, artist_id)
+                                       SELECT DISTINCT track_id, artist_id FROM track_artist_fact
+                                       ON CONFLICT DO NOTHING;
+
+                                       DROP TABLE track_artist_fact;
+                                   END IF;
+
+                                   IF to_regclass('track_artist_monthly') IS NOT NULL THEN
+                                       INSERT INTO track_metrics_monthly (track_id, month, snapshot_count,
+                                                                          avg_track_popularity, max_track_popularity)
+                                       SELECT track_id, month, max(snapshot_count), max(avg_track_popularity),
+                                              max(max_track_popularity)
+                                       FROM track_artist_monthly
+                                       GROUP BY track_id, month
+                                       ON CONFLICT DO NOTHING;
+
+                                       INSERT INTO artist_metrics_monthly (artist_id, month, snapshot_count,
+                                                                           avg_artist_popularity, max_artist_followers)
+                                       SELECT artist_id, month, max(snapshot_count), max(avg_artist_popularity),
+                                              max(max_artist_followers)
+                                       FROM track_artist_monthly
+                                       GROUP BY artist_id, month
+                                       ON CONFLICT DO NOTHING;
+
+                                       INSERT INTO track_artist_bridge (track_id, artist_id)
+                                       SELECT DISTINCT track_id, artist_id FROM track_artist_monthly
+                                       ON CONFLICT DO NOTHING;
+
+                                       DROP TABLE track_artist_monthly;
+                                   END IF;
+                               END $$
+                            """
+
+# every loaded snapshot. 'heartbeat_weeks' > 0 => the snapshot was stored in change-only mode, where a metric row is
+# only written when the value changed or the entity's latest row is 'heartbeat_weeks' old (see 'update_fact_tables')
+create_fact_snapshot = """CREATE TABLE IF NOT EXISTS fact_snapshot (
+                            date_id char(8),
+                            heartbeat_weeks SMALLINT DEFAULT 0,
+                            constraint fact_snapshot_pk primary key (date_id),
+                            constraint fact_snapshot_fk1 foreign key (date_id) references date_dim (date_id)
+                            );
+                          -- snapshots loaded before the table existed
+                          INSERT INTO fact_snapshot (date_id)
+                          SELECT date_id FROM (SELECT date_id FROM track_playlist_fact
+                                               UNION SELECT date_id FROM track_metrics_fact
+                                               UNION SELECT date_id FROM artist_metrics_fact) loaded
+                          WHERE NOT EXISTS (SELECT 1 FROM fact_snapshot)
+                       """
+
+# dense metric series => a row for every snapshot since the entity's first observation, carrying the latest observed
+# value forward (for at most the snapshot's heartbeat interval). Filters on track_id / artist_id are pushed all the way
+# down to the fact table's primary key, so reading one entity's series stays cheap.
+create_track_metrics_dense = """CREATE OR REPLACE VIEW track_metrics_dense AS
+                                SELECT track_id, date_id, date, track_popularity
+                                FROM (
+                                    SELECT track_id, date_id, date, heartbeat_weeks,
+                                           max(track_popularity) OVER w AS track_popularity,
+                                           max(observed_on) OVER w AS observed_on
+                                    FROM (
+                                        SELECT e.track_id, s.date_id, dd.date, s.heartbeat_weeks, tm.track_popularity,
+                                               CASE WHEN tm.track_id IS NOT NULL THEN dd.date END AS observed_on,
+                                               count(tm.track_id) OVER (PARTITION BY e.track_id
+                                                                        ORDER BY s.date_id) AS grp
+                                        FROM (SELECT track_id, min(date_id) AS first_date_id
+                                              FROM track_metrics_fact
+                                              GROUP BY track_id) e
+                                        JOIN fact_snapshot s ON s.date_id >= e.first_date_id
+                                        JOIN date_dim dd ON dd.date_id = s.date_id
+                                        LEFT JOIN track_metrics_fact tm ON tm.track_id = e.track_id
+                                                                       AND tm.date_id = s.date_id
+                                    ) observations
+                                    WINDOW w AS (PARTITION BY track_id, grp)
+                                ) carried
+                                WHERE date <= observed_on + 7 * heartbeat_weeks
+                             """
+
+create_artist_metrics_dense = """CREATE OR REPLACE VIEW artist_metrics_dense AS
+                                 SELECT artist_id, date_id, date, artist_popularity, artist_followers
+                                 FROM (
+                                     SELECT artist_id, date_id, date, heartbeat_weeks,
+                                            max(artist_popularity) OVER w AS artist_popularity,
+                                            max(artist_followers) OVER w AS artist_followers,
+                                            max(observed_on) OVER w AS observed_on
+                                     FROM (
+                                         SELECT e.artist_id, s.date_id, dd.date, s.heartbeat_weeks,
+                                                am.artist_popularity, am.artist_followers,
+                                                CASE WHEN am.artist_id IS NOT NULL THEN dd.date END AS observed_on,
+                                                count(am.artist_id) OVER (PARTITION BY e.artist_id
+                                                                          ORDER BY s.date_id) AS grp
+                                         FROM (SELECT artist_id, min(date_id) AS first_date_id
+                                               FROM artist_metrics_fact
+                                               GROUP BY artist_id) e
+                                         JOIN fact_snapshot s ON s.date_id >= e.first_date_id
+                                         JOIN date_dim dd ON dd.date_id = s.date_id
+                                         LEFT JOIN artist_metrics_fact am ON am.artist_id = e.artist_id
+                                                                         AND am.date_id = s.date_id
+                                     ) observations
+                                     WINDOW w AS (PARTITION BY artist_id, grp)
+                                 ) carried
+                                 WHERE date <= observed_on + 7 * heartbeat_weeks
+                              """
+
+# every track's / artist's metrics as of a single snapshot => the latest row within the snapshot's heartbeat interval
+# (a range scan on the 'date_id' index instead of a pass over the whole history)
+create_metrics_asof_functions = """CREATE OR REPLACE FUNCTION track_metrics_asof(p_date_id char(8))
+                                        RETURNS TABLE (track_id INTEGER, track_popularity SMALLINT)
+                                        LANGUAGE sql STABLE
+                                        AS $$
+                                            SELECT DISTINCT ON (tm.track_id) tm.track_id, tm.track_popularity
+                                            FROM track_metrics_fact tm
+                                            JOIN fact_snapshot s ON s.date_id = p_date_id
+                                            WHERE tm.date_id <= p_date_id
+                                              AND tm.date_id >= to_char(to_date(p_date_id, 'YYYYMMDD')
+                                                                        - 7 * s.heartbeat_weeks, 'YYYYMMDD')
+                                            ORDER BY tm.track_id, tm.date_id DESC
+                                        $$;
+                                   CREATE OR REPLACE FUNCTION artist_metrics_asof(p_date_id char(8))
+                                        RETURNS TABLE (artist_id INTEGER, artist_popularity SMALLINT,
+                                                       artist_followers INT)
+                                        LANGUAGE sql STABLE
+                                        AS $$
+                                            SELECT DISTINCT ON (am.artist_id) am.artist_id, am.artist_popularity,
+                                                   am.artist_followers
+                                            FROM artist_metrics_fact am
+                                            JOIN fact_snapshot s ON s.date_id = p_date_id
+                                            WHERE am.date_id <= p_date_id
+                                              AND am.date_id >= to_char(to_date(p_date_id, 'YYYYMMDD')
+                                                                        - 7 * s.heartbeat_weeks, 'YYYYMMDD')
+                                            ORDER BY am.artist_id, am.date_id DESC
+                                        $$
+                                """
+
+# the old 'track_artist_fact' layout, for ad hoc queries / tools written against it
+create_track_artist_view = """CREATE OR REPLACE VIEW track_artist_fact AS
+                                SELECT b.track_id, b.artist_id, tm.date_id, tm.track_popularity, am.artist_popularity,
+                                       am.artist_followers
+                                FROM track_artist_bridge b
+                                JOIN track_metrics_dense tm ON tm.track_id = b.track_id
+                                JOIN artist_metrics_dense am ON am.artist_id = b.artist_id AND am.date_id = tm.date_id
+                            """
+
+
+# per task run metrics (stage timings, API request counts / latencies, rows loaded) recorded by 'PlaylistDW.save_metrics'
+create_etl_run_metric = """CREATE TABLE IF NOT EXISTS etl_run_metric (
+                            run_id varchar(250),
+                            dag_id varchar(250),
+                            task_id varchar(250),
+                            metric_name varchar(100),
+                            metric_type varchar(10),
+                            labels varchar(250),
+                            metric_value NUMERIC,
+                            recorded_at TIMESTAMP DEFAULT now()
+                            )
+                        """
+
+create_etl_run_metric_index = """CREATE INDEX IF NOT EXISTS etl_run_metric_name_time
+                                    ON etl_run_metric (metric_name, recorded_at)
+                              """
+
+# one row per searchable track / artist / album / label => the dashboard's search runs a single indexed query
+# (full text on 'search_vector', trigram similarity on 'entity_name' for typos / partial words)
+create_search_index = """CREATE EXTENSION IF NOT EXISTS pg_trgm;
+                         CREATE TABLE IF NOT EXISTS search_index (
+                            entity_type varchar(6),
+                            entity_key varchar(22),
+                            entity_name varchar(100),
+                            detail varchar(250),
+                            artist_id INTEGER,
+                            search_vector tsvector,
+                            constraint search_index_pk primary key (entity_type, entity_key)
+                            );
+                         CREATE INDEX IF NOT EXISTS search_index_vector ON search_index USING gin (search_vector);
+                         CREATE INDEX IF NOT EXISTS search_index_name_trgm
+                            ON search_index USING gin (entity_name gin_trgm_ops)
+                      """
+
+# rebuilds the search documents from the dimensions ('PlaylistDW.refresh_search_index'). Unchanged rows aren't
+# rewritten => the GIN indexes only get the entries that actually changed
+refresh_search_index = """
+    INSERT INTO search_index (entity_type, entity_key, entity_name, detail, artist_id, search_vector)
+    SELECT 'track', td.track_id::text, td.track_name,
+           left(concat_ws(' - ', string_agg(ad.artist_name, ', ' ORDER BY ad.artist_id), td.album_name), 250),
+           min(ad.artist_id),
+           setweight(to_tsvector('simple', coalesce(td.track_name, '')), 'A') ||
+           setweight(to_tsvector('simple', coalesce(string_agg(ad.artist_name, ' '), '')), 'B') ||
+           setweight(to_tsvector('simple', coalesce(td.album_name, '')), 'C')
+    FROM track_dim td
+    LEFT JOIN track_artist_bridge tab ON tab.track_id = td.track_id
+    LEFT JOIN artist_dim ad ON ad.artist_id = tab.artist_id
+    GROUP BY td.track_id
+    ON CONFLICT (entity_type, entity_key) DO UPDATE
+        SET entity_name = EXCLUDED.entity_name, detail = EXCLUDED.detail, artist_id = EXCLUDED.artist_id,
+            search_vector = EXCLUDED.search_vector
+        WHERE (search_index.entity_name, search_index.detail, search_index.artist_id)
+            IS DISTINCT FROM (EXCLUDED.entity_name, EXCLUDED.detail, EXCLUDED.artist_id);
+
+    INSERT INTO search_index (entity_type, entity_key, entity_name, detail, artist_id, search_vector)
+    SELECT 'artist', artist_id::text, artist_name, NULL, artist_id,
+           setweight(to_tsvector('simple', coalesce(artist_name, '')), 'A')
+    FROM artist_dim
+    ON CONFLICT (entity_type, entity_key) DO UPDATE
+        SET entity_name = EXCLUDED.entity_name, search_vector = EXCLUDED.search_vector
+        WHERE search_index.entity_name IS DISTINCT FROM EXCLUDED.entity_name;
+
+    INSERT INTO search_index (entity_type, entity_key, entity_name, detail, artist_id, search_vector)
+    SELECT 'album', album_id, max(album_name), max(label_name), NULL,
+           setweight(to_tsvector('simple', coalesce(max(album_name), '')), 'A') ||
+           setweight(to_tsvector('simple', coalesce(max(label_name), '')), 'C')
+    FROM track_dim
+    WHERE album_id IS NOT NULL
+    GROUP BY album_id
+    ON CONFLICT (entity_type, entity_key) DO UPDATE
+        SET entity_name = EXCLUDED.entity_name, detail = EXCLUDED.detail, search_vector = EXCLUDED.search_vector
+        WHERE (search_index.entity_name, search_index.detail)
+            IS DISTINCT FROM (EXCLUDED.entity_name, EXCLUDED.detail);
+
+    -- labels are also found by their other spellings ('label_alias')
+    INSERT INTO search_index (entity_type, entity_key, entity_name, detail, artist_id, search_vector)
+    SELECT 'label', ld.label_id::text, ld.label_name, NULL, NULL,
+           setweight(to_tsvector('simple', coalesce(ld.label_name, '')), 'A') ||
+           setweight(to_tsvector('simple', coalesce(string_agg(la.alias_name, ' '), '')), 'B')
+    FROM label_dim ld
+    LEFT JOIN label_alias la ON la.label_id = ld.label_id
+    GROUP BY ld.label_id
+    ON CONFLICT (entity_type, entity_key) DO UPDATE
+        SET entity_name = EXCLUDED.entity_name, search_vector = EXCLUDED.search_vector
+        WHERE (search_index.entity_name, search_index.search_vector)
+            IS DISTINCT FROM (EXCLUDED.entity_name, EXCLUDED.search_vector);
+
+    -- albums no track points at anymore (corrected album metadata) / merged labels
+    DELETE FROM search_index si
+    WHERE (si.entity_type = 'album' AND NOT EXISTS (SELECT 1 FROM track_dim td WHERE td.album_id = si.entity_key))
+        OR (si.entity_type = 'label'
+            AND NOT EXISTS (SELECT 1 FROM label_dim ld WHERE ld.label_id::text = si.entity_key))
+"""
+
+
+# results of the completed units (playlists, id batches) of an ETL task, kept until the run's load succeeds => a
+# retried task resumes from where the failed attempt stopped ('etl_checkpoint.RunCheckpoints')
+create_etl_checkpoint = """CREATE TABLE IF NOT EXISTS etl_checkpoint (
+                            run_key varchar(250),
+                            stage varchar(20),
+                            unit_key varchar(100),
+                            payload jsonb,
+                            created_at TIMESTAMP DEFAULT now(),
+                            constraint etl_checkpoint_pk primary key (run_key, stage, unit_key)
+                            )
+                        """
+
+
+# single row bumped by every step that changes what the dashboard shows (loads, derived tables, replays, retention)
+# => part of the web app's cache key / ETag. Bump it by hand after correcting the dw directly.
+create_data_version = """CREATE TABLE IF NOT EXISTS dw_data_version (
+                            version_key BOOLEAN DEFAULT true,
+                            version BIGINT DEFAULT 0,
+                            changed_at TIMESTAMP DEFAULT now(),
+                            constraint dw_data_version_pk primary key (version_key),
+                            constraint dw_data_version_single_row check (version_key)
+                            );
+                         INSERT INTO dw_data_version DEFAULT VALUES ON CONFLICT DO NOTHING
+                      """
+
+
+# fills 'date_dim' with every day between %(start_date)s and %(end_date)s in a single statement
+populate_date_dim = """INSERT INTO date_dim (date_id, date, date_description, calendar_year, calendar_quarter,
+                                             calendar_month_num, calendar_month_name, calendar_month_day_num,
+                                             day_of_week)
+                        SELECT to_char(d, 'YYYYMMDD'), d::date, to_char(d, 'FMMonth DD, YYYY'), to_char(d, 'YYYY'),
+                               extract(quarter FROM d), extract(month FROM d), to_char(d, 'FMMonth'),
+                               extract(day FROM d), to_char(d, 'FMDay')
+                        FROM generate_series(%(start_date)s::date, %(end_date)s::date, interval '1 day') d
+                        ON CONFLICT (date_id) DO NOTHING
+                    """
+
+
+# statements run (in order) by 'PlaylistDW.create_tables'
+TABLE_DEFINITIONS = [create_date,
+                     widen_date_description,
+                     create_playlist,
+                     create_track,
+                     create_artist,
+                     create_track_metrics,
+                     create_artist_metrics,
+                     create_track_artist_bridge,
+                     create_track_playlist,
+                     create_fact_date_index,
+                     add_archived_at,
+                     create_canonical_label_function,
+                     create_label,
+                     create_label_alias,
+                     add_track_label_id,
+                     link_track_labels,
+                     add_row_hash,
+                     create_track_label_history,
+                     create_track_metrics_monthly,
+                     create_artist_metrics_monthly,
+                     create_track_playlist_monthly,
+                     migrate_track_artist_fact,
+                     create_fact_snapshot,
+                     create_track_metrics_dense,
+                     create_artist_metrics_dense,
+                     create_metrics_asof_functions,
+                     create_track_artist_view,
+                     create_backfill_job,
+                     create_backfill_index,
+                     create_track_trend,
+                     create_artist_trend,
+                     widen_follower_growth_rate,
+                     create_trend_rank_index,
+                     create_playlist_movement,
+                     create_playlist_movement_index,
+                     create_label_share,
+                     create_etl_run_metric,
+                     create_etl_run_metric_index,
+                     create_etl_checkpoint,
+                     create_search_index,
+                     create_data_version]
+
+
+# the snapshot (date_id keyed) fact tables
+FACT_TABLES = ["track_metrics_fact", "artist_metrics_fact", "track_playlist_fact"]
+
+
+# every table in the dw, in an order that's safe to drop them in ('track_artist_fact' is dropped with its tables)
+DW_TABLES = ["dw_data_version", "search_index", "etl_checkpoint", "etl_run_metric", "track_metrics_monthly",
+             "artist_metrics_monthly", "track_playlist_monthly", "label_share_weekly", "playlist_movement_fact",
+             "track_trend", "artist_trend", "playlist_backfill_job", "track_playlist_fact", "track_artist_bridge",
+             "track_metrics_fact", "artist_metrics_fact", "track_label_history", "artist_dim", "track_dim",
+             "label_alias", "label_dim", "playlist_dim", "fact_snapshot", "date_dim"]
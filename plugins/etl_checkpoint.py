@@ -0,0 +1,106 @@
+"""
+Checkpoints of the units of work an ETL task has already completed (one extracted playlist, one batch of ids sent to
+the 'ids' endpoints), stored in the 'etl_checkpoint' table under the Airflow run they belong to. When a task fails
+partway through and Airflow retries it, the completed units are read back instead of being requested from Spotify
+again, so the retry only pays for the remaining work.
+"""
+
+import hashlib
+import json
+import logging
+
+from etl_metrics import RunMetrics
+
+
+def batch_key(id_type, ids_str):
+
+    """
+    Checkpoint key of one batch of ids (the same ids always map to the same key, however the batches were built)
+    """
+
+    return f"{id_type}:{hashlib.md5(ids_str.encode()).hexdigest()}"
+
+
+class RunCheckpoints:
+
+    """
+    Reads / writes the checkpoints of a single run
+    """
+
+    def __init__(self, hook, run_key, metrics=None):
+
+        self.hook = hook
+        self.run_key = run_key  # e.g. the Airflow run id => shared by every attempt of the run's tasks
+        self.metrics = metrics or RunMetrics()
+        self.connection = None  # own connection => checkpoints are committed even if the task's transaction isn't
+        self.units = {}  # stage => {unit key: payload}, loaded lazily
+
+    def get_conn(self):
+
+        if self.connection is None or self.connection.closed:
+            self.connection = self.hook.get_conn()
+
+        return self.connection
+
+    def load_stage(self, stage):
+
+        """
+        :return: dict of unit key => payload for the units of a stage that were completed by an earlier attempt
+        """
+
+        if stage not in self.units:
+            with self.get_conn().cursor() as cursor:
+                cursor.execute("SELECT unit_key, payload FROM etl_checkpoint WHERE run_key = %s AND stage = %s",
+                               (self.run_key, stage))
+                self.units[stage] = dict(cursor.fetchall())
+            if self.units[stage]:
+                logging.info(f"Resuming from {len(self.units[stage])} '{stage}' checkpoints of run {self.run_key}")
+
+        return self.units[stage]
+
+    def get(self, stage, unit_key):
+
+        """
+        :return: the payload saved for a unit, or None if it hasn't been completed yet
+        """
+
+        payload = self.load_stage(stage).get(unit_key)
+        if payload is not None:
+            self.metrics.increment("checkpoints_reused_total", stage=stage)
+
+        return payload
+
+    def save(self, stage, unit_key, payload):
+
+        """
+        Stores the result of a completed unit (must be JSON serializable => tuples come back as lists)
+        """
+
+        connection = self.get_conn()
+        with connection.cursor() as cursor:
+            cursor.execute("""INSERT INTO etl_checkpoint (run_key, stage, unit_key, payload)
+                              VALUES (%s, %s, %s, %s)
+                              ON CONFLICT (run_key, stage, unit_key) DO UPDATE SET payload = EXCLUDED.payload,
+                                                                                   created_at = now()""",
+                           (self.run_key, stage, unit_key, json.dumps(payload)))
+        connection.commit()
+
+        self.load_stage(stage)[unit_key] = payload
+        self.metrics.increment("checkpoints_saved_total", stage=stage)
+
+    def clear(self, max_age_days=7):
+
+        """
+        Deletes the run's checkpoints once its data is loaded, along with the leftovers of abandoned runs
+
+        :param max_age_days: checkpoints older than this are deleted whatever run they belong to
+        """
+
+        connection = self.get_conn()
+        with connection.cursor() as cursor:
+            cursor.execute("""DELETE FROM etl_checkpoint
+                              WHERE run_key = %s OR created_at < now() - make_interval(days => %s)""",
+                           (self.run_key, max_age_days))
+            logging.info(f"Deleted {cursor.rowcount} checkpoints")
+        connection.commit()
+        self.units.clear()
@@ -0,0 +1,161 @@
+import functools
+import os
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+# upper bounds (seconds) of the histogram buckets written to the Prometheus textfile
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 900)
+
+
+def format_labels(labels):
+
+    """
+    Renders a sorted tuple of (name, value) pairs the way Prometheus does, e.g. endpoint="albums",status="200"
+    """
+
+    return ",".join(f'{name}="{value}"' for name, value in labels)
+
+
+class RunMetrics:
+
+    """
+    Collects counters, gauges and histograms (timings, request latencies) during a single ETL task run
+    """
+
+    def __init__(self):
+
+        self.counters = defaultdict(float)  # (metric name, labels) => running total
+        self.gauges = {}  # (metric name, labels) => latest value
+        self.observations = defaultdict(list)  # (metric name, labels) => every observed value
+
+    def reset(self):
+
+        self.counters.clear()
+        self.gauges.clear()
+        self.observations.clear()
+
+    def increment(self, name, value=1, **labels):
+
+        """
+        Adds to a counter
+
+        :param name: metric name
+        :param value: amount to add
+        :param labels: dimensions the counter is broken down by (e.g. endpoint="albums")
+        """
+
+        self.counters[(name, tuple(sorted(labels.items())))] += value
+
+    def set_gauge(self, name, value, **labels):
+
+        """
+        Records the current value of something that can go up or down (e.g. a table's size)
+        """
+
+        self.gauges[(name, tuple(sorted(labels.items())))] = value
+
+    def observe(self, name, value, **labels):
+
+        """
+        Records one observation (e.g. the latency of a single request) in a histogram
+
+        :param name: metric name
+        :param value: observed value
+        :param labels: dimensions the histogram is broken down by
+        """
+
+        self.observations[(name, tuple(sorted(labels.items())))].append(value)
+
+    @contextmanager
+    def timer(self, name, **labels):
+
+        """
+        Observes the number of seconds spent inside the 'with' block, whether or not it raises
+        """
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def summarize(self):
+
+        """
+        Flattens the collected metrics into rows. Histograms are summarized as count / sum / max / p50 / p95.
+
+        :return: list of (metric name, metric type, labels, value) tuples
+        """
+
+        rows = [(name, "counter", format_labels(labels), value) for (name, labels), value in self.counters.items()]
+        rows.extend((name, "gauge", format_labels(labels), value) for (name, labels), value in self.gauges.items())
+
+        for (name, labels), values in self.observations.items():
+            ordered = sorted(values)
+            summary = {"count": len(ordered),
+                       "sum": sum(ordered),
+                       "max": ordered[-1],
+                       "p50": ordered[int(0.50 * (len(ordered) - 1))],
+                       "p95": ordered[int(0.95 * (len(ordered) - 1))]}
+            rows.extend((f"{name}_{stat}", "histogram", format_labels(labels), round(value, 6))
+                        for stat, value in summary.items())
+
+        return rows
+
+    def write_prometheus_textfile(self, path, buckets=DEFAULT_BUCKETS, **run_labels):
+
+        """
+        Writes the collected metrics in the Prometheus text format, e.g. for node_exporter's textfile collector. The
+        file is replaced atomically so the collector never reads a half-written file.
+
+        :param path: destination '.prom' file
+        :param buckets: histogram bucket upper bounds
+        :param run_labels: labels added to every sample (e.g. dag_id, task_id)
+        """
+
+        lines = []
+        typed = set()  # each metric's '# TYPE' line is only written once
+        extra = tuple(sorted(run_labels.items()))
+
+        for metric_type, values in (("counter", self.counters), ("gauge", self.gauges)):
+            for (name, labels), value in sorted(values.items()):
+                if name not in typed:
+                    lines.append(f"# TYPE spotify_etl_{name} {metric_type}")
+                    typed.add(name)
+                lines.append(f"spotify_etl_{name}{{{format_labels(extra + labels)}}} {value}")
+
+        for (name, labels), values in sorted(self.observations.items()):
+            if name not in typed:
+                lines.append(f"# TYPE spotify_etl_{name} histogram")
+                typed.add(name)
+            label_str = format_labels(extra + labels)
+            for bound in buckets:
+                count = sum(1 for value in values if value <= bound)
+                lines.append(f'spotify_etl_{name}_bucket{{{label_str},le="{bound}"}} {count}')
+            lines.append(f'spotify_etl_{name}_bucket{{{label_str},le="+Inf"}} {len(values)}')
+            lines.append(f"spotify_etl_{name}_sum{{{label_str}}} {sum(values)}")
+            lines.append(f"spotify_etl_{name}_count{{{label_str}}} {len(values)}")
+
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(tmp_path, path)
+
+
+def timed_stage(stage):
+
+    """
+    Decorator for 'PlaylistDW' methods => records how long each call takes in the 'stage_seconds' histogram
+    """
+
+    def decorator(method):
+
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            with self.metrics.timer("stage_seconds", stage=stage):
+                return method(self, *args, **kwargs)
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,123 @@
+"""
+Columnar (Parquet) archive of the fact tables' history, with the dimension attributes denormalised in. Every snapshot
+is written to its own hive-style 'date_id=YYYYMMDD' partition, so each ETL load only appends one new directory and
+readers only open the partitions their filters select. Kept free of Airflow imports so analysts can read the archive
+with nothing but pandas + pyarrow:
+
+    from fact_archive import read_archive
+
+    df = read_archive("track_playlist_fact", columns=["date", "playlist_name", "label_name"],
+                      filters=[("date_id", ">=", "20240101")])
+"""
+
+import os
+import shutil
+
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+ARCHIVE_DIR = os.getenv("FACT_ARCHIVE_DIR", "archive")
+
+# keep date_id a string (as in the dw) instead of letting pyarrow infer an integer from the directory names
+PARTITIONING = pa.schema([("date_id", pa.string())])
+
+# one snapshot of each fact table, joined with the attributes analysts usually filter / group by
+EXPORT_QUERIES = {
+    "track_metrics_fact": """
+        SELECT dd.date_id, dd.date, tmf.track_id, td.track_spotify_id, td.track_name, td.track_isrc,
+               td.album_name, td.album_release_date, td.album_type, td.label_id, ld.label_name, tmf.track_popularity
+        FROM track_metrics_asof(%(date_id)s) tmf  -- dense, even if the snapshot was stored in change-only mode
+        JOIN date_dim dd ON dd.date_id = %(date_id)s
+        JOIN track_dim td ON td.track_id = tmf.track_id
+        LEFT JOIN label_dim ld ON ld.label_id = td.label_id
+        ORDER BY ld.label_name, tmf.track_id  -- clustered rows => tighter row group statistics for label filters
+    """,
+    "artist_metrics_fact": """
+        SELECT dd.date_id, dd.date, amf.artist_id, ad.artist_spotify_id, ad.artist_name, amf.artist_popularity,
+               amf.artist_followers
+        FROM artist_metrics_asof(%(date_id)s) amf
+        JOIN date_dim dd ON dd.date_id = %(date_id)s
+        JOIN artist_dim ad ON ad.artist_id = amf.artist_id
+        ORDER BY amf.artist_id
+    """,
+    "track_playlist_fact": """
+        SELECT tpf.date_id, dd.date, tpf.track_id, td.track_spotify_id, td.track_name, td.track_isrc,
+               td.album_name, td.album_release_date, td.album_type, td.label_id, ld.label_name, tpf.playlist_id,
+               pd.playlist_spotify_id, pd.playlist_name, tpf.track_playlist_position, tpf.track_popularity
+        FROM track_playlist_fact tpf
+        JOIN date_dim dd ON dd.date_id = tpf.date_id
+        JOIN track_dim td ON td.track_id = tpf.track_id
+        JOIN playlist_dim pd ON pd.playlist_id = tpf.playlist_id
+        LEFT JOIN label_dim ld ON ld.label_id = td.label_id
+        WHERE tpf.date_id = %(date_id)s
+        ORDER BY tpf.playlist_id, tpf.track_playlist_position
+    """,
+}
+
+
+def archived_date_ids(table_name, archive_dir=None):
+
+    """
+    Lists the snapshots that have already been archived for a fact table
+
+    :param table_name: 'track_metrics_fact', 'artist_metrics_fact' or 'track_playlist_fact'
+    :param archive_dir: root folder of the archive
+    :return: set of date ids
+    """
+
+    table_dir = os.path.join(archive_dir or ARCHIVE_DIR, table_name)
+
+    if not os.path.isdir(table_dir):
+        return set()
+
+    return {name.split("=", 1)[1] for name in os.listdir(table_dir) if name.startswith("date_id=")}
+
+
+def write_snapshot(df, table_name, date_id, archive_dir=None):
+
+    """
+    Writes (or replaces) one snapshot of a fact table as a single Parquet file in its 'date_id=' partition
+
+    :param df: DataFrame returned by the table's export query
+    :param table_name: 'track_metrics_fact', 'artist_metrics_fact' or 'track_playlist_fact'
+    :param date_id: the snapshot's date id
+    :param archive_dir: root folder of the archive
+    :return: path of the written file
+    """
+
+    table_dir = os.path.join(archive_dir or ARCHIVE_DIR, table_name)
+    partition_dir = os.path.join(table_dir, f"date_id={date_id}")
+    tmp_dir = os.path.join(table_dir, f".tmp-{date_id}")  # readers skip '.' prefixed folders
+
+    # write next to the partition, then swap it in => readers never see a half-written snapshot
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    table = pa.Table.from_pandas(df.drop(columns=["date_id"]), preserve_index=False)
+    pq.write_table(table, os.path.join(tmp_dir, "part-0.parquet"), compression="zstd")
+
+    shutil.rmtree(partition_dir, ignore_errors=True)
+    os.replace(tmp_dir, partition_dir)
+
+    return os.path.join(partition_dir, "part-0.parquet")
+
+
+def read_archive(table_name, columns=None, filters=None, archive_dir=None):
+
+    """
+    Reads an archived fact table. Only the requested columns are decoded, filters on 'date_id' skip whole partitions,
+    and other filters are checked against each file's row group statistics before any rows are read.
+
+    :param table_name: 'track_metrics_fact', 'artist_metrics_fact' or 'track_playlist_fact'
+    :param columns: columns to read (all of them by default)
+    :param filters: pyarrow filters, e.g. [("date_id", ">=", "20240101"), ("label_name", "==", "Columbia")]
+    :param archive_dir: root folder of the archive
+    :return: DataFrame
+    """
+
+    table = pq.read_table(os.path.join(archive_dir or ARCHIVE_DIR, table_name),
+                          columns=columns,
+                          filters=filters,
+                          partitioning=ds.partitioning(PARTITIONING, flavor="hive"))
+
+    return table.to_pandas()
@@ -0,0 +1,155 @@
+"""
+Archive of the raw Spotify API responses collected by each run, so any snapshot can later be rebuilt without calling
+Spotify (e.g. after an outage on the load side or a schema change). Responses are stored as gzipped JSON lines under
+'<RAW_ARCHIVE_DIR>/<run date>/':
+
+    playlists/<playlist id>.jsonl.gz   every page of the playlist's items, with the offset it was requested at
+    albums.jsonl.gz                    album / track / artist objects returned by the 'ids' endpoints, one per line
+    tracks.jsonl.gz                    (looked up by id on replay, so they don't depend on how requests were batched)
+    artists.jsonl.gz
+"""
+
+import gzip
+import json
+import os
+
+from etl_metrics import RunMetrics
+from spot_api import SpotifyAPI
+from spot_payloads import PayloadParser
+
+
+class RawResponseArchive:
+
+    """
+    Reads / writes the raw API responses of a single run date
+    """
+
+    def __init__(self, run_date, root_dir=None):
+
+        self.root_dir = root_dir or os.getenv('RAW_ARCHIVE_DIR', 'raw_archive')
+        self.date_dir = os.path.join(self.root_dir, str(run_date))
+        self.objects = {}  # id type => {spotify id: object}, loaded lazily on replay
+
+    @staticmethod
+    def archived_dates(root_dir=None):
+
+        """
+        :return: sorted list of the run dates ('YYYY-MM-DD') that have an archive
+        """
+
+        root_dir = root_dir or os.getenv('RAW_ARCHIVE_DIR', 'raw_archive')
+
+        if not os.path.isdir(root_dir):
+            return []
+
+        return sorted(name for name in os.listdir(root_dir) if os.path.isdir(os.path.join(root_dir, name)))
+
+    def playlist_path(self, playlist_id):
+
+        return os.path.join(self.date_dir, "playlists", f"{playlist_id}.jsonl.gz")
+
+    def save_playlist_page(self, playlist_id, offset, page):
+
+        """
+        Appends one page of a playlist's items. The first page truncates the file => a retried extraction replaces
+        the pages of the earlier attempt instead of duplicating them.
+        """
+
+        path = self.playlist_path(playlist_id)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        with gzip.open(path, "wt" if offset == 0 else "at") as f:
+            f.write(json.dumps({"offset": offset, "page": page}) + "\n")
+
+    def save_objects(self, id_type, objects):
+
+        """
+        Appends the objects returned by one of the 'ids' endpoints (albums, tracks or artists)
+        """
+
+        os.makedirs(self.date_dir, exist_ok=True)
+
+        with gzip.open(os.path.join(self.date_dir, f"{id_type}.jsonl.gz"), "at") as f:
+            for obj in objects:
+                if obj is not None:
+                    f.write(json.dumps(obj) + "\n")
+
+    def playlist_ids(self):
+
+        """
+        :return: the playlists that were extracted on this run date
+        """
+
+        playlist_dir = os.path.join(self.date_dir, "playlists")
+
+        if not os.path.isdir(playlist_dir):
+            return []
+
+        return sorted(name.split(".")[0] for name in os.listdir(playlist_dir) if name.endswith(".jsonl.gz"))
+
+    def load_playlist_pages(self, playlist_id):
+
+        """
+        :return: dict of offset => page of playlist items
+        """
+
+        with gzip.open(self.playlist_path(playlist_id), "rt") as f:
+            entries = [json.loads(line) for line in f]
+
+        return {entry["offset"]: entry["page"] for entry in entries}
+
+    def load_objects(self, id_type):
+
+        """
+        :return: dict of spotify id => object for one of the 'ids' endpoints (the latest response wins)
+        """
+
+        if id_type not in self.objects:
+            path = os.path.join(self.date_dir, f"{id_type}.jsonl.gz")
+            self.objects[id_type] = {}
+            if os.path.exists(path):
+                with gzip.open(path, "rt") as f:
+                    for line in f:
+                        obj = json.loads(line)
+                        self.objects[id_type][obj["id"]] = obj
+
+        return self.objects[id_type]
+
+
+class ArchivedSpotifyAPI(SpotifyAPI):
+
+    """
+    Drop-in replacement for 'SpotifyAPI' that answers every request from a 'RawResponseArchive' instead of calling
+    Spotify, so the regular extraction + loading code can rebuild a past snapshot
+    """
+
+    def __init__(self, archive, metrics=None):
+
+        # no credentials / token / session needed
+        self.replay_archive = archive
+        self.archive = None
+        self.checkpoints = None
+        self.parser = PayloadParser()
+        self.request_pause = 0
+        self.metrics = metrics or RunMetrics()
+
+    def get_playlist_items(self, playlist_id, offset_val):
+
+        self.metrics.increment("api_requests_replayed_total", endpoint="playlist_items")
+
+        return self.replay_archive.load_playlist_pages(playlist_id)[offset_val]
+
+    def get_playlist_page(self, playlist_id, offset_val):
+
+        return self.get_playlist_items(playlist_id, offset_val)  # already decoded => parsed as is
+
+    def get_ids_data(self, id_list, id_type="tracks"):
+
+        self.metrics.increment("api_requests_replayed_total", endpoint=id_type)
+        objects = self.replay_archive.load_objects(id_type)
+
+        return {id_type: [objects.get(spotify_id) for spotify_id in id_list.split(",")]}
+
+    def has_data(self, id_type, spotify_id):
+
+        return spotify_id in self.replay_archive.load_objects(id_type)
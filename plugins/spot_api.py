@@ -1,7 +1,55 @@
 import logging
+import os
+import threading
 import time
 import requests
 
+try:
+    from etl_metrics import RunMetrics  # airflow puts 'plugins' itself on the path
+    from etl_checkpoint import batch_key
+    from spot_payloads import (PayloadParser, decode_json, parse_playlist_page, normalize_albums,
+                               normalize_track_pop_scores, normalize_artist_metrics)
+except ImportError:
+    from plugins.etl_metrics import RunMetrics  # the web app imports it as a package
+    from plugins.etl_checkpoint import batch_key
+    from plugins.spot_payloads import (PayloadParser, decode_json, parse_playlist_page, normalize_albums,
+                                       normalize_track_pop_scores, normalize_artist_metrics)
+
+
+class RateLimiter:
+
+    """
+    Spaces out the requests of every thread sharing a 'SpotifyAPI' client, so they stay within one request rate budget
+    """
+
+    def __init__(self, requests_per_second):
+
+        self.interval = 1 / requests_per_second  # seconds between two consecutive requests
+        self.next_request_at = 0.0  # monotonic time at which the next request may be sent
+        self.lock = threading.Lock()
+
+    def wait(self):
+
+        """
+        Blocks until the calling thread's request fits in the budget
+        """
+
+        with self.lock:
+            now = time.monotonic()
+            request_at = max(self.next_request_at, now)
+            self.next_request_at = request_at + self.interval
+
+        time.sleep(request_at - now)
+
+    def defer(self, seconds):
+
+        """
+        Holds back every thread's requests for a while (e.g. after a 429's 'Retry-After')
+        """
+
+        with self.lock:
+            self.next_request_at = max(self.next_request_at, time.monotonic() + seconds)
+
 
 class SpotifyAPI:
 
@@ -9,10 +57,24 @@ class SpotifyAPI:
     Class that uses the Spotify Web API to retrieve playlist, artist, and track metadata
     """
 
-    def __init__(self, client_id, client_secret):
+    def __init__(self, client_id, client_secret, request_pause=None, metrics=None):
 
         self.client_id = client_id  # Spotify client ID
         self.client_secret = client_secret  # Spotify client secret
+        # base urls can be pointed at a local stand-in for the Spotify API (e.g. for benchmarks)
+        self.accounts_url = os.getenv('SPOTIFY_ACCOUNTS_URL', 'https://accounts.spotify.com')
+        self.api_url = os.getenv('SPOTIFY_API_URL', 'https://api.spotify.com')
+        # seconds to wait between consecutive requests to stay under Spotify's rate limit
+        self.request_pause = float(os.getenv('SPOTIFY_REQUEST_PAUSE', 1)) if request_pause is None else request_pause
+        self.max_retries = 5  # max number of times a throttled (429) request is retried
+        self.session = requests.Session()  # reuse connections across requests
+        self.metrics = metrics or RunMetrics()  # request counts / latencies for the current run
+        self.archive = None  # 'RawResponseArchive' that successful responses are saved to (if any)
+        self.checkpoints = None  # 'RunCheckpoints' that completed id batches are saved to / resumed from (if any)
+        self.parser = PayloadParser()  # decodes + normalizes playlist pages (in worker processes if configured)
+        self.rate_limiter = None  # 'RateLimiter' shared by the threads using this client (if any)
+        self.token_expires_at = 0  # unix time at which the current access token expires
+        self.token_lock = threading.Lock()  # one thread refreshes an expiring token, the others wait for it
         self.headers = self.get_authorization_header()  # grab access token / authorization header for future requests
 
     def get_access_token(self):
@@ -21,21 +83,23 @@ class SpotifyAPI:
         Obtains API access token
         """
 
-        url = 'https://accounts.spotify.com/api/token'
+        url = f"{self.accounts_url}/api/token"
         headers = {"Content-Type": "application/x-www-form-urlencoded"}
         data = {"grant_type": "client_credentials",
                 "client_id": self.client_id,
                 "client_secret": self.client_secret}
 
         try:
-            response = requests.post(url=url,
-                                     headers=headers,
-                                     data=data)
+            response = self.session.post(url=url,
+                                         headers=headers,
+                                         data=data)
+            self.metrics.increment("api_requests_total", endpoint="token", status=response.status_code)
             response.raise_for_status()
-            json_response = response.json()
+            json_response = decode_json(response.content)
+            self.token_expires_at = time.time() + json_response.get("expires_in", 3600)
             logging.info("Successful API request - get access token")
             return json_response.get("access_token")
-        except requests.exceptions.RequestException as err:
+        except (requests.exceptions.RequestException, ValueError) as err:
             logging.info(f"UNSUCCESSFUL API REQUEST - GET ACCESS TOKEN:\n {err}")
 
     def get_authorization_header(self):
@@ -43,130 +107,180 @@ class SpotifyAPI:
         token = self.get_access_token()
         return {"Authorization": f"Bearer {token}"}
 
-    def search_spotify(self, search_term, search_type="playlist"):
+    def get_current_headers(self):
+
+        """
+        Returns the authorization header, requesting a new access token if the current one is about to expire. Safe to
+        call from several threads sharing the client => only one of them requests the new token.
+        """
+
+        if time.time() >= self.token_expires_at - 60:
+            with self.token_lock:
+                if time.time() >= self.token_expires_at - 60:  # not refreshed by another thread in the meantime
+                    self.headers = self.get_authorization_header()
+
+        return self.headers
+
+    def get_with_retry(self, url, params, endpoint):
+
+        """
+        Sends a GET request to the Spotify API. Throttled requests (429) are retried after the 'Retry-After' delay.
+
+        :param url: API endpoint
+        :param params: dict of query string parameters
+        :param endpoint: short name of the endpoint that request metrics are recorded under
+        :return: the final response
+        """
+
+        for attempt in range(self.max_retries + 1):
+
+            if self.rate_limiter is not None:
+                self.rate_limiter.wait()
+
+            headers = self.get_current_headers()
+            with self.metrics.timer("api_request_seconds", endpoint=endpoint):
+                response = self.session.get(url=url,
+                                            headers=headers,
+                                            params=params)
+            self.metrics.increment("api_requests_total", endpoint=endpoint, status=response.status_code)
+
+            if response.status_code != 429 or attempt == self.max_retries:
+                return response
+
+            retry_after = float(response.headers.get("Retry-After", 1))
+            self.metrics.increment("api_retries_total", endpoint=endpoint)
+            self.metrics.increment("api_throttled_seconds_total", retry_after, endpoint=endpoint)
+            logging.info(f"API request throttled, retrying in {retry_after} seconds - {url}")
+            if self.rate_limiter is not None:
+                self.rate_limiter.defer(retry_after)  # the other threads back off too
+            time.sleep(retry_after)
+
+    def search_spotify(self, search_term, search_type="playlist", limit=1):
 
         """
         Searches the Spotify app for an item of interest
 
         :param search_term: the keyword you'd like to search
         :param search_type: specifies what you're looking for (playlist, artist, track, etc.)
-        :return: json object containing data associated with the 1st result returned by the search
+        :param limit: number of search results to return (only the first one by default)
+        :return: json object containing data associated with the results returned by the search
         """
 
-        url = 'https://api.spotify.com/v1/search'
-        headers = self.headers
+        url = f"{self.api_url}/v1/search"
         params = {'q': search_term,
                   'type': search_type,
-                  'limit': 1}  # only return the first search result
+                  'limit': limit}
         try:
-            response = requests.get(url=url,
-                                    headers=headers,
-                                    params=params)
+            response = self.get_with_retry(url, params, endpoint="search")
             response.raise_for_status()
-            json_response = response.json()
+            json_response = decode_json(response.content)
             logging.info(f"Successful API request - search spotify, term = {search_term}, search type = {search_type}")
             return json_response
-        except requests.exceptions.RequestException as err:
+        except (requests.exceptions.RequestException, ValueError) as err:
             logging.exception(f"UNSUCCESSFUL API REQUEST - SEARCH SPOTIFY:\n{err}")
 
-    def get_playlist_items(self, playlist_id, offset_val):
+    def get_playlist(self, playlist_id):
 
         """
-        Grabs the data for up to 50 items (tracks) from a playlist
+        Grabs a playlist's id + name
 
         :param playlist_id: the unique ID for a Spotify playlist
-        :param offset_val: the index value of the first playlist item you'd like to return
-        :return: json object containing metadata for up to 50 tracks from a playlist
+        :return: json object containing the playlist's 'id' and 'name', or None if the request failed
         """
 
-        url = f"https://api.spotify.com/v1/playlists/{playlist_id}/tracks"
-        headers = self.headers
-        params = {'offset': offset_val}
+        url = f"{self.api_url}/v1/playlists/{playlist_id}"
+        params = {'fields': 'id,name'}
 
         try:
-            response = requests.get(url=url,
-                                    headers=headers,
-                                    params=params)
+            response = self.get_with_retry(url, params, endpoint="playlist")
             response.raise_for_status()
-            json_response = response.json()
-            logging.info(f"Successful API request - get playlist items, plist id = {playlist_id}, off = {offset_val}")
+            json_response = decode_json(response.content)
+            logging.info(f"Successful API request - get playlist, plist id = {playlist_id}")
             return json_response
-        except requests.exceptions.RequestException as err:
-            logging.exception(f"UNSUCCESSFUL API REQUEST - GET PLAYLIST ITEMS: \n{err}")
+        except (requests.exceptions.RequestException, ValueError) as err:
+            logging.exception(f"UNSUCCESSFUL API REQUEST - GET PLAYLIST:\n{err}")
 
-    def get_all_playlist_items(self, plist_id):
+    def get_playlist_page(self, playlist_id, offset_val):
 
         """
-        Grabs and organizes the data for ALL tracks on a Spotify playlist of interest
+        Grabs one page of items (up to 100 tracks) from a playlist, without decoding it
 
-        :param plist_id: unique ID for a Spotify playlist
-        :return: 4 lists containing cleaned metadata for each track. Each list is comprised of data that will later be
-        stored in separate tables within a data warehouse.
+        :param playlist_id: the unique ID for a Spotify playlist
+        :param offset_val: the index value of the first playlist item you'd like to return
+        :return: the raw JSON response body (bytes)
         """
 
-        items_processed = 0
-        off = 0  # offset value to be passed into the API request
-        all_track_data = []
-        all_artist_data = []
-        all_track_artist_data = []
-        all_track_playlist_data = []
+        url = f"{self.api_url}/v1/playlists/{playlist_id}/tracks"
+        params = {'offset': offset_val}
 
-        while True:
+        try:
+            response = self.get_with_retry(url, params, endpoint="playlist_items")
+            response.raise_for_status()
+            logging.info(f"Successful API request - get playlist items, plist id = {playlist_id}, off = {offset_val}")
+            if self.archive is not None:
+                self.archive.save_playlist_page(playlist_id, offset_val, decode_json(response.content))
+            return response.content
+        except (requests.exceptions.RequestException, ValueError) as err:
+            logging.exception(f"UNSUCCESSFUL API REQUEST - GET PLAYLIST ITEMS: \n{err}")
 
-            json_response = self.get_playlist_items(plist_id, off)
+    def get_playlist_items(self, playlist_id, offset_val):
 
-            playlist_total_items = json_response['total']
-            request_total_items = len(json_response['items'])
-            json_clean = [json_response['items'][i] for i in range(len(json_response['items'])) if
-                          json_response['items'][i]['track'] is not None]
+        """
+        Grabs the data for up to 100 items (tracks) from a playlist
 
-            # 'track' data
-            track_ids = [i['track']['id'] for i in json_clean]
-            track_names = [i['track']['name'] for i in json_clean]
-            track_durations = [i['track']['duration_ms'] for i in json_clean]
-            track_isrcs = [i['track']['external_ids']['isrc'] for i in json_clean]
-            track_album_positions = [i['track']['track_number'] for i in json_clean]
-            album_ids = [i['track']['album']['id'] for i in json_clean]
-            album_names = [i['track']['album']['name'] for i in json_clean]
-            album_release_dates = [
-                i['track']['album']['release_date'] + '-01-01' if len(i['track']['album']['release_date']) == 4 else
-                i['track']['album']['release_date'] for i in json_clean]  # handle irregular date formats
-            album_types = [i['track']['album']['album_type'] for i in json_clean]
-            album_total_tracks = [i['track']['album']['total_tracks'] for i in json_clean]
-            track_data = list(zip(track_ids, track_names, track_durations, track_isrcs, track_album_positions,
-                                  album_ids, album_names, album_release_dates, album_types, album_total_tracks))
+        :param playlist_id: the unique ID for a Spotify playlist
+        :param offset_val: the index value of the first playlist item you'd like to return
+        :return: json object containing metadata for up to 100 tracks from a playlist
+        """
 
-            # 'track_playlist' data
-            track_plist_positions = [off + i + 1 for i in range(len(json_clean))]
-            track_playlist_data = track_plist_positions.copy()
+        content = self.get_playlist_page(playlist_id, offset_val)
 
-            # 'artist' data
-            artist_ids = [j['id'] for i in json_clean for j in i['track']['artists']]
-            artist_names = [j['name'] for i in json_clean for j in i['track']['artists']]
-            artist_data = list(zip(artist_ids, artist_names))
+        try:
+            return decode_json(content) if content is not None else None
+        except ValueError as err:
+            logging.exception(f"UNSUCCESSFUL API REQUEST - GET PLAYLIST ITEMS: \n{err}")
 
-            # 'track_artist' data
-            track_artist_data = [(track['track']['id'], artist['id']) for track in json_clean for
-                                 artist in track['track']['artists']]
+    def get_all_playlist_items(self, plist_id):
 
-            for i in range(len(track_data)):
-                all_track_data.append(track_data[i])
-                all_track_playlist_data.append(track_playlist_data[i])
+        """
+        Grabs and organizes the data for ALL tracks on a Spotify playlist of interest. The first page gives the
+        playlist's size => the remaining pages are fetched as raw bytes, then decoded + normalized together (in
+        worker processes when SPOTIFY_PARSE_PROCESSES > 1).
 
-            for artist in artist_data:
-                all_artist_data.append(artist)
+        :param plist_id: unique ID for a Spotify playlist
+        :return: 4 lists containing cleaned metadata for each track. Each list is comprised of data that will later be
+        stored in separate tables within a data warehouse.
+        """
 
-            for track_artist in track_artist_data:
-                all_track_artist_data.append(track_artist)
+        first_page = self.get_playlist_items(plist_id, 0)
+        if first_page is None:  # the request failed => fail the playlist instead of storing a partial one
+            raise RuntimeError(f"Could not get the items of playlist {plist_id} at offset 0")
 
-            items_processed += request_total_items
+        playlist_total_items = first_page['total']
+        page_size = first_page.get('limit') or len(first_page['items'])
+        offsets = list(range(page_size, playlist_total_items, page_size)) if page_size else []
 
-            if items_processed == playlist_total_items:
-                logging.info(f"All {playlist_total_items} tracks processed successfully, plist id = {plist_id}")
-                break
+        pages = [first_page]
+        for off in offsets:
+            time.sleep(self.request_pause)
+            content = self.get_playlist_page(plist_id, off)
+            if content is None:
+                raise RuntimeError(f"Could not get the items of playlist {plist_id} at offset {off}")
+            pages.append(content)
 
-            off += request_total_items
-            time.sleep(1)
+        all_track_data = []
+        all_artist_data = []
+        all_track_artist_data = []
+        all_track_playlist_data = []
+
+        for track_data, artist_data, track_artist_data, track_playlist_data in \
+                self.parser.map(parse_playlist_page, pages, [0] + offsets):
+            all_track_data.extend(track_data)
+            all_artist_data.extend(artist_data)
+            all_track_artist_data.extend(track_artist_data)
+            all_track_playlist_data.extend(track_playlist_data)
+
+        logging.info(f"All {playlist_total_items} tracks processed successfully, plist id = {plist_id}")
 
         all_artist_data = list(set(all_artist_data))  # remove potential duplicate artists
 
@@ -214,21 +328,31 @@ class SpotifyAPI:
         :return: Json object containing data associated with list of IDs
         """
 
-        url = f"https://api.spotify.com/v1/{id_type}"
-        headers = self.headers
+        url = f"{self.api_url}/v1/{id_type}"
         params = {'ids': id_list}
 
         try:
-            response = requests.get(url=url,
-                                    headers=headers,
-                                    params=params)
+            response = self.get_with_retry(url, params, endpoint=id_type)
             response.raise_for_status()
-            json_response = response.json()
+            json_response = decode_json(response.content)
             logging.info("Successful API request - get ids data")
+            if self.archive is not None:
+                self.archive.save_objects(id_type, json_response.get(id_type, []))
             return json_response
-        except requests.exceptions.RequestException as err:
+        except (requests.exceptions.RequestException, ValueError) as err:
             logging.exception(f"API REQUEST ERROR - get ids data:\n{err}")
 
+    def has_data(self, id_type, spotify_id):
+
+        """
+        Whether metrics can be fetched for an id (always true for the live API, see 'ArchivedSpotifyAPI')
+
+        :param id_type: 'albums', 'tracks' or 'artists'
+        :param spotify_id: unique Spotify ID
+        """
+
+        return True
+
     def organize_album_data(self, album_ids):
 
         """
@@ -240,14 +364,8 @@ class SpotifyAPI:
 
         logging.info("Getting the tracks' UPC and label information...")
         json_response = self.get_ids_data(album_ids, id_type="albums")
-        albums_arr = json_response['albums']
-        total_albums = len(albums_arr)
 
-        album_upcs = [albums_arr[i]['external_ids']['upc'] for i in range(total_albums)]
-        album_labels = [albums_arr[i]['label'] for i in range(total_albums)]
-        organized_album_data = list(zip(album_upcs, album_labels))
-
-        return organized_album_data
+        return normalize_albums(json_response)
 
     def get_track_pop_scores(self, track_ids):
 
@@ -260,12 +378,8 @@ class SpotifyAPI:
 
         logging.info("Getting track popularity scores...")
         json_response = self.get_ids_data(track_ids, id_type="tracks")
-        track_arr = json_response['tracks']
-        total_tracks = len(track_arr)
-
-        track_pop_scores = [track_arr[i]['popularity'] for i in range(total_tracks)]
 
-        return track_pop_scores
+        return normalize_track_pop_scores(json_response)
 
     def get_artist_metrics(self, artist_ids):
 
@@ -278,14 +392,8 @@ class SpotifyAPI:
 
         logging.info("Getting artists' popularity metrics...")
         json_response = self.get_ids_data(artist_ids, id_type="artists")
-        artists_arr = json_response['artists']
-        total_artists = len(artists_arr)
 
-        artist_followers = [artists_arr[i]['followers']['total'] for i in range(total_artists)]
-        artist_pop_scores = [artists_arr[i]['popularity'] for i in range(total_artists)]
-        artist_pop_metrics = list(zip(artist_pop_scores, artist_followers))
-
-        return artist_pop_metrics
+        return normalize_artist_metrics(json_response)
 
     def process_all_ids(self, id_list, id_type="album"):
 
@@ -312,12 +420,23 @@ class SpotifyAPI:
             sub_list = id_list[i: j]
             ids_str = ",".join(sub_list)
 
-            if id_type == "album":
-                data = self.organize_album_data(ids_str)
-            elif id_type == "artist":
-                data = self.get_artist_metrics(ids_str)
+            # batches completed by an earlier attempt of the task are reused instead of requested again
+            checkpoint_key = batch_key(id_type, ids_str)
+            data = self.checkpoints.get("id_batch", checkpoint_key) if self.checkpoints is not None else None
+
+            if data is not None:
+                data = [tuple(element) if isinstance(element, list) else element for element in data]
             else:
-                data = self.get_track_pop_scores(ids_str)
+                if id_type == "album":
+                    data = self.organize_album_data(ids_str)
+                elif id_type == "artist":
+                    data = self.get_artist_metrics(ids_str)
+                else:
+                    data = self.get_track_pop_scores(ids_str)
+
+                if self.checkpoints is not None:
+                    self.checkpoints.save("id_batch", checkpoint_key, data)
+                time.sleep(self.request_pause)
 
             for element in data:
                 all_responses.append(element)
@@ -328,6 +447,4 @@ class SpotifyAPI:
             else:
                 j += 50
 
-            time.sleep(1)
-
         return all_responses
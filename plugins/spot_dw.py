@@ -1,14 +1,49 @@
 import logging
+import hashlib
 import time
 import datetime
-import pytz
 import os
 from dotenv import load_dotenv
 from psycopg2 import IntegrityError
 from spot_api import SpotifyAPI
+from dw_schema import (TABLE_DEFINITIONS, FACT_TABLES, populate_date_dim, link_track_labels, refresh_search_index,
+                       build_label_share)
+from etl_metrics import RunMetrics, timed_stage
+from fact_archive import EXPORT_QUERIES, archived_date_ids, write_snapshot
+from raw_archive import RawResponseArchive, ArchivedSpotifyAPI
+from etl_checkpoint import RunCheckpoints
 from airflow.providers.postgres.hooks.postgres import PostgresHook
 
 
+def to_date_id(run_date):
+
+    """
+    Converts a logical run date (a date or an Airflow 'ds' style 'YYYY-MM-DD' string) to its 'date_dim' key
+    """
+
+    return str(run_date).replace("-", "")
+
+
+def get_run_date(data_interval_end):
+
+    """
+    The logical date an Airflow run's snapshot is stored under: the (Mountain time) day its data interval ends. Unlike
+    'ds' (the start of the interval => a week earlier for the weekly ETL), this is the day the run fires, and it stays
+    the same if a task is retried after midnight.
+    """
+
+    return data_interval_end.in_timezone("America/Denver").to_date_string()
+
+
+def row_hash(values):
+
+    """
+    Content hash of a dimension row's tracked attributes (everything but its spotify id) => 'row_hash' column
+    """
+
+    return hashlib.md5("\x1f".join("" if value is None else str(value) for value in values).encode()).hexdigest()
+
+
 class PlaylistDW:
 
     """
@@ -22,8 +57,11 @@ class PlaylistDW:
         self.hook = PostgresHook(os.getenv('POSTGRES_CONN_ID'))
         self.connection = self.hook.get_conn()  # connect to the dw
         self.cursor = self.connection.cursor()
+        self.metrics = RunMetrics()  # stage timings, API requests + rows loaded during the current task run
         self.spot_api = SpotifyAPI(os.getenv('SPOTIFY_CLIENT_ID'),
-                                   os.getenv('SPOTIFY_CLIENT_SECRET'))  # instantiate Spotify API object
+                                   os.getenv('SPOTIFY_CLIENT_SECRET'),
+                                   metrics=self.metrics)  # instantiate Spotify API object
+        self.checkpoints = None  # 'RunCheckpoints' of the current run (see 'enable_checkpoints')
 
     def create_tables(self):
 
@@ -32,92 +70,27 @@ class PlaylistDW:
 
         """
 
-        # create the dimensions
-        create_date = """CREATE TABLE IF NOT EXISTS date_dim (
-                            date_id char(8),
-                            date DATE,
-                            date_description varchar(17),
-                            calendar_year char(4),
-                            calendar_quarter SMALLINT,
-                            calendar_month_num SMALLINT,
-                            calendar_month_name varchar(9),
-                            calendar_month_day_num SMALLINT,
-                            day_of_week varchar(9),
-                            constraint date_id_pk primary key (date_id)
-                            )
-                        """
-        self.hook.run(create_date)
-
-        create_playlist = """CREATE TABLE IF NOT EXISTS playlist_dim (
-                                playlist_id SERIAL,
-                                playlist_spotify_id char(22), 
-                                playlist_name varchar(40), 
-                                constraint plist_id_pk primary key (playlist_id),
-                                constraint unique_playlist_spotify_id unique (playlist_spotify_id)
-                                )
-                            """
-        self.hook.run(create_playlist)
-
-        create_track = """CREATE TABLE IF NOT EXISTS track_dim (
-                                track_id SERIAL,
-                                track_spotify_id char(22),
-                                track_name varchar(100),
-                                track_duration_ms INTEGER,
-                                track_isrc char(12),
-                                track_album_position SMALLINT,
-                                album_id char(22),
-                                album_name varchar(100),
-                                album_release_date DATE,
-                                album_type varchar(20),
-                                album_total_tracks SMALLINT,
-                                album_upc varchar(20),
-                                label_name varchar(100),
-                                constraint track_id_pk primary key (track_id),
-                                constraint unique_track_spotify_id unique (track_spotify_id)
-                                )
-                            """
-        self.hook.run(create_track)
-
-        create_artist = """CREATE TABLE IF NOT EXISTS artist_dim (
-                                artist_id SERIAL,
-                                artist_spotify_id char(22),
-                                artist_name varchar(40),
-                                constraint artist_id_pk primary key (artist_id),
-                                constraint unique_artist_spotify_id unique (artist_spotify_id)
-                                )
-                        """
-        self.hook.run(create_artist)
-
-        # create the fact tables
-        create_track_artist = """CREATE TABLE IF NOT EXISTS track_artist_fact (
-                                        track_id INTEGER,
-                                        artist_id INTEGER,
-                                        date_id char(8),
-                                        track_popularity SMALLINT,
-                                        artist_popularity SMALLINT,
-                                        artist_followers INT,
-                                        constraint track_artist_pk primary key (track_id, artist_id, date_id),
-                                        constraint track_artist_fk1 foreign key (track_id) references track_dim (track_id),
-                                        constraint track_artist_fk2 foreign key (artist_id) references artist_dim (artist_id),
-                                        constraint track_artist_fk3 foreign key (date_id) references date_dim (date_id))
-                                    """
-        self.hook.run(create_track_artist)
-
-        create_track_playlist = """CREATE TABLE IF NOT EXISTS track_playlist_fact (
-                                        track_id INTEGER,
-                                        playlist_id INTEGER,
-                                        date_id char(8),
-                                        track_playlist_position SMALLINT,
-                                        track_popularity SMALLINT,
-                                        constraint track_playlist_pk primary key (track_id, playlist_id, date_id),
-                                        constraint track_playlist_fk1 foreign key (track_id) references track_dim (track_id),
-                                        constraint track_playlist_fk2 foreign key (playlist_id) references playlist_dim (playlist_id),
-                                        constraint track_playlist_fk3 foreign key (date_id) references date_dim (date_id)
-                                        )
-                                    """
-        self.hook.run(create_track_playlist)
+        for table_definition in TABLE_DEFINITIONS:
+            self.hook.run(table_definition)
         logging.info("Created the data warehouse's tables")
 
+    def populate_date_dim(self, start_date=None, end_date=None):
+
+        """
+        Pre-populates 'date_dim' with every day in a range using a single statement. Days that are already in the
+        table are left untouched, so this is safe to run before every load.
+
+        :param start_date: first day of the calendar (defaults to DATE_DIM_START, or 2024-01-01)
+        :param end_date: last day of the calendar (defaults to the end of next year)
+        """
+
+        start_date = start_date or os.getenv('DATE_DIM_START', '2024-01-01')
+        end_date = end_date or datetime.date(datetime.date.today().year + 1, 12, 31)
+
+        self.cursor.execute(populate_date_dim, {'start_date': start_date, 'end_date': end_date})
+        self.connection.commit()
+        logging.info(f"Added {self.cursor.rowcount} days ({start_date} - {end_date}) to 'date_dim'")
+
     def insert_record(self, insertion_statement, insertion_values, destination_table="date_dim"):
 
         """
@@ -126,22 +99,86 @@ class PlaylistDW:
         :param insertion_statement: SQL insertion statement
         :param insertion_values: the row of values to be added to a table of interest
         :param destination_table: the fact or dimension table to be updated
+        :return: True if the row was added
         """
 
         try:
             self.hook.run(insertion_statement, parameters=insertion_values)
+            self.metrics.increment("rows_inserted_total", table=destination_table)
+            return True
         except IntegrityError:
+            self.metrics.increment("rows_skipped_total", table=destination_table)
             logging.info(f"The following row is already in the {destination_table}:\n{insertion_values}")
         except Exception as e:
+            self.metrics.increment("rows_failed_total", table=destination_table)
             logging.info(f"The following row was not added to the {destination_table}:\n{insertion_values}\n")
             logging.exception(f"ERROR TYPE - {e}")
 
-    def extract_playlists_data(self, playlist_list):
+        return False
+
+    def update_record(self, update_statement, update_values, destination_table="track_dim"):
+
+        """
+        Updates an existing record of one of the data warehouse's dimension tables
+
+        :param update_statement: SQL update statement
+        :param update_values: the new values of the row (followed by the values of its WHERE clause)
+        :param destination_table: the dimension table to be updated
+        :return: True if the row was updated
+        """
+
+        try:
+            self.hook.run(update_statement, parameters=update_values)
+            self.metrics.increment("rows_updated_total", table=destination_table)
+            return True
+        except Exception as e:
+            self.metrics.increment("rows_failed_total", table=destination_table)
+            logging.info(f"The following row was not updated in the {destination_table}:\n{update_values}\n")
+            logging.exception(f"ERROR TYPE - {e}")
+
+        return False
+
+    def archive_raw_responses(self, run_date):
+
+        """
+        Saves the API responses of the current run to the raw archive (only when RAW_ARCHIVE_DIR is set)
+
+        :param run_date: logical date of the run => the archive folder responses are stored under
+        """
+
+        if os.getenv('RAW_ARCHIVE_DIR'):
+            self.spot_api.archive = RawResponseArchive(run_date)
+
+    def enable_checkpoints(self, run_key):
+
+        """
+        Saves every extracted playlist + id batch of the current task as it completes. If the task fails and is
+        retried, the completed units are reused and only the remaining ones are requested from Spotify.
+
+        :param run_key: key the checkpoints are stored under, shared by every attempt of the run (e.g. Airflow's
+        'run_id')
+        """
+
+        self.checkpoints = RunCheckpoints(self.hook, run_key, metrics=self.metrics)
+        self.spot_api.checkpoints = self.checkpoints
+
+    def clear_checkpoints(self):
+
+        """
+        Deletes the current run's checkpoints (once its data has been loaded)
+        """
+
+        if self.checkpoints is not None:
+            self.checkpoints.clear()
+
+    @timed_stage("extract_playlists_data")
+    def extract_playlists_data(self, playlist_list, run_date):
 
         """
         Collects and cleans playlist data to be stored in the data warehouse
 
         :param playlist_list: list of Spotify playlist IDs
+        :param run_date: logical date of the run => where the raw API responses are archived
         :return: 4 lists containing cleaned data that will eventually be added to the data warehouse's tables
         """
 
@@ -150,16 +187,28 @@ class PlaylistDW:
         track_artist_pairings = []
         track_playlist_pairings = []
 
+        self.archive_raw_responses(run_date)
+
         for playlist in playlist_list:
 
-            track_data, artist_data, ta_data, tp_data = self.spot_api.prepare_playlist_data(playlist)
+            # playlists extracted by an earlier attempt of the task are reused
+            checkpoint = self.checkpoints.get("playlist", playlist) if self.checkpoints is not None else None
+
+            if checkpoint is not None:
+                track_data, artist_data, ta_data, tp_data = [[tuple(row) for row in rows] for rows in checkpoint]
+            else:
+                with self.metrics.timer("playlist_extract_seconds", playlist=playlist):  # spot slow playlists
+                    track_data, artist_data, ta_data, tp_data = self.spot_api.prepare_playlist_data(playlist)
+                if self.checkpoints is not None:
+                    self.checkpoints.save("playlist", playlist, [track_data, artist_data, ta_data, tp_data])
+                time.sleep(2 * self.spot_api.request_pause)
+            self.metrics.increment("tracks_extracted_total", len(tp_data))
 
             tracks.append(track_data)
             artists.append(artist_data)
             track_artist_pairings.append(ta_data)
             track_playlist_pairings.append(tp_data)
 
-            time.sleep(2)
             logging.info(f"\nFinished collecting initial playlist data for playlist with ID = {playlist}\n")
 
         logging.info(f"\nFinished collecting data for all tracked playlists\n")
@@ -176,89 +225,217 @@ class PlaylistDW:
 
         return tracks_cleaned, artists_cleaned, track_artist_pairings_cleaned, track_playlist_pairings_cleaned
 
-    def update_dimensions(self, track_data, artist_data):
+    @timed_stage("update_dimensions")
+    def update_dimensions(self, track_data, artist_data, run_date=None, label_history=None):
 
         """
-        Adds new rows to the dimension tables within the data warehouse
+        Adds new rows to the dimension tables within the data warehouse and updates the rows whose attributes changed
+        since they were stored (renamed artists, corrected labels, updated album metadata...). Each row stores a hash
+        of its attributes, so the unchanged rows are skipped without being rewritten. Rows are stamped with the run
+        date, and a row last updated by a later run is never overwritten => replaying an old run's payloads can't
+        revert the dimensions to stale values.
 
         :param track_data: list of cleaned track metadata that's been extracted from playlists of interest
         :param artist_data: list of cleaned artist metadata that's been extracted from playlists of interest
+        :param run_date: logical date of the run the metadata was extracted for (defaults to today)
+        :param label_history: when True, label changes are recorded in 'track_label_history' (defaults to the
+        TRACK_LABEL_HISTORY env var, on)
         """
 
-        # update 'date_dim' table
-        mountain_tz = pytz.timezone("America/Denver")
-        todays_date = datetime.datetime.now(mountain_tz)
-        calendar_year = todays_date.year
-        calendar_month_num = f"{todays_date.month:02}"
-        calendar_month_day_num = f"{todays_date.day:02}"
-        date_full = f"{calendar_year}-{calendar_month_num}-{calendar_month_day_num}"
-        date_id = date_full.replace("-", "")
-        date_description = todays_date.strftime("%B %d, %Y")
-        calendar_quarter = (todays_date.month - 1) // 3 + 1
-        calendar_month_name = todays_date.strftime("%B")
-        day_of_week = todays_date.strftime("%A")
-
-        date_data = (date_id, date_full, date_description, calendar_year, calendar_quarter, calendar_month_num,
-                     calendar_month_name, calendar_month_day_num, day_of_week)
-        date_insert = """INSERT INTO date_dim (date_id, date, date_description, calendar_year, calendar_quarter, 
-                                            calendar_month_num, calendar_month_name, calendar_month_day_num, 
-                                            day_of_week)
-                                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
-                    """
-        self.insert_record(date_insert, date_data, destination_table="date_dim")
-        logging.info("Added date information to 'date_dim' table")
+        run_date = run_date or datetime.date.today()
+        if label_history is None:
+            label_history = os.getenv('TRACK_LABEL_HISTORY', 'true').lower() == 'true'
+
+        # 'date_dim' is pre-populated by 'populate_date_dim'
 
         # update 'track_dim' table
         track_insert = """INSERT INTO track_dim (track_spotify_id, track_name, track_duration_ms, track_isrc, 
                                                 track_album_position, album_id, album_name, album_release_date, 
-                                                album_type, album_total_tracks, album_upc, label_name)
-                                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                                                album_type, album_total_tracks, album_upc, label_name, row_hash,
+                                                updated_at)
+                                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s::date)
                         """
-        for track in track_data:
-            self.insert_record(track_insert, track, destination_table="track_dim")
-        logging.info(f"Added track data to 'track_dim' table")
+        # 'label_id' is reset => relinked from the (possibly corrected) label name below
+        track_update = """UPDATE track_dim SET track_name = %s, track_duration_ms = %s, track_isrc = %s,
+                                               track_album_position = %s, album_id = %s, album_name = %s,
+                                               album_release_date = %s, album_type = %s, album_total_tracks = %s,
+                                               album_upc = %s, label_name = %s, label_id = NULL, row_hash = %s,
+                                               updated_at = %s::date
+                          WHERE track_spotify_id = %s AND (updated_at IS NULL OR updated_at::date <= %s::date)
+                       """
+        changed_tracks = self.apply_dimension_changes(track_data, "track_dim", "track_spotify_id", track_insert,
+                                                      track_update, run_date)
+        logging.info(f"Added / updated {len(changed_tracks)} rows of the 'track_dim' table")
+
+        # update 'label_dim' / 'label_alias' + link the new / updated tracks to their labels
+        self.cursor.execute(link_track_labels)
+        self.connection.commit()
+        logging.info(f"Linked {self.cursor.rowcount} new tracks to their labels")
+
+        if label_history:
+            self.record_label_history(changed_tracks, run_date)
 
         # update 'artist_dim' table
-        artist_insert = "INSERT INTO artist_dim (artist_spotify_id, artist_name) VALUES (%s, %s)"
-        for artist in artist_data:
-            self.insert_record(artist_insert, artist, destination_table="artist_dim")
-        logging.info(f"Added artist data to 'artist_dim' table")
+        artist_insert = """INSERT INTO artist_dim (artist_spotify_id, artist_name, row_hash, updated_at)
+                           VALUES (%s, %s, %s, %s::date)"""
+        artist_update = """UPDATE artist_dim SET artist_name = %s, row_hash = %s, updated_at = %s::date
+                           WHERE artist_spotify_id = %s AND (updated_at IS NULL OR updated_at::date <= %s::date)"""
+        changed_artists = self.apply_dimension_changes(artist_data, "artist_dim", "artist_spotify_id",
+                                                       artist_insert, artist_update, run_date)
+        logging.info(f"Added / updated {len(changed_artists)} rows of the 'artist_dim' table")
+
+        self.bump_data_version()
+
+    def apply_dimension_changes(self, rows, table, key_column, insert_statement, update_statement, run_date):
 
-    def organize_facts(self, new_track_artist_data, track_playlist_data):
+        """
+        Compares incoming dimension rows with the hashes stored in the dw => inserts the new rows, updates the changed
+        ones and skips the rest, along with the rows that a later run already updated
+
+        :param rows: tuples of (spotify id, *tracked attributes) in the column order of the statements
+        :param table: the dimension table to be updated
+        :param key_column: the table's spotify id column
+        :param insert_statement: SQL insertion statement taking (spotify id, *attributes, row hash, run date)
+        :param update_statement: SQL update statement taking (*attributes, row hash, run date, spotify id, run date).
+        Its WHERE clause re-checks the run date, so concurrent replays can't overwrite a newer row either.
+        :param run_date: logical date of the run the rows were extracted for
+        :return: list of the spotify ids that were inserted or updated
+        """
+
+        run_date = datetime.date.fromisoformat(str(run_date))
+        hashes = {row[0]: row_hash(row[1:]) for row in rows}
+
+        stored_rows = {}
+        if hashes:
+            self.cursor.execute(f"""SELECT {key_column}, row_hash, updated_at::date FROM {table}
+                                    WHERE {key_column} = ANY(%s::bpchar[])""", (list(hashes),))
+            stored_rows = {spotify_id: (stored_hash, updated_on)
+                           for spotify_id, stored_hash, updated_on in self.cursor.fetchall()}
+
+        changed_ids = []
+        unchanged = 0
+        outdated = 0
+        for row in rows:
+            spotify_id = row[0]
+            if spotify_id not in stored_rows:
+                if self.insert_record(insert_statement, row + (hashes[spotify_id], run_date), destination_table=table):
+                    changed_ids.append(spotify_id)
+                    stored_rows[spotify_id] = (hashes[spotify_id], run_date)  # later duplicates => unchanged
+            elif stored_rows[spotify_id][0] == hashes[spotify_id]:
+                unchanged += 1
+            elif stored_rows[spotify_id][1] is not None and stored_rows[spotify_id][1] > run_date:
+                outdated += 1  # e.g. a replayed run's payload => the stored row is newer
+            elif self.update_record(update_statement, row[1:] + (hashes[spotify_id], run_date, spotify_id, run_date),
+                                    destination_table=table):
+                changed_ids.append(spotify_id)
+                stored_rows[spotify_id] = (hashes[spotify_id], run_date)
+
+        self.metrics.increment("rows_unchanged_total", unchanged, table=table)
+        self.metrics.increment("rows_outdated_total", outdated, table=table)
+
+        return changed_ids
+
+    def record_label_history(self, track_spotify_ids, run_date):
+
+        """
+        Type-2 history of the tracks' labels: closes the current 'track_label_history' row of every track whose label
+        changed and opens a new one with its current label. Rows are valid from / to the date of the run that saw the
+        change.
+
+        :param track_spotify_ids: the tracks that were inserted or updated by this run
+        :param run_date: logical date of the run
+        """
+
+        if not track_spotify_ids:
+            return
+
+        params = {'track_ids': track_spotify_ids, 'run_date': run_date}
+
+        self.cursor.execute("""UPDATE track_label_history tlh SET valid_to = %(run_date)s::date
+                               FROM track_dim td
+                               WHERE tlh.track_id = td.track_id AND tlh.valid_to IS NULL
+                                   AND td.track_spotify_id = ANY(%(track_ids)s::bpchar[])
+                                   AND tlh.label_name IS DISTINCT FROM td.label_name""", params)
+        closed = self.cursor.rowcount
+
+        # a label that changes again on the same run date replaces that date's row
+        self.cursor.execute("""INSERT INTO track_label_history (track_id, label_id, label_name, valid_from)
+                               SELECT td.track_id, td.label_id, td.label_name, %(run_date)s::date
+                               FROM track_dim td
+                               WHERE td.track_spotify_id = ANY(%(track_ids)s::bpchar[])
+                                   AND NOT EXISTS (SELECT 1 FROM track_label_history tlh
+                                                   WHERE tlh.track_id = td.track_id AND tlh.valid_to IS NULL)
+                               ON CONFLICT (track_id, valid_from) DO UPDATE
+                               SET label_id = EXCLUDED.label_id, label_name = EXCLUDED.label_name, valid_to = NULL""",
+                            params)
+        self.connection.commit()
+        logging.info(f"Recorded {closed} label changes in 'track_label_history'")
+
+    @timed_stage("refresh_search_index")
+    def refresh_search_index(self):
+
+        """
+        Brings the dashboard's search index ('search_index') up to date with the dimensions + track / artist
+        pairings. Only the documents of new / changed tracks, artists, albums and labels are rewritten.
+        """
+
+        self.cursor.execute(refresh_search_index)
+        self.connection.commit()
+        self.bump_data_version()
+        logging.info("Refreshed the search index")
+
+    @timed_stage("organize_facts")
+    def organize_facts(self, new_track_artist_data, track_playlist_data, run_date, refresh_existing=True):
 
         """
         Compiles all of the information needed for the data warehouse's fact tables. Combines existing
         playlist data with the dimension tables' foreign keys and the latest performance metrics for both new and
         existing tracks / artists that are already present inside the dw.
 
-        :param track_artist_data: previously-extracted data that will be added to the 'track_artist_fact' table
+        :param new_track_artist_data: previously-extracted track / artist pairings => 'track_artist_bridge'
         :param track_playlist_data: previously-extracted data that will be added to the 'track_playlist_fact' table
-        :return: 2 lists of cleaned data that will be added to their respective fact tables in the dw
+        :param run_date: logical date of the run (e.g. Airflow's 'ds') => the snapshot the facts are stored under
+        :param refresh_existing: when False, only the tracks / artists in the extracted data are refreshed instead of
+        every track / artist already stored in the dw
+        :return: 4 lists of cleaned data for 'track_metrics_fact', 'artist_metrics_fact', 'track_artist_bridge' and
+        'track_playlist_fact'
         """
-        logging.info("Gathering and organizing additional data for both fact tables")
+        logging.info("Gathering and organizing additional data for the fact tables")
+
+        # 'TRACK_METRICS' / 'ARTIST_METRICS'
+
+        extracted_tracks = {i[0] for i in new_track_artist_data} | {i[0] for i in track_playlist_data}
+        extracted_artists = {i[1] for i in new_track_artist_data}
 
-        # 'TRACK_ARTIST'
+        # archived tracks / artists that are back on a tracked playlist get refreshed again
+        self.cursor.execute("UPDATE track_dim SET archived_at = NULL WHERE archived_at IS NOT NULL "
+                            "AND track_spotify_id = ANY(%s::bpchar[])", (list(extracted_tracks),))
+        self.cursor.execute("UPDATE artist_dim SET archived_at = NULL WHERE archived_at IS NOT NULL "
+                            "AND artist_spotify_id = ANY(%s::bpchar[])", (list(extracted_artists),))
+        self.connection.commit()
 
         # look up id info in the data warehouse that will be used as foreign keys in the fact tables
-        track_id_query = "SELECT track_id, track_spotify_id from track_dim"
+        track_id_query = "SELECT track_id, track_spotify_id from track_dim WHERE archived_at IS NULL"
         self.cursor.execute(track_id_query)
         track_id_info = [track_info for track_info in self.cursor.fetchall()]
 
-        artist_id_query = "SELECT artist_id, artist_spotify_id from artist_dim"
+        artist_id_query = "SELECT artist_id, artist_spotify_id from artist_dim WHERE archived_at IS NULL"
         self.cursor.execute(artist_id_query)
         artist_id_info = [artist_info for artist_info in self.cursor.fetchall()]
 
-        mountain_tz = pytz.timezone("America/Denver")
-        current_date = datetime.datetime.now(mountain_tz)
-        date_values = f"{current_date.year}-{current_date.month:02}-{current_date.day:02}"
-        date_query = """SELECT date_id
-                            FROM date_dim
-                            WHERE date = %s
-                        """
-        self.cursor.execute(date_query, (date_values,))
-        date_foreign_key = self.cursor.fetchall()[0][0]
+        if not refresh_existing:
+            track_id_info = [i for i in track_id_info if i[1] in extracted_tracks]
+            artist_id_info = [i for i in artist_id_info if i[1] in extracted_artists]
+
+        # on replay, only the tracks / artists whose responses were archived can be refreshed
+        track_id_info = [i for i in track_id_info if self.spot_api.has_data("tracks", i[1])]
+        artist_id_info = [i for i in artist_id_info if self.spot_api.has_data("artists", i[1])]
+
+        self.archive_raw_responses(run_date)
+
+        date_foreign_key = to_date_id(run_date)
 
-        # collect latest facts / measurements to add to 'track_artist_fact'
+        # collect latest facts / measurements to add to 'track_metrics_fact' / 'artist_metrics_fact'
         track_ids = [i[0] for i in track_id_info]
         track_spotify_ids = [i[1] for i in track_id_info]
         track_pop_scores = self.spot_api.process_all_ids(track_spotify_ids, id_type="track")
@@ -269,25 +446,19 @@ class PlaylistDW:
         artist_pop_metrics = self.spot_api.process_all_ids(artist_spotify_ids, id_type="artist")
         artist_pop_dict = {i[0]: i[1] for i in zip(artist_ids, artist_pop_metrics)}  # store pop + followers in dict
 
-        # grab distinct artist / track pairings that are currently in 'track_artist_fact'
-        track_artist_query = "SELECT DISTINCT track_id, artist_id from track_artist_fact"
-        self.cursor.execute(track_artist_query)
-        existing_track_artist_combinations = [ta_combo for ta_combo in self.cursor.fetchall()]
-        # grab new artist / track pairings => use dicts look up the relevant ID info to add to 'track_artist_fact'
+        # one row per track / artist (instead of one per track + artist pairing)
+        final_track_metric_data = [(track_id, date_foreign_key, track_pop) for track_id, track_pop in
+                                   track_pop_dict.items()]
+        final_artist_metric_data = [(artist_id, date_foreign_key, artist_pop[0], artist_pop[1]) for
+                                    artist_id, artist_pop in artist_pop_dict.items()]
+
+        # 'TRACK_ARTIST_BRIDGE'
+
+        # new artist / track pairings => use dicts to look up the relevant ID info (existing pairings are skipped)
         track_id_dict = {track_id[1]: track_id[0] for track_id in track_id_info}
         artist_id_dict = {artist_id[1]: artist_id[0] for artist_id in artist_id_info}
-        new_track_artist_combinations = [(track_id_dict[i[0]], artist_id_dict[i[1]]) for i in new_track_artist_data]
-        unique_track_artist_combinations = list(set(existing_track_artist_combinations + new_track_artist_combinations))
-
-        # combine the final data together before inserting into 'track_artist_fact'
-        final_ta_track_ids = [i[0] for i in unique_track_artist_combinations]
-        final_ta_artist_ids = [i[1] for i in unique_track_artist_combinations]
-        final_ta_date_fks = [date_foreign_key for i in range(len(unique_track_artist_combinations))]
-        final_ta_track_pops = [track_pop_dict[i] for i in final_ta_track_ids]  # KEY ERROR: 88
-        final_ta_artist_pops = [artist_pop_dict[j][0] for j in final_ta_artist_ids]
-        final_ta_artist_followers = [artist_pop_dict[j][1] for j in final_ta_artist_ids]
-        final_track_artist_data = list(zip(final_ta_track_ids, final_ta_artist_ids, final_ta_date_fks,
-                                           final_ta_track_pops, final_ta_artist_pops, final_ta_artist_followers))
+        final_track_artist_data = list({(track_id_dict[i[0]], artist_id_dict[i[1]]) for i in new_track_artist_data
+                                        if i[0] in track_id_dict and i[1] in artist_id_dict})
 
         # 'TRACK_PLAYLIST'
 
@@ -306,40 +477,745 @@ class PlaylistDW:
         final_track_playlist_data = list(zip(final_tp_track_ids, final_tp_playlist_ids, final_tp_date_fks,
                                              final_tp_playlist_positions, final_tp_track_pops))
 
-        return final_track_artist_data, final_track_playlist_data
+        return final_track_metric_data, final_artist_metric_data, final_track_artist_data, final_track_playlist_data
 
-    def update_fact_tables(self, cleaned_track_artist_data, cleaned_track_playlist_data):
+    @timed_stage("update_fact_tables")
+    def update_fact_tables(self, cleaned_track_metric_data, cleaned_artist_metric_data, cleaned_track_artist_data,
+                           cleaned_track_playlist_data, change_only=None, heartbeat_weeks=None):
 
         """
-        Updates the data warehouse's 2 fact tables
+        Updates the data warehouse's fact tables. In change-only mode a track / artist metric row is only written when
+        its values differ from the entity's latest stored row, or when that row is 'heartbeat_weeks' old. Readers get
+        dense series back from the 'track_metrics_dense' / 'artist_metrics_dense' views and the '*_metrics_asof'
+        functions.
 
-        :param cleaned_track_artist_data: list containing rows of data to be added to the 'track_artist_fact' table
+        :param cleaned_track_metric_data: list containing rows of data to be added to the 'track_metrics_fact' table
+        :param cleaned_artist_metric_data: list containing rows of data to be added to the 'artist_metrics_fact' table
+        :param cleaned_track_artist_data: list of (track id, artist id) pairings for the 'track_artist_bridge' table
         :param cleaned_track_playlist_data: list containing rows of data to be added to the 'track_playlist_fact' table
+        :param change_only: only store changed metrics (defaults to FACT_STORAGE_MODE=changes)
+        :param heartbeat_weeks: max age of an entity's latest row in change-only mode (defaults to FACT_HEARTBEAT_WEEKS)
+        :raises RuntimeError: if any of the tables couldn't be loaded (the other tables are still loaded)
+        """
+
+        if change_only is None:
+            change_only = os.getenv('FACT_STORAGE_MODE', 'full') == 'changes'
+        heartbeat_weeks = (heartbeat_weeks or int(os.getenv('FACT_HEARTBEAT_WEEKS', 4))) if change_only else 0
+
+        # register the snapshot(s) => tells readers how far a value may be carried forward
+        snapshot_date_ids = ({row[1] for row in cleaned_track_metric_data + cleaned_artist_metric_data}
+                             | {row[2] for row in cleaned_track_playlist_data})
+        self.cursor.executemany("""INSERT INTO fact_snapshot (date_id, heartbeat_weeks) VALUES (%s, %s)
+                                   ON CONFLICT (date_id) DO UPDATE SET heartbeat_weeks = EXCLUDED.heartbeat_weeks""",
+                                [(date_id, heartbeat_weeks) for date_id in snapshot_date_ids])
+        self.connection.commit()
+
+        if change_only:
+            cleaned_track_metric_data = self.drop_unchanged_metrics(
+                "track_metrics_fact", ["track_id", "date_id", "track_popularity"], cleaned_track_metric_data,
+                heartbeat_weeks)
+            cleaned_artist_metric_data = self.drop_unchanged_metrics(
+                "artist_metrics_fact", ["artist_id", "date_id", "artist_popularity", "artist_followers"],
+                cleaned_artist_metric_data, heartbeat_weeks)
+
+        fact_inserts = [
+            ("track_metrics_fact",
+             """INSERT INTO track_metrics_fact (track_id, date_id, track_popularity)
+                VALUES (%s, %s, %s)
+                ON CONFLICT DO NOTHING""",
+             cleaned_track_metric_data),
+            ("artist_metrics_fact",
+             """INSERT INTO artist_metrics_fact (artist_id, date_id, artist_popularity, artist_followers)
+                VALUES (%s, %s, %s, %s)
+                ON CONFLICT DO NOTHING""",
+             cleaned_artist_metric_data),
+            ("track_artist_bridge",
+             """INSERT INTO track_artist_bridge (track_id, artist_id)
+                VALUES (%s, %s)
+                ON CONFLICT DO NOTHING""",
+             cleaned_track_artist_data),
+            ("track_playlist_fact",
+             """INSERT INTO track_playlist_fact (track_id, playlist_id, date_id, track_playlist_position,
+                                                 track_popularity)
+                VALUES (%s, %s, %s, %s, %s)
+                ON CONFLICT DO NOTHING""",
+             cleaned_track_playlist_data),
+        ]
+
+        failed_tables = []
+        for table, insert_statement, rows in fact_inserts:
+            try:
+                self.cursor.executemany(insert_statement, rows)
+                self.connection.commit()
+                self.record_rows_loaded(table, len(rows))
+                logging.info(f"Data added to '{table}' table")
+            except Exception:
+                self.connection.rollback()
+                failed_tables.append(table)
+                logging.exception(f"Data NOT added to '{table}' table")
+
+        self.bump_data_version()  # the other tables' rows are committed either way
+        if failed_tables:
+            raise RuntimeError(f"Data NOT added to {', '.join(failed_tables)}")
+
+        logging.info("All playlist data successfully added to the DW")
+
+    def drop_unchanged_metrics(self, table, columns, rows, heartbeat_weeks):
+
+        """
+        Filters out the metric rows whose values match the entity's latest stored row, as long as that row is less than
+        'heartbeat_weeks' old
+
+        :param table: 'track_metrics_fact' or 'artist_metrics_fact'
+        :param columns: the table's columns, in the same order as the rows (entity id, date id, metric values)
+        :param rows: metric rows of a single snapshot
+        :param heartbeat_weeks: an entity's row is rewritten once its latest row is this many weeks old
+        :return: the rows that need to be stored
+        """
+
+        if not rows:
+            return rows
+
+        key_column = columns[0]
+        latest_query = f"""SELECT DISTINCT ON ({key_column}) {', '.join(columns)}
+                           FROM {table}
+                           WHERE date_id < %(date_id)s
+                             AND date_id > to_char(to_date(%(date_id)s, 'YYYYMMDD') - 7 * %(weeks)s, 'YYYYMMDD')
+                           ORDER BY {key_column}, date_id DESC
+                        """
+        self.cursor.execute(latest_query, {'date_id': rows[0][1], 'weeks': heartbeat_weeks})
+        latest_values = {row[0]: tuple(row[2:]) for row in self.cursor.fetchall()}
+
+        changed_rows = [row for row in rows if latest_values.get(row[0]) != tuple(row[2:])]
+        self.metrics.increment("rows_unchanged_total", len(rows) - len(changed_rows), table=table)
+        logging.info(f"{len(changed_rows)} of {len(rows)} '{table}' rows changed")
+
+        return changed_rows
+
+    def bump_data_version(self):
+
+        """
+        Marks the data the dashboard shows as changed => its cached partials / ETags are invalidated (see
+        'dw_data_version'). Called once a step's changes are committed.
+        """
+
+        self.cursor.execute("UPDATE dw_data_version SET version = version + 1, changed_at = now()")
+        self.connection.commit()
+
+    def record_rows_loaded(self, table, rows_sent):
+
+        """
+        Counts the rows the last statement inserted vs. the rows it skipped (e.g. ON CONFLICT DO NOTHING)
+
+        :param table: destination table
+        :param rows_sent: number of rows passed to the statement
+        """
+
+        rows_inserted = max(self.cursor.rowcount, 0)  # executemany sums the rowcount of every execution
+        self.metrics.increment("rows_inserted_total", rows_inserted, table=table)
+        self.metrics.increment("rows_skipped_total", rows_sent - rows_inserted, table=table)
+
+    @timed_stage("update_playlist_movements")
+    def update_playlist_movements(self, run_date):
+
+        """
+        Compares each playlist's snapshot from a run with its previous one and stores the tracks that were added,
+        dropped, or moved to a new position in 'playlist_movement_fact'. Only the 2 snapshots involved are read.
+
+        :param run_date: logical date of the run whose snapshot is compared
+        """
+
+        date_id = to_date_id(run_date)
+
+        movement_insert = """
+            INSERT INTO playlist_movement_fact (track_id, playlist_id, date_id, prev_date_id, movement_type,
+                                                previous_position, current_position, position_change)
+            WITH snapshot_dates AS (
+                SELECT
+                    cur_playlists.playlist_id,
+                    (SELECT max(tpf.date_id)
+                     FROM track_playlist_fact tpf
+                     WHERE tpf.playlist_id = cur_playlists.playlist_id AND tpf.date_id < %(date_id)s) AS prev_date_id
+                FROM (SELECT DISTINCT playlist_id FROM track_playlist_fact WHERE date_id = %(date_id)s) cur_playlists
+            ),
+            cur AS (
+                SELECT track_id, playlist_id, track_playlist_position
+                FROM track_playlist_fact
+                WHERE date_id = %(date_id)s
+            ),
+            prev AS (
+                SELECT tpf.track_id, tpf.playlist_id, tpf.track_playlist_position
+                FROM track_playlist_fact tpf
+                JOIN snapshot_dates sd ON sd.playlist_id = tpf.playlist_id AND sd.prev_date_id = tpf.date_id
+            ),
+            movements AS (
+                SELECT
+                    coalesce(cur.track_id, prev.track_id) AS track_id,
+                    coalesce(cur.playlist_id, prev.playlist_id) AS playlist_id,
+                    CASE
+                        WHEN prev.track_id IS NULL THEN 'add'
+                        WHEN cur.track_id IS NULL THEN 'drop'
+                        WHEN cur.track_playlist_position <> prev.track_playlist_position THEN 'move'
+                    END AS movement_type,
+                    prev.track_playlist_position AS previous_position,
+                    cur.track_playlist_position AS current_position,
+                    prev.track_playlist_position - cur.track_playlist_position AS position_change  -- > 0 => moved up
+                FROM cur
+                FULL OUTER JOIN prev ON prev.track_id = cur.track_id AND prev.playlist_id = cur.playlist_id
+            )
+            SELECT m.track_id, m.playlist_id, %(date_id)s, sd.prev_date_id, m.movement_type, m.previous_position,
+                   m.current_position, m.position_change
+            FROM movements m
+            JOIN snapshot_dates sd ON sd.playlist_id = m.playlist_id
+            WHERE sd.prev_date_id IS NOT NULL  -- a playlist's 1st snapshot has nothing to compare against
+              AND m.movement_type IS NOT NULL  -- skip tracks that stayed in the same position
         """
 
-        # update 'track_artist_fact'
-        track_artist_insert = """INSERT INTO track_artist_fact (
-                                    track_id, artist_id, date_id, track_popularity, artist_popularity, artist_followers)
-                                    VALUES (%s, %s, %s, %s, %s, %s)
-                                """
         try:
-            self.cursor.executemany(track_artist_insert, cleaned_track_artist_data)
+            self.cursor.execute("DELETE FROM playlist_movement_fact WHERE date_id = %s", (date_id,))
+            self.cursor.execute(movement_insert, {'date_id': date_id})
+            self.metrics.increment("rows_inserted_total", self.cursor.rowcount, table="playlist_movement_fact")
             self.connection.commit()
-            logging.info("Data successfully added to 'track_artist_fact' table")
+            logging.info(f"Added {self.cursor.rowcount} rows to 'playlist_movement_fact' for {date_id}")
+            self.bump_data_version()
         except Exception:
-            logging.exception("Data NOT added to 'track_artist_fact' table")
+            self.connection.rollback()
+            logging.exception("Data NOT added to 'playlist_movement_fact' table")
+
+    @timed_stage("update_label_share")
+    def update_label_share(self, run_date):
+
+        """
+        Rolls the playlist placements of a run's snapshot up into 'label_share_weekly' => every label x playlist, label,
+        playlist and snapshot total in one GROUP BY CUBE. Snapshots that were loaded before the table existed are
+        rolled up along the way, so the rollup is built incrementally and only the snapshots involved are read. Each
+        snapshot is a weekly load (backfills are added to the latest one) => one rollup per week.
+
+        :param run_date: logical date of the run whose snapshot is rolled up (again)
+        """
+
+        self.cursor.execute("""SELECT date_id FROM fact_snapshot fs
+                                WHERE date_id = %s
+                                   OR NOT EXISTS (SELECT 1 FROM label_share_weekly lsw WHERE lsw.date_id = fs.date_id)
+                                ORDER BY date_id
+                            """, (to_date_id(run_date),))
+        date_ids = [row[0] for row in self.cursor.fetchall()]
+
+        if not date_ids:
+            return
 
-        # update 'track_playlist_fact'
-        track_playlist_insert = """INSERT INTO track_playlist_fact (
-                                        track_id, playlist_id, date_id, track_playlist_position, track_popularity)
-                                    VALUES (%s, %s, %s, %s, %s)
-                                    """
         try:
-            self.cursor.executemany(track_playlist_insert, cleaned_track_playlist_data)
+            self.cursor.execute("DELETE FROM label_share_weekly WHERE date_id = ANY(%s::bpchar[])", (date_ids,))
+            self.cursor.execute(build_label_share, {'date_ids': date_ids})
+            self.metrics.increment("rows_inserted_total", self.cursor.rowcount, table="label_share_weekly")
             self.connection.commit()
-            logging.info("Data added to 'track_playlist_fact' table")
+            logging.info(f"Added {self.cursor.rowcount} rows to 'label_share_weekly' for {len(date_ids)} snapshot(s)")
+            self.bump_data_version()
         except Exception:
-            logging.exception("Data NOT added to 'track_playlist_fact' table")
+            self.connection.rollback()
+            logging.exception("Data NOT added to 'label_share_weekly' table")
 
-        logging.info("All playlist data successfully added to the DW")
+    @timed_stage("compute_trends")
+    def compute_trends(self, run_date):
+
+        """
+        Ranks every track and artist by how quickly they're growing. Compares a snapshot with the previous one and
+        scores the week-over-week changes (popularity, followers, playlist adds) as z-scores, all inside postgres
+        using window functions. A track's score also includes its popularity z-score within its label. Every
+        'fact_snapshot' date is a full weekly load (backfills are added to the latest one, see 'backfill_playlist'),
+        so the previous snapshot is always the previous week's.
+
+        :param run_date: logical date of the run whose snapshot is scored
+        """
+
+        date_id = to_date_id(run_date)
+
+        self.cursor.execute("SELECT max(date_id) FROM fact_snapshot WHERE date_id < %s", (date_id,))
+        prev_date_id = self.cursor.fetchone()[0]
+
+        if prev_date_id is None:
+            logging.info("Need at least 2 snapshots before trends can be computed")
+            return
+
+        params = {'date_id': date_id, 'prev_date_id': prev_date_id}
+
+        track_trend_insert = """
+            INSERT INTO track_trend (date_id, track_id, track_popularity, popularity_delta, playlist_count,
+                                     playlist_add_velocity, label_zscore, trend_score, trend_rank)
+            WITH track_pop AS (
+                -- dense snapshots, whether they were stored in full or change-only mode
+                SELECT track_id, %(date_id)s AS date_id, track_popularity FROM track_metrics_asof(%(date_id)s)
+                UNION ALL
+                SELECT track_id, %(prev_date_id)s, track_popularity FROM track_metrics_asof(%(prev_date_id)s)
+            ),
+            placements AS (
+                SELECT track_id, date_id, count(*) AS playlist_count
+                FROM track_playlist_fact
+                WHERE date_id IN (%(date_id)s, %(prev_date_id)s)
+                GROUP BY track_id, date_id
+            ),
+            changes AS (
+                SELECT
+                    cur.track_id,
+                    td.label_id,
+                    cur.track_popularity,
+                    cur.track_popularity - prev.track_popularity AS popularity_delta,
+                    coalesce(cur_pl.playlist_count, 0) AS playlist_count,
+                    coalesce(cur_pl.playlist_count, 0) - coalesce(prev_pl.playlist_count, 0) AS playlist_add_velocity
+                FROM track_pop cur
+                JOIN track_dim td ON td.track_id = cur.track_id
+                LEFT JOIN track_pop prev ON prev.track_id = cur.track_id AND prev.date_id = %(prev_date_id)s
+                LEFT JOIN placements cur_pl ON cur_pl.track_id = cur.track_id AND cur_pl.date_id = %(date_id)s
+                LEFT JOIN placements prev_pl ON prev_pl.track_id = cur.track_id AND prev_pl.date_id = %(prev_date_id)s
+                WHERE cur.date_id = %(date_id)s
+            ),
+            scored AS (
+                SELECT
+                    *,
+                    (popularity_delta - avg(popularity_delta) OVER (PARTITION BY label_id))
+                        / nullif(stddev_samp(popularity_delta) OVER (PARTITION BY label_id), 0) AS label_zscore,
+                    coalesce((popularity_delta - avg(popularity_delta) OVER ())
+                        / nullif(stddev_samp(popularity_delta) OVER (), 0), 0)
+                    + coalesce((playlist_add_velocity - avg(playlist_add_velocity) OVER ())
+                        / nullif(stddev_samp(playlist_add_velocity) OVER (), 0), 0) AS market_score
+                FROM changes
+            ),
+            combined AS (
+                -- a track outgrowing the rest of its label's catalog scores higher
+                SELECT *, market_score + coalesce(label_zscore, 0) AS trend_score
+                FROM scored
+            )
+            SELECT %(date_id)s, track_id, track_popularity, popularity_delta, playlist_count, playlist_add_velocity,
+                   round(label_zscore, 3), round(trend_score, 3), rank() OVER (ORDER BY trend_score DESC)
+            FROM combined
+        """
+
+        artist_trend_insert = """
+            INSERT INTO artist_trend (date_id, artist_id, artist_popularity, popularity_delta, artist_followers,
+                                      follower_growth_rate, playlist_count, playlist_add_velocity, trend_score,
+                                      trend_rank)
+            WITH artist_pop AS (
+                SELECT artist_id, %(date_id)s AS date_id, artist_popularity, artist_followers
+                FROM artist_metrics_asof(%(date_id)s)
+                UNION ALL
+                SELECT artist_id, %(prev_date_id)s, artist_popularity, artist_followers
+                FROM artist_metrics_asof(%(prev_date_id)s)
+            ),
+            placements AS (
+                SELECT tab.artist_id, tpf.date_id, count(DISTINCT tpf.playlist_id) AS playlist_count
+                FROM track_playlist_fact tpf
+                JOIN track_artist_bridge tab ON tab.track_id = tpf.track_id
+                WHERE tpf.date_id IN (%(date_id)s, %(prev_date_id)s)
+                GROUP BY tab.artist_id, tpf.date_id
+            ),
+            changes AS (
+                SELECT
+                    cur.artist_id,
+                    cur.artist_popularity,
+                    cur.artist_popularity - prev.artist_popularity AS popularity_delta,
+                    cur.artist_followers,
+                    (cur.artist_followers - prev.artist_followers)::numeric
+                        / nullif(prev.artist_followers, 0) AS follower_growth_rate,
+                    coalesce(cur_pl.playlist_count, 0) AS playlist_count,
+                    coalesce(cur_pl.playlist_count, 0) - coalesce(prev_pl.playlist_count, 0) AS playlist_add_velocity
+                FROM artist_pop cur
+                LEFT JOIN artist_pop prev ON prev.artist_id = cur.artist_id AND prev.date_id = %(prev_date_id)s
+                LEFT JOIN placements cur_pl ON cur_pl.artist_id = cur.artist_id AND cur_pl.date_id = %(date_id)s
+                LEFT JOIN placements prev_pl ON prev_pl.artist_id = cur.artist_id AND prev_pl.date_id = %(prev_date_id)s
+                WHERE cur.date_id = %(date_id)s
+            ),
+            scored AS (
+                SELECT
+                    *,
+                    coalesce((popularity_delta - avg(popularity_delta) OVER ())
+                        / nullif(stddev_samp(popularity_delta) OVER (), 0), 0)
+                    + coalesce((follower_growth_rate - avg(follower_growth_rate) OVER ())
+                        / nullif(stddev_samp(follower_growth_rate) OVER (), 0), 0)
+                    + coalesce((playlist_add_velocity - avg(playlist_add_velocity) OVER ())
+                        / nullif(stddev_samp(playlist_add_velocity) OVER (), 0), 0) AS trend_score
+                FROM changes
+            )
+            SELECT %(date_id)s, artist_id, artist_popularity, popularity_delta, artist_followers,
+                   round(follower_growth_rate, 5), playlist_count, playlist_add_velocity, round(trend_score, 3),
+                   rank() OVER (ORDER BY trend_score DESC)
+            FROM scored
+        """
+
+        try:
+            # replace any scores from an earlier attempt at the same snapshot
+            self.cursor.execute("DELETE FROM track_trend WHERE date_id = %s", (date_id,))
+            self.cursor.execute("DELETE FROM artist_trend WHERE date_id = %s", (date_id,))
+            self.cursor.execute(track_trend_insert, params)
+            self.metrics.increment("rows_inserted_total", self.cursor.rowcount, table="track_trend")
+            self.cursor.execute(artist_trend_insert, params)
+            self.metrics.increment("rows_inserted_total", self.cursor.rowcount, table="artist_trend")
+            self.connection.commit()
+            self.bump_data_version()
+            logging.info(f"Computed track + artist trends for {date_id} (compared with {prev_date_id})")
+        except Exception:
+            self.connection.rollback()
+            logging.exception("Trends NOT computed")
+
+    @timed_stage("export_fact_archive")
+    def export_fact_archive(self, archive_dir=None):
+
+        """
+        Appends every snapshot that isn't in the Parquet archive yet (see 'fact_archive'). The latest snapshot is always
+        rewritten, since backfills of newly tracked playlists can add rows to it after the weekly load.
+
+        :param archive_dir: root folder of the archive (defaults to FACT_ARCHIVE_DIR)
+        """
+
+        self.cursor.execute("SELECT date_id FROM fact_snapshot ORDER BY date_id")
+        dw_date_ids = [row[0] for row in self.cursor.fetchall()]
+        if not dw_date_ids:
+            return
+
+        for table_name, export_query in EXPORT_QUERIES.items():
+
+            archived = archived_date_ids(table_name, archive_dir)
+            to_export = [date_id for date_id in dw_date_ids if date_id not in archived]
+            if dw_date_ids[-1] not in to_export:
+                to_export.append(dw_date_ids[-1])
+
+            for date_id in to_export:
+                snapshot_df = self.hook.get_pandas_df(export_query, parameters={'date_id': date_id})
+                write_snapshot(snapshot_df, table_name, date_id, archive_dir)
+                self.metrics.increment("rows_archived_total", len(snapshot_df), table=table_name)
+
+            logging.info(f"Archived {len(to_export)} snapshot(s) of '{table_name}'")
+
+    def delete_in_batches(self, table, where_clause, params, batch_size):
+
+        """
+        Deletes the rows matching a condition a batch at a time, committing after each batch so locks are short-lived
+        and the WAL / dead tuples produced by a single transaction stay bounded
+
+        :param table: table to delete from
+        :param where_clause: condition selecting the rows to delete
+        :param params: parameters of the condition
+        :param batch_size: max number of rows deleted per transaction
+        :return: total number of rows deleted
+        """
+
+        batch_delete = f"""DELETE FROM {table}
+                            WHERE ctid IN (SELECT ctid FROM {table} WHERE {where_clause} LIMIT %(batch_size)s)
+                        """
+        total_deleted = 0
+
+        while True:
+            self.cursor.execute(batch_delete, {**params, 'batch_size': batch_size})
+            deleted = self.cursor.rowcount
+            self.connection.commit()
+            total_deleted += deleted
+            if deleted < batch_size:
+                break
+
+        self.metrics.increment("rows_deleted_total", total_deleted, table=table)
+
+        return total_deleted
+
+    @timed_stage("apply_retention")
+    def apply_retention(self, run_date, full_resolution_weeks=None, inactive_weeks=None, batch_size=None):
+
+        """
+        Keeps the fact tables bounded. Snapshots from whole months that fall outside the full resolution window are
+        rolled up into the '*_monthly' tables and then deleted in batches, movements +
+        trends older than the window are dropped, and tracks / artists that haven't been on a tracked playlist for a
+        while are archived so 'organize_facts' stops refreshing them. Defaults come from the RETENTION_* env variables.
+
+        :param run_date: logical date of the run => the windows are counted back from this date
+        :param full_resolution_weeks: number of weeks of weekly snapshots to keep
+        :param inactive_weeks: tracks that have been off every tracked playlist for this many weeks are archived
+        :param batch_size: max number of rows deleted per transaction
+        """
+
+        full_resolution_weeks = full_resolution_weeks or int(os.getenv('RETENTION_FULL_RESOLUTION_WEEKS', 52))
+        inactive_weeks = inactive_weeks or int(os.getenv('RETENTION_INACTIVE_WEEKS', 26))
+        batch_size = batch_size or int(os.getenv('RETENTION_DELETE_BATCH_SIZE', 10000))
+
+        # only whole months are rolled up => each month's rollup is built once, from all of its snapshots
+        self.cursor.execute("""SELECT to_char(date_trunc('month', %(run_date)s::date - %(full)s * interval '1 week'),
+                                              'YYYYMMDD'),
+                                      to_char(%(run_date)s::date - %(inactive)s * interval '1 week', 'YYYYMMDD')""",
+                            {'run_date': run_date, 'full': full_resolution_weeks, 'inactive': inactive_weeks})
+        cutoff_date_id, inactive_since_date_id = self.cursor.fetchone()
+
+        self.cursor.execute("""SELECT DISTINCT date_trunc('month', dd.date)::date
+                                FROM fact_snapshot fs
+                                JOIN date_dim dd ON dd.date_id = fs.date_id
+                                WHERE fs.date_id < %s
+                                ORDER BY 1
+                            """, (cutoff_date_id,))
+        months = [row[0] for row in self.cursor.fetchall()]
+
+        track_metrics_rollup = """
+            INSERT INTO track_metrics_monthly (track_id, month, snapshot_count, avg_track_popularity,
+                                               max_track_popularity)
+            SELECT track_id, %(month)s, count(*), round(avg(track_popularity)), max(track_popularity)
+            FROM track_metrics_fact
+            WHERE date_id >= %(month_start)s AND date_id < %(month_end)s
+            GROUP BY track_id
+            ON CONFLICT DO NOTHING  -- already rolled up by an earlier run that stopped while deleting
+        """
+
+        artist_metrics_rollup = """
+            INSERT INTO artist_metrics_monthly (artist_id, month, snapshot_count, avg_artist_popularity,
+                                                max_artist_followers)
+            SELECT artist_id, %(month)s, count(*), round(avg(artist_popularity)), max(artist_followers)
+            FROM artist_metrics_fact
+            WHERE date_id >= %(month_start)s AND date_id < %(month_end)s
+            GROUP BY artist_id
+            ON CONFLICT DO NOTHING
+        """
+
+        track_playlist_rollup = """
+            INSERT INTO track_playlist_monthly (track_id, playlist_id, month, snapshot_count, best_position,
+                                                avg_position, avg_track_popularity)
+            SELECT track_id, playlist_id, %(month)s, count(*), min(track_playlist_position),
+                   round(avg(track_playlist_position)), round(avg(track_popularity))
+            FROM track_playlist_fact
+            WHERE date_id >= %(month_start)s AND date_id < %(month_end)s
+            GROUP BY track_id, playlist_id
+            ON CONFLICT DO NOTHING
+        """
+
+        for month in months:
+
+            next_month = (month.replace(day=28) + datetime.timedelta(days=4)).replace(day=1)
+            params = {'month': month,
+                      'month_start': month.strftime("%Y%m%d"),
+                      'month_end': next_month.strftime("%Y%m%d")}
+
+            self.cursor.execute(track_metrics_rollup, params)
+            self.cursor.execute(artist_metrics_rollup, params)
+            self.cursor.execute(track_playlist_rollup, params)
+            self.connection.commit()
+
+            month_condition = "date_id >= %(month_start)s AND date_id < %(month_end)s"
+            for table in FACT_TABLES:
+                self.delete_in_batches(table, month_condition, params, batch_size)
+            self.cursor.execute(f"DELETE FROM fact_snapshot WHERE {month_condition}", params)
+            self.connection.commit()
+            logging.info(f"Rolled up + deleted the snapshots from {month:%B %Y}")
+
+        for table in ("playlist_movement_fact", "track_trend", "artist_trend"):
+            self.delete_in_batches(table, "date_id < %(cutoff)s", {'cutoff': cutoff_date_id}, batch_size)
+
+        # archive tracks that haven't been on a tracked playlist recently + artists without any active tracks
+        self.cursor.execute("""UPDATE track_dim td SET archived_at = now()
+                                WHERE archived_at IS NULL
+                                  AND NOT EXISTS (SELECT 1 FROM track_playlist_fact tpf
+                                                  WHERE tpf.track_id = td.track_id AND tpf.date_id >= %s)
+                            """, (inactive_since_date_id,))
+        self.metrics.increment("entities_archived_total", self.cursor.rowcount, table="track_dim")
+        self.cursor.execute("""UPDATE artist_dim SET archived_at = now()
+                                WHERE archived_at IS NULL
+                                  AND artist_id NOT IN (SELECT DISTINCT tab.artist_id
+                                                        FROM track_artist_bridge tab
+                                                        JOIN track_dim td ON td.track_id = tab.track_id
+                                                        WHERE td.archived_at IS NULL)
+                            """)
+        self.metrics.increment("entities_archived_total", self.cursor.rowcount, table="artist_dim")
+        self.connection.commit()
+        self.bump_data_version()
+
+        # make the deleted rows' space reusable + refresh the planner's statistics, then record the tables' sizes
+        for table in FACT_TABLES:
+            self.hook.run(f"VACUUM ANALYZE {table}", autocommit=True)
+            self.cursor.execute("SELECT pg_table_size(%s), pg_indexes_size(%s)", (table, table))
+            table_bytes, index_bytes = self.cursor.fetchone()
+            self.metrics.set_gauge("table_bytes", table_bytes, table=table)
+            self.metrics.set_gauge("index_bytes", index_bytes, table=table)
+            logging.info(f"'{table}' is now {table_bytes / 2 ** 20:.1f} MB "
+                         f"(+ {index_bytes / 2 ** 20:.1f} MB of indexes)")
+
+    def claim_backfill_job(self, timeout_minutes=None):
+
+        """
+        Claims the oldest pending backfill job. Rows locked by another worker are skipped. A job that has been running
+        for longer than 'timeout_minutes' is claimed again => its worker died before it could mark the job done/failed.
+
+        :param timeout_minutes: age of a running job before it's reclaimed (defaults to BACKFILL_JOB_TIMEOUT_MINUTES)
+        :return: (job id, playlist spotify id) tuple, or None if the queue is empty
+        """
+
+        timeout_minutes = timeout_minutes or int(os.getenv('BACKFILL_JOB_TIMEOUT_MINUTES', 60))
+
+        claim_query = """UPDATE playlist_backfill_job bj
+                            SET status = 'running', started_at = now(), progress = 'claimed', error_message = NULL
+                            FROM (
+                                SELECT job_id, status
+                                FROM playlist_backfill_job
+                                WHERE status = 'pending'
+                                   OR (status = 'running' AND started_at < now() - make_interval(mins => %s))
+                                ORDER BY requested_at
+                                LIMIT 1
+                                FOR UPDATE SKIP LOCKED
+                            ) claimed
+                            WHERE bj.job_id = claimed.job_id
+                            RETURNING bj.job_id, bj.playlist_id, claimed.status
+                        """
+        self.cursor.execute(claim_query, (timeout_minutes,))
+        job = self.cursor.fetchone()
+        self.connection.commit()
+
+        if job is None:
+            return None
+
+        if job[2] == 'running':
+            self.metrics.increment("backfill_jobs_reclaimed_total")
+            logging.warning(f"Reclaimed backfill job {job[0]} after it ran for more than {timeout_minutes} minutes")
+
+        self.cursor.execute("SELECT playlist_spotify_id FROM playlist_dim WHERE playlist_id = %s", (job[1],))
+        playlist_spotify_id = self.cursor.fetchone()[0]
+
+        return job[0], playlist_spotify_id
+
+    def update_backfill_job(self, job_id, progress, status="running", error_message=None):
+
+        """
+        Records the progress of a backfill job so it can be reported back to the web app
+
+        :param job_id: ID of the backfill job being processed
+        :param progress: short description of the stage the job is currently in
+        :param status: 'running', 'done', 'skipped' or 'failed'
+        :param error_message: the error that caused the job to fail (if any)
+        """
+
+        update_query = """UPDATE playlist_backfill_job
+                            SET progress = %s,
+                                status = %s,
+                                error_message = %s,
+                                finished_at = CASE WHEN %s IN ('done', 'skipped', 'failed') THEN now() END
+                            WHERE job_id = %s
+                        """
+        self.cursor.execute(update_query, (progress, status, error_message, status, job_id))
+        self.connection.commit()
+
+    def latest_snapshot_date(self):
+
+        """
+        :return: run date ('YYYY-MM-DD') of the latest snapshot loaded by the weekly ETL, or None before the first one
+        """
+
+        self.cursor.execute("""SELECT max(dd.date) FROM fact_snapshot fs JOIN date_dim dd ON dd.date_id = fs.date_id""")
+        latest_date = self.cursor.fetchone()[0]
+        self.connection.commit()
+
+        return latest_date.isoformat() if latest_date else None
+
+    def backfill_playlist(self, job_id, playlist_spotify_id):
+
+        """
+        Runs the extraction and loading steps for a single, newly tracked playlist. Only the playlist's own tracks and
+        artists are refreshed. The facts are added to the latest weekly snapshot rather than stored as a snapshot of
+        their own, so trends, label shares, the archive and retention keep working with full weekly snapshots. Before
+        the first weekly load there's no snapshot to add them to => the job is skipped and the weekly run loads them.
+
+        :param job_id: ID of the backfill job being processed
+        :param playlist_spotify_id: unique Spotify playlist ID
+        """
+
+        run_date = self.latest_snapshot_date()
+        if run_date is None:
+            self.update_backfill_job(job_id, "waiting for the first weekly load", status="skipped")
+            self.metrics.increment("backfill_jobs_total", status="skipped")
+            logging.info(f"No weekly snapshot to add playlist with ID = {playlist_spotify_id} to yet")
+            return
+
+        try:
+            self.update_backfill_job(job_id, "extracting playlist data")
+            track_data, artist_data, track_artist_data, track_playlist_data = \
+                self.extract_playlists_data([playlist_spotify_id], run_date)
+
+            self.update_backfill_job(job_id, "updating dimensions")
+            self.update_dimensions(track_data, artist_data, run_date)
+
+            self.update_backfill_job(job_id, "collecting performance metrics")
+            fact_data = self.organize_facts(track_artist_data, track_playlist_data, run_date, refresh_existing=False)
+
+            self.update_backfill_job(job_id, "loading fact tables")
+            self.update_fact_tables(*fact_data)
+            self.refresh_search_index()  # the playlist's tracks can be searched right away
+            self.update_label_share(run_date)  # recompute the latest week's label shares with the playlist included
+
+            self.update_backfill_job(job_id, f"loaded {len(fact_data[3])} tracks", status="done")
+            self.metrics.increment("backfill_jobs_total", status="done")
+            logging.info(f"Finished backfilling playlist with ID = {playlist_spotify_id}")
+        except Exception as e:
+            self.connection.rollback()
+            self.update_backfill_job(job_id, "failed", status="failed", error_message=str(e))
+            self.metrics.increment("backfill_jobs_total", status="failed")
+            logging.exception(f"Backfill failed for playlist with ID = {playlist_spotify_id}")
+
+    def replay_date(self, run_date, archive_dir=None):
+
+        """
+        Rebuilds the dimensions and fact snapshot of a past run from its archived raw API responses, without calling
+        Spotify. The snapshot's existing fact rows are replaced. Movements / trends are not recomputed here since they
+        depend on the previous snapshot => run 'update_playlist_movements' and 'compute_trends' in date order after
+        every date has been replayed, along with 'update_label_share'.
+
+        :param run_date: run date to replay ('YYYY-MM-DD')
+        :param archive_dir: root folder of the raw archive (defaults to RAW_ARCHIVE_DIR)
+        """
+
+        archive = RawResponseArchive(run_date, root_dir=archive_dir)
+        playlist_list = archive.playlist_ids()
+        if not playlist_list:
+            raise ValueError(f"No archived API responses for {run_date}")
+
+        live_api = self.spot_api
+        self.spot_api = ArchivedSpotifyAPI(archive, metrics=self.metrics)
+
+        try:
+            track_data, artist_data, track_artist_data, track_playlist_data = \
+                self.extract_playlists_data(playlist_list, run_date)
+            self.update_dimensions(track_data, artist_data, run_date)
+            fact_data = self.organize_facts(track_artist_data, track_playlist_data, run_date)
+
+            date_id = to_date_id(run_date)
+            for table in FACT_TABLES:
+                self.cursor.execute(f"DELETE FROM {table} WHERE date_id = %s", (date_id,))
+            self.connection.commit()
+
+            self.update_fact_tables(*fact_data)
+        finally:
+            self.spot_api = live_api
+
+        logging.info(f"Replayed {len(playlist_list)} playlists for {run_date} from the raw archive")
+
+    def save_metrics(self, context):
+
+        """
+        Stores the metrics collected during a task run in 'etl_run_metric' and, when ETL_METRICS_TEXTFILE_DIR is set,
+        in a Prometheus textfile ('<dag id>__<task id>.prom') that node_exporter can pick up. Meant to be used as an
+        Airflow 'on_success_callback' / 'on_failure_callback', so metrics are kept for failed runs too.
+
+        :param context: Airflow task context
+        """
+
+        run_id = context['run_id']
+        dag_id = context['dag'].dag_id
+        task_id = context['task_instance'].task_id
+
+        metric_rows = [(run_id, dag_id, task_id, name, metric_type, labels, value)
+                       for name, metric_type, labels, value in self.metrics.summarize()]
+
+        try:
+            # uses a new connection => works even if the task left 'self.connection' in an aborted transaction
+            self.hook.insert_rows("etl_run_metric", metric_rows,
+                                  target_fields=["run_id", "dag_id", "task_id", "metric_name", "metric_type",
+                                                 "labels", "metric_value"])
+
+            textfile_dir = os.getenv('ETL_METRICS_TEXTFILE_DIR')
+            if textfile_dir:
+                self.metrics.write_prometheus_textfile(os.path.join(textfile_dir, f"{dag_id}__{task_id}.prom"),
+                                                       dag_id=dag_id, task_id=task_id)
+
+            logging.info(f"Saved {len(metric_rows)} metrics for run {run_id}, task {task_id}")
+        except Exception:
+            logging.exception("Metrics NOT saved")  # never fail a task because its metrics couldn't be stored
 
+        self.metrics.reset()
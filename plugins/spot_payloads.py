@@ -0,0 +1,151 @@
+"""
+Decoding + normalisation of the Spotify API's JSON payloads into the rows stored in the data warehouse. Kept free of
+network / Airflow imports and made of module-level functions, so raw page bytes can be decoded and normalised in
+worker processes: with SPOTIFY_PARSE_PROCESSES > 1, 'PayloadParser' spreads a playlist's pages over a process pool.
+
+SPOTIFY_JSON_DECODER picks the JSON decoder ('orjson' when it's installed, otherwise the standard library's 'json').
+"""
+
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def get_decoder(name=None):
+
+    """
+    :param name: 'orjson' or 'json' (defaults to SPOTIFY_JSON_DECODER, then to the fastest one installed)
+    :return: function that decodes a JSON document (bytes or str)
+    """
+
+    name = name or os.getenv('SPOTIFY_JSON_DECODER', 'orjson' if orjson is not None else 'json')
+
+    if name == 'orjson' and orjson is not None:
+        return orjson.loads
+
+    return json.loads
+
+
+decode_json = get_decoder()
+
+
+def normalize_playlist_page(page, offset):
+
+    """
+    Organizes one page of playlist items in a single pass over its items (null tracks are skipped)
+
+    :param page: decoded page returned by the playlist items endpoint
+    :param offset: the offset the page was requested at => the tracks' playlist positions
+    :return: 4 lists => track rows, (artist id, artist name) rows, (track id, artist id) pairs + playlist positions
+    """
+
+    track_data = []
+    artist_data = []
+    track_artist_data = []
+    playlist_positions = []
+
+    for item in page['items']:
+
+        track = item['track']
+        if track is None:
+            continue
+
+        album = track['album']
+        release_date = album['release_date']
+        if len(release_date) == 4:
+            release_date += '-01-01'  # handle irregular date formats
+
+        track_data.append((track['id'], track['name'], track['duration_ms'], track['external_ids']['isrc'],
+                           track['track_number'], album['id'], album['name'], release_date, album['album_type'],
+                           album['total_tracks']))
+        playlist_positions.append(offset + len(playlist_positions) + 1)
+
+        for artist in track['artists']:
+            artist_data.append((artist['id'], artist['name']))
+            track_artist_data.append((track['id'], artist['id']))
+
+    return track_data, artist_data, track_artist_data, playlist_positions
+
+
+def parse_playlist_page(content, offset):
+
+    """
+    Decodes (if needed) + normalizes one page of playlist items => can run in a worker process
+
+    :param content: raw response body (bytes / str) or an already decoded page
+    :param offset: the offset the page was requested at
+    """
+
+    page = decode_json(content) if isinstance(content, (bytes, str)) else content
+
+    return normalize_playlist_page(page, offset)
+
+
+def normalize_albums(json_response):
+
+    """
+    :return: list of (UPC, label) tuples for the albums returned by the 'albums' endpoint
+    """
+
+    return [(album['external_ids']['upc'], album['label']) for album in json_response['albums']]
+
+
+def normalize_track_pop_scores(json_response):
+
+    """
+    :return: list of popularity scores for the tracks returned by the 'tracks' endpoint
+    """
+
+    return [track['popularity'] for track in json_response['tracks']]
+
+
+def normalize_artist_metrics(json_response):
+
+    """
+    :return: list of (popularity, followers) tuples for the artists returned by the 'artists' endpoint
+    """
+
+    return [(artist['popularity'], artist['followers']['total']) for artist in json_response['artists']]
+
+
+class PayloadParser:
+
+    """
+    Runs a parsing function over many payloads, in a process pool when more than one process is configured
+    """
+
+    def __init__(self, processes=None):
+
+        # number of worker processes (0 / 1 => parse in the calling process)
+        self.processes = int(os.getenv('SPOTIFY_PARSE_PROCESSES', 0)) if processes is None else processes
+        self.pool = None  # started on first use, reused afterwards
+
+    def map(self, function, *iterables):
+
+        """
+        :return: list of the function's results, in the order of the inputs
+        """
+
+        iterables = [list(iterable) for iterable in iterables]
+
+        if self.processes <= 1 or len(iterables[0]) <= 1:
+            return list(map(function, *iterables))
+
+        if self.pool is None:
+            self.pool = ProcessPoolExecutor(max_workers=self.processes)
+
+        # a few chunks per worker => fewer round trips between the processes
+        chunksize = max(1, len(iterables[0]) // (4 * self.processes))
+
+        return list(self.pool.map(function, *iterables, chunksize=chunksize))
+
+    def close(self):
+
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
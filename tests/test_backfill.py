@@ -0,0 +1,90 @@
+from unittest import mock
+
+from dw_test_case import WarehouseTestCase
+
+
+class BackfillJobTests(WarehouseTestCase):
+
+    def setUp(self):
+
+        super().setUp()
+        self.playlist_spotify_id = next(iter(self.catalog.playlists))
+        self.playlist_id = self.query("""INSERT INTO playlist_dim (playlist_spotify_id, playlist_name)
+                                         VALUES (%s, 'Playlist') RETURNING playlist_id""",
+                                      (self.playlist_spotify_id,))[0][0]
+
+    def add_job(self, status="pending", started_minutes_ago=None):
+
+        return self.query("""INSERT INTO playlist_backfill_job (playlist_id, status, started_at)
+                             VALUES (%s, %s, now() - make_interval(mins => %s)) RETURNING job_id""",
+                          (self.playlist_id, status, started_minutes_ago))[0][0]
+
+    def job_status(self, job_id):
+
+        return self.query("SELECT status, error_message FROM playlist_backfill_job WHERE job_id = %s", (job_id,))[0]
+
+    def test_pending_job_is_claimed(self):
+
+        job_id = self.add_job()
+
+        self.assertEqual(self.dw.claim_backfill_job(), (job_id, self.playlist_spotify_id))
+        self.assertEqual(self.job_status(job_id), ("running", None))
+        self.assertIsNone(self.dw.claim_backfill_job())
+
+    def test_recently_started_job_is_left_to_its_worker(self):
+
+        self.add_job("running", started_minutes_ago=5)
+
+        self.assertIsNone(self.dw.claim_backfill_job(timeout_minutes=60))
+
+    def test_job_of_a_dead_worker_is_reclaimed(self):
+
+        job_id = self.add_job("running", started_minutes_ago=90)
+
+        self.assertEqual(self.dw.claim_backfill_job(timeout_minutes=60), (job_id, self.playlist_spotify_id))
+        self.assertEqual(self.dw.metrics.counters[("backfill_jobs_reclaimed_total", ())], 1)
+        self.assertEqual(self.query("SELECT started_at > now() - interval '1 minute' FROM playlist_backfill_job"),
+                         [(True,)])
+
+    def add_weekly_snapshot(self, date_id="20240903"):
+
+        self.execute("INSERT INTO fact_snapshot (date_id) VALUES (%s)", (date_id,))
+
+    def test_failed_fact_load_fails_the_job(self):
+
+        self.add_weekly_snapshot()
+        job_id = self.add_job()
+        self.dw.claim_backfill_job()
+        bad_facts = ([], [], [], [(-1, self.playlist_id, "20240903", 1, 50)])  # unknown track => foreign key error
+
+        with mock.patch.object(self.dw, "organize_facts", return_value=bad_facts):
+            self.dw.backfill_playlist(job_id, self.playlist_spotify_id)
+
+        status, error_message = self.job_status(job_id)
+        self.assertEqual(status, "failed")
+        self.assertIn("track_playlist_fact", error_message)
+
+    def test_backfill_is_added_to_the_latest_weekly_snapshot(self):
+
+        self.add_weekly_snapshot("20240827")
+        self.add_weekly_snapshot("20240903")
+        job_id = self.add_job()
+        self.dw.claim_backfill_job()
+
+        self.dw.backfill_playlist(job_id, self.playlist_spotify_id)
+
+        self.assertEqual(self.job_status(job_id), ("done", None))
+        self.assertEqual(self.query("SELECT DISTINCT date_id FROM track_playlist_fact WHERE playlist_id = %s",
+                                    (self.playlist_id,)), [("20240903",)])
+        self.assertEqual(self.query("SELECT date_id FROM fact_snapshot ORDER BY date_id"),
+                         [("20240827",), ("20240903",)])  # no snapshot of its own
+
+    def test_backfill_before_the_first_weekly_load_is_skipped(self):
+
+        job_id = self.add_job()
+        self.dw.claim_backfill_job()
+
+        self.dw.backfill_playlist(job_id, self.playlist_spotify_id)
+
+        self.assertEqual(self.job_status(job_id), ("skipped", None))
+        self.assertEqual(self.query("SELECT count(*) FROM track_playlist_fact"), [(0,)])
@@ -0,0 +1,38 @@
+from dw_test_case import WarehouseTestCase
+
+
+class DataVersionTests(WarehouseTestCase):
+
+    def version(self):
+
+        return self.query("SELECT version FROM dw_data_version")[0][0]
+
+    def assert_bumps(self, step, *args):
+
+        version = self.version()
+        step(*args)
+        self.assertGreater(self.version(), version, step.__name__)
+
+    def test_every_write_step_bumps_the_version(self):
+
+        (track_id,), artist_id = self.add_tracks(["A"])
+        playlist_id = self.add_playlists(1)[0]
+        self.dw.update_fact_tables([(track_id, "20240903", 50)], [(artist_id, "20240903", 50, 100)], [],
+                                   [(track_id, playlist_id, "20240903", 1, 50)], change_only=False)
+        facts = ([(track_id, "20240910", 60)], [(artist_id, "20240910", 50, 200)], [],
+                 [(track_id, playlist_id, "20240910", 2, 60)])
+
+        self.assert_bumps(self.dw.update_dimensions, [], [], self.run_date)
+        self.assert_bumps(self.dw.update_fact_tables, *facts)
+        self.assert_bumps(self.dw.refresh_search_index)
+        self.assert_bumps(self.dw.update_playlist_movements, self.run_date)
+        self.assert_bumps(self.dw.update_label_share, self.run_date)
+        self.assert_bumps(self.dw.compute_trends, self.run_date)
+        self.assert_bumps(self.dw.apply_retention, self.run_date)
+
+    def test_recreating_the_tables_keeps_the_version(self):
+
+        self.dw.bump_data_version()
+        self.dw.create_tables()
+
+        self.assertEqual(self.query("SELECT version FROM dw_data_version"), [(1,)])
@@ -0,0 +1,35 @@
+import datetime
+
+from dw_test_case import WarehouseTestCase
+
+
+class PopulateDateDimTests(WarehouseTestCase):
+
+    def test_every_day_of_the_year_is_added(self):
+
+        # setUp populated 2024 => a leap year, September included
+        self.assertEqual(self.query("SELECT count(*), min(date), max(date) FROM date_dim")[0],
+                         (366, datetime.date(2024, 1, 1), datetime.date(2024, 12, 31)))
+
+    def test_september_dates_fit_their_description(self):
+
+        self.assertEqual(self.query("SELECT date_description, calendar_month_name, day_of_week FROM date_dim "
+                                    "WHERE date_id = '20240918'"),
+                         [("September 18, 2024", "September", "Wednesday")])
+
+    def test_populating_again_skips_existing_days(self):
+
+        self.dw.populate_date_dim(start_date="2024-09-01", end_date="2025-01-31")
+
+        self.assertEqual(self.dw.cursor.rowcount, 31)
+        self.assertEqual(self.query("SELECT count(*) FROM date_dim")[0][0], 366 + 31)
+
+    def test_existing_narrow_column_is_widened(self):
+
+        self.execute("DELETE FROM date_dim")
+        self.execute("ALTER TABLE date_dim ALTER COLUMN date_description TYPE varchar(17)")
+
+        self.dw.create_tables()
+        self.dw.populate_date_dim(start_date="2024-09-01", end_date="2024-09-30")
+
+        self.assertEqual(self.query("SELECT count(*) FROM date_dim")[0][0], 30)
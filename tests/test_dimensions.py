@@ -0,0 +1,56 @@
+import datetime
+
+from dw_test_case import WarehouseTestCase, track_row
+
+
+class UpdateDimensionsTests(WarehouseTestCase):
+
+    track_id = "t" * 22
+    artist_id = "a" * 22
+
+    def track(self):
+
+        return self.query("SELECT track_name, label_name, updated_at::date FROM track_dim")
+
+    def label_history(self):
+
+        return self.query("""SELECT label_name, valid_from::date, valid_to::date
+                             FROM track_label_history ORDER BY valid_from""")
+
+    def test_unchanged_rows_are_skipped(self):
+
+        self.dw.update_dimensions([track_row(self.track_id)], [(self.artist_id, "Artist")], "2024-09-03")
+        self.dw.update_dimensions([track_row(self.track_id)], [(self.artist_id, "Artist")], "2024-09-10")
+
+        self.assertEqual(self.track(), [("Track", "Label A", datetime.date(2024, 9, 3))])
+        self.assertEqual(self.dw.metrics.counters[("rows_unchanged_total", (("table", "track_dim"),))], 1)
+
+    def test_changed_rows_are_updated_and_relinked(self):
+
+        self.dw.update_dimensions([track_row(self.track_id)], [(self.artist_id, "Artist")], "2024-09-03")
+        self.dw.update_dimensions([track_row(self.track_id, "Track (Remastered)", "Label B")],
+                                  [(self.artist_id, "Renamed Artist")], "2024-09-10")
+
+        self.assertEqual(self.track(), [("Track (Remastered)", "Label B", datetime.date(2024, 9, 10))])
+        self.assertEqual(self.query("SELECT artist_name FROM artist_dim"), [("Renamed Artist",)])
+        self.assertEqual(self.query("""SELECT ld.label_name FROM track_dim td
+                                       JOIN label_dim ld ON ld.label_id = td.label_id"""), [("Label B",)])
+
+    def test_label_history_is_stamped_with_the_run_dates(self):
+
+        self.dw.update_dimensions([track_row(self.track_id)], [], "2024-09-03")
+        self.dw.update_dimensions([track_row(self.track_id, label="Label B")], [], "2024-09-10")
+
+        self.assertEqual(self.label_history(), [("Label A", datetime.date(2024, 9, 3), datetime.date(2024, 9, 10)),
+                                                ("Label B", datetime.date(2024, 9, 10), None)])
+
+    def test_replayed_payloads_dont_revert_newer_rows(self):
+
+        self.dw.update_dimensions([track_row(self.track_id, label="Label B")], [(self.artist_id, "New Name")],
+                                  "2024-09-10")
+        self.dw.update_dimensions([track_row(self.track_id, "Old Title", "Label A")], [(self.artist_id, "Old Name")],
+                                  "2024-08-06")  # e.g. 'replay_date' for an older week
+
+        self.assertEqual(self.track(), [("Track", "Label B", datetime.date(2024, 9, 10))])
+        self.assertEqual(self.query("SELECT artist_name FROM artist_dim"), [("New Name",)])
+        self.assertEqual(self.label_history(), [("Label B", datetime.date(2024, 9, 10), None)])
@@ -0,0 +1,58 @@
+from dw_test_case import WarehouseTestCase
+
+
+class ChangeOnlyStorageTests(WarehouseTestCase):
+
+    def setUp(self):
+
+        super().setUp()
+        self.track_ids, self.artist_id = self.add_tracks(["A", "B"])
+
+    def load_metrics(self, date_id, popularities, heartbeat_weeks=4):
+
+        self.dw.update_fact_tables([(track_id, date_id, pop) for track_id, pop in zip(self.track_ids, popularities)],
+                                   [(self.artist_id, date_id, 50, 1000)], [], [],
+                                   change_only=True, heartbeat_weeks=heartbeat_weeks)
+
+    def stored_rows(self):
+
+        return self.query("""SELECT track_id, date_id, track_popularity FROM track_metrics_fact
+                             ORDER BY date_id, track_id""")
+
+    def test_only_changed_metrics_are_stored(self):
+
+        self.load_metrics("20240903", [50, 60])
+        self.load_metrics("20240910", [50, 65])
+
+        first, second = self.track_ids
+        self.assertEqual(self.stored_rows(), [(first, "20240903", 50), (second, "20240903", 60),
+                                              (second, "20240910", 65)])
+        self.assertEqual(self.query("SELECT count(*) FROM artist_metrics_fact"), [(1,)])
+        self.assertEqual(self.dw.metrics.counters[("rows_unchanged_total", (("table", "track_metrics_fact"),))], 1)
+
+    def test_asof_carries_unchanged_values_forward(self):
+
+        self.load_metrics("20240903", [50, 60])
+        self.load_metrics("20240910", [50, 65])
+
+        first, second = self.track_ids
+        self.assertEqual(self.query("SELECT * FROM track_metrics_asof('20240910') ORDER BY track_id"),
+                         [(first, 50), (second, 65)])
+        self.assertEqual(self.query("SELECT * FROM artist_metrics_asof('20240910')"), [(self.artist_id, 50, 1000)])
+
+    def test_unchanged_metrics_are_rewritten_after_the_heartbeat(self):
+
+        self.load_metrics("20240903", [50, 60], heartbeat_weeks=2)
+        self.load_metrics("20240917", [50, 60], heartbeat_weeks=2)  # 2 weeks later => the latest rows are too old
+
+        self.assertEqual(len(self.stored_rows()), 4)
+        self.assertEqual(self.query("SELECT count(*) FROM track_metrics_asof('20240917')"), [(2,)])
+
+    def test_full_mode_stores_every_row(self):
+
+        for date_id in ("20240903", "20240910"):
+            self.dw.update_fact_tables([(track_id, date_id, 50) for track_id in self.track_ids], [], [], [],
+                                       change_only=False)
+
+        self.assertEqual(len(self.stored_rows()), 4)
+        self.assertEqual(self.query("SELECT heartbeat_weeks FROM fact_snapshot ORDER BY date_id"), [(0,), (0,)])
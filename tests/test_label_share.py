@@ -0,0 +1,81 @@
+from decimal import Decimal
+from unittest import mock
+
+from dw_test_case import WarehouseTestCase
+
+
+class LabelShareTests(WarehouseTestCase):
+
+    def setUp(self):
+
+        super().setUp()
+        self.track_ids, _ = self.add_tracks(["A", "A", "B"])
+        self.first_playlist, self.second_playlist = self.add_playlists(2)
+        self.labels = dict(self.query("SELECT label_name, label_id FROM label_dim"))
+
+    def load_placements(self, date_id, placements):
+
+        self.dw.update_fact_tables([], [], [], [(self.track_ids[track], playlist_id, date_id, position, 50)
+                                                for track, playlist_id, position in placements],
+                                   change_only=False)
+
+    def rollup(self, grouping_level):
+
+        return self.query("""SELECT label_id, playlist_id, placements, track_count, avg_position, placement_share
+                             FROM label_share_weekly
+                             WHERE grouping_level = %s
+                             ORDER BY label_id NULLS LAST, playlist_id NULLS LAST""", (grouping_level,))
+
+    def test_every_cube_level_is_stored(self):
+
+        # 1st playlist: 2 label A tracks + 1 label B track, 2nd playlist: 1 label A track
+        self.load_placements("20240910", [(0, self.first_playlist, 1), (1, self.first_playlist, 2),
+                                          (2, self.first_playlist, 3), (0, self.second_playlist, 1)])
+
+        self.dw.update_label_share(self.run_date)
+
+        a, b = self.labels["A"], self.labels["B"]
+        self.assertEqual(self.rollup(0), [(a, self.first_playlist, 2, 2, Decimal("1.50"), Decimal("0.666667")),
+                                          (a, self.second_playlist, 1, 1, Decimal("1.00"), Decimal("1.000000")),
+                                          (b, self.first_playlist, 1, 1, Decimal("3.00"), Decimal("0.333333"))])
+        self.assertEqual(self.rollup(1), [(a, None, 3, 2, Decimal("1.33"), Decimal("0.750000")),
+                                          (b, None, 1, 1, Decimal("3.00"), Decimal("0.250000"))])
+        self.assertEqual(self.rollup(2), [(None, self.first_playlist, 3, 3, Decimal("2.00"), Decimal("0.750000")),
+                                          (None, self.second_playlist, 1, 1, Decimal("1.00"), Decimal("0.250000"))])
+        self.assertEqual(self.rollup(3), [(None, None, 4, 3, Decimal("1.75"), Decimal("1.000000"))])
+
+    def test_rerunning_a_snapshot_replaces_its_rows(self):
+
+        self.load_placements("20240910", [(0, self.first_playlist, 1)])
+        self.dw.update_label_share(self.run_date)
+        self.load_placements("20240910", [(2, self.first_playlist, 2)])  # e.g. a backfill after the weekly load
+
+        self.dw.update_label_share(self.run_date)
+
+        self.assertEqual(self.query("SELECT placements FROM label_share_weekly WHERE grouping_level = 3"), [(2,)])
+
+    def test_snapshots_without_a_rollup_are_caught_up(self):
+
+        self.load_placements("20240903", [(0, self.first_playlist, 1)])
+        self.load_placements("20240910", [(1, self.first_playlist, 1)])
+
+        self.dw.update_label_share(self.run_date)
+
+        self.assertEqual(self.query("""SELECT date_id FROM label_share_weekly WHERE grouping_level = 3
+                                       ORDER BY date_id"""), [("20240903",), ("20240910",)])
+
+    def test_backfill_recomputes_the_latest_week(self):
+
+        self.load_placements("20240910", [(0, self.first_playlist, 1)])
+        self.dw.update_label_share(self.run_date)
+        job_id = self.query("INSERT INTO playlist_backfill_job (playlist_id) VALUES (%s) RETURNING job_id",
+                            (self.second_playlist,))[0][0]
+        placement = (self.track_ids[2], self.second_playlist, "20240910", 1, 50)
+
+        with mock.patch.object(self.dw, "extract_playlists_data", return_value=([], [], [], [])), \
+                mock.patch.object(self.dw, "organize_facts", return_value=([], [], [], [placement])):
+            self.dw.backfill_playlist(job_id, "backfilled")
+
+        self.assertEqual(self.query("""SELECT date_id, placements FROM label_share_weekly WHERE grouping_level = 3"""),
+                         [("20240910", 2)])  # no week of its own
+        self.assertEqual([row[5] for row in self.rollup(1)], [Decimal("0.500000"), Decimal("0.500000")])
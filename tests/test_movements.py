@@ -0,0 +1,64 @@
+from dw_test_case import WarehouseTestCase
+
+
+class PlaylistMovementTests(WarehouseTestCase):
+
+    def setUp(self):
+
+        super().setUp()
+        self.track_ids, _ = self.add_tracks(["A", "A", "A", "A"])
+        self.playlist_id = self.add_playlists(1)[0]
+
+    def load_playlist(self, date_id, track_ids):
+
+        self.dw.update_fact_tables([], [], [], [(track_id, self.playlist_id, date_id, position, 50)
+                                                for position, track_id in enumerate(track_ids, 1)],
+                                   change_only=False)
+
+    def movements(self):
+
+        return self.query("""SELECT track_id, prev_date_id, movement_type, previous_position, current_position,
+                                    position_change
+                             FROM playlist_movement_fact ORDER BY track_id""")
+
+    def test_first_snapshot_has_no_movements(self):
+
+        self.load_playlist("20240903", self.track_ids[:3])
+
+        self.dw.update_playlist_movements("2024-09-03")
+
+        self.assertEqual(self.movements(), [])
+
+    def test_adds_drops_and_moves_are_stored(self):
+
+        a, b, c, d = self.track_ids
+        self.load_playlist("20240903", [a, b, c])
+        self.load_playlist("20240910", [b, a, d])
+
+        self.dw.update_playlist_movements(self.run_date)
+
+        self.assertEqual(self.movements(), [(a, "20240903", "move", 1, 2, -1),
+                                            (b, "20240903", "move", 2, 1, 1),
+                                            (c, "20240903", "drop", 3, None, None),
+                                            (d, "20240903", "add", None, 3, None)])
+
+    def test_unmoved_tracks_are_skipped_and_reruns_replace_rows(self):
+
+        a, b, c, _ = self.track_ids
+        self.load_playlist("20240903", [a, b, c])
+        self.load_playlist("20240910", [a, b, c])
+
+        self.dw.update_playlist_movements(self.run_date)
+        self.dw.update_playlist_movements(self.run_date)
+
+        self.assertEqual(self.movements(), [])
+
+    def test_compares_with_the_playlists_own_previous_snapshot(self):
+
+        a, b, _, _ = self.track_ids
+        self.load_playlist("20240820", [a])
+        self.load_playlist("20240910", [b, a])  # the playlist wasn't loaded on 20240827 / 20240903
+
+        self.dw.update_playlist_movements(self.run_date)
+
+        self.assertEqual(self.movements(), [(a, "20240820", "move", 1, 2, -1), (b, "20240820", "add", None, 1, None)])
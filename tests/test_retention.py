@@ -0,0 +1,65 @@
+import datetime
+
+from dw_test_case import WarehouseTestCase
+
+
+class ApplyRetentionTests(WarehouseTestCase):
+
+    def setUp(self):
+
+        super().setUp()
+        (self.old_track, self.active_track), self.artist_id = self.add_tracks(["A", "A"])
+        self.playlist_id = self.add_playlists(1)[0]
+
+        # 2 January snapshots of both tracks, then only the active track is still placed in September
+        for date_id, old_popularity, old_position in (("20240102", 40, 1), ("20240109", 50, 3)):
+            self.load_snapshot(date_id, [(self.old_track, old_popularity, old_position), (self.active_track, 60, 2)])
+        self.load_snapshot("20240903", [(self.active_track, 70, 1)])
+
+    def load_snapshot(self, date_id, placements):
+
+        self.dw.update_fact_tables([(track_id, date_id, popularity) for track_id, popularity, _ in placements],
+                                   [(self.artist_id, date_id, 50, 1000)], [],
+                                   [(track_id, self.playlist_id, date_id, position, popularity)
+                                    for track_id, popularity, position in placements],
+                                   change_only=False)
+
+    def apply_retention(self):
+
+        self.dw.apply_retention(self.run_date, full_resolution_weeks=8, inactive_weeks=26, batch_size=1)
+
+    def test_old_months_are_rolled_up(self):
+
+        self.apply_retention()
+
+        january = datetime.date(2024, 1, 1)
+        self.assertEqual(self.query("""SELECT track_id, month, snapshot_count, avg_track_popularity,
+                                              max_track_popularity
+                                       FROM track_metrics_monthly ORDER BY track_id"""),
+                         [(self.old_track, january, 2, 45, 50), (self.active_track, january, 2, 60, 60)])
+        self.assertEqual(self.query("""SELECT snapshot_count, best_position, avg_position FROM track_playlist_monthly
+                                       WHERE track_id = %s""", (self.old_track,)), [(2, 1, 2)])
+        self.assertEqual(self.query("SELECT month, snapshot_count FROM artist_metrics_monthly"), [(january, 2)])
+
+    def test_rolled_up_snapshots_are_deleted(self):
+
+        self.apply_retention()
+
+        for table in ("track_metrics_fact", "artist_metrics_fact", "track_playlist_fact", "fact_snapshot"):
+            self.assertEqual(self.query(f"SELECT DISTINCT date_id FROM {table}"), [("20240903",)], table)
+
+    def test_inactive_tracks_are_archived(self):
+
+        self.apply_retention()
+
+        self.assertEqual(self.query("SELECT track_id FROM track_dim WHERE archived_at IS NOT NULL"),
+                         [(self.old_track,)])
+        self.assertEqual(self.query("SELECT count(*) FROM artist_dim WHERE archived_at IS NOT NULL"), [(0,)])
+
+    def test_running_again_changes_nothing(self):
+
+        self.apply_retention()
+        self.apply_retention()
+
+        self.assertEqual(self.query("SELECT count(*) FROM track_metrics_monthly"), [(2,)])
+        self.assertEqual(self.query("SELECT count(*) FROM track_metrics_fact"), [(1,)])
@@ -0,0 +1,42 @@
+import os
+import threading
+import unittest
+
+import dw_test_case  # noqa: F401 => puts 'plugins' + 'benchmarks' on the path
+from mock_spotify import MockCatalog, start_mock_server
+
+
+class TokenRefreshTests(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+
+        cls.server, base_url = start_mock_server(MockCatalog(playlists=1, tracks_per_playlist=1))
+        os.environ.update({"SPOTIFY_ACCOUNTS_URL": base_url, "SPOTIFY_API_URL": base_url})
+
+    @classmethod
+    def tearDownClass(cls):
+
+        cls.server.shutdown()
+
+    def test_threads_sharing_a_client_refresh_the_token_once(self):
+
+        from spot_api import SpotifyAPI
+
+        client = SpotifyAPI("test", "test", request_pause=0)
+        client.token_expires_at = 0  # the token expired while the client sat in a cache
+        barrier = threading.Barrier(8)
+
+        def request():
+            barrier.wait()
+            client.get_current_headers()
+
+        threads = [threading.Thread(target=request) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        token_requests = client.metrics.counters[("api_requests_total", (("endpoint", "token"), ("status", 200)))]
+        self.assertEqual(token_requests, 2)  # the client's first token + one refresh
+        self.assertEqual(client.headers, {"Authorization": "Bearer mock-token"})
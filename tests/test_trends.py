@@ -0,0 +1,66 @@
+from decimal import Decimal
+from unittest import mock
+
+from dw_test_case import WarehouseTestCase
+
+
+class ComputeTrendsTests(WarehouseTestCase):
+
+    def setUp(self):
+
+        super().setUp()
+        self.track_ids, self.artist_id = self.add_tracks(["A", "A", "B"])
+        self.playlist_id = self.add_playlists(1)[0]
+
+    def load_snapshot(self, date_id, popularities, followers):
+
+        self.dw.update_fact_tables([(track_id, date_id, pop) for track_id, pop in zip(self.track_ids, popularities)],
+                                   [(self.artist_id, date_id, 50, followers)],
+                                   [(self.track_ids[0], self.artist_id)],
+                                   [(track_id, self.playlist_id, date_id, position, 50)
+                                    for position, track_id in enumerate(self.track_ids, 1)],
+                                   change_only=False)
+
+    def test_label_zscore_is_part_of_the_track_score(self):
+
+        self.load_snapshot("20240903", [50, 50, 50], 100)
+        self.load_snapshot("20240910", [60, 50, 55], 100)  # label A: +10 / +0, label B: +5
+
+        self.dw.compute_trends(self.run_date)
+
+        # market z-scores 1 / -1 / 0, label z-scores 0.707 / -0.707 / NULL (only track of its label)
+        self.assertEqual(self.query("""SELECT label_zscore, trend_score, trend_rank FROM track_trend
+                                       ORDER BY track_id"""),
+                         [(Decimal("0.707"), Decimal("1.707"), 1),
+                          (Decimal("-0.707"), Decimal("-1.707"), 3),
+                          (None, Decimal("0.000"), 2)])
+
+    def test_backfill_during_the_week_keeps_the_weekly_comparison(self):
+
+        self.load_snapshot("20240903", [50, 50, 50], 100)
+        backfilled_playlist = self.query("""INSERT INTO playlist_dim (playlist_spotify_id, playlist_name)
+                                            VALUES ('backfilled', 'Backfilled') RETURNING playlist_id""")[0][0]
+        job_id = self.query("INSERT INTO playlist_backfill_job (playlist_id) VALUES (%s) RETURNING job_id",
+                            (backfilled_playlist,))[0][0]
+        placement = (self.track_ids[0], backfilled_playlist, "20240903", 1, 50)
+        with mock.patch.object(self.dw, "extract_playlists_data", return_value=([], [], [], [])), \
+                mock.patch.object(self.dw, "organize_facts", return_value=([], [], [], [placement])):
+            self.dw.backfill_playlist(job_id, "backfilled")
+        self.load_snapshot("20240910", [60, 50, 55], 100)  # the 1st track has since left the backfilled playlist
+
+        self.dw.compute_trends(self.run_date)
+
+        self.assertEqual(self.query("SELECT date_id FROM fact_snapshot ORDER BY date_id"),
+                         [("20240903",), ("20240910",)])
+        self.assertEqual(self.query("""SELECT popularity_delta, playlist_add_velocity FROM track_trend
+                                       ORDER BY track_id"""), [(10, -1), (0, 0), (5, 0)])
+
+    def test_huge_follower_growth_is_stored(self):
+
+        self.load_snapshot("20240903", [50, 50, 50], 1)
+        self.load_snapshot("20240910", [50, 50, 50], 10_000_000)
+
+        self.dw.compute_trends(self.run_date)
+
+        self.assertEqual(self.query("SELECT follower_growth_rate FROM artist_trend"), [(Decimal("9999999.00000"),)])
+        self.assertEqual(self.query("SELECT count(*) FROM track_trend"), [(3,)])